@@ -0,0 +1,76 @@
+from bisect import bisect_right
+
+# Roll animation, computed in one go when a roll starts.
+#
+# Frames come quickly at first and slow down towards the end; the last frame,
+# shown at exactly the roll duration, is the result, which is drawn up front.
+# Playback asks for the frame due at the elapsed time, so a late tick skips
+# frames instead of stretching the animation.
+
+
+# Milliseconds between frames at the start and at the end of a roll
+MIN_FRAME_INTERVAL = 50
+MAX_FRAME_INTERVAL = 400
+
+
+def frame_times(duration, min_interval=MIN_FRAME_INTERVAL, max_interval=MAX_FRAME_INTERVAL):
+    # Start times (ms) of the frames. The interval grows with the square of the
+    # progress (an ease-out), and the last time is always the duration itself.
+    times = []
+    time = 0.0
+    while time < duration - min_interval:
+        times.append(int(time))
+        progress = time / duration
+        time += min_interval + (max_interval - min_interval) * progress * progress
+    times.append(duration)
+    return times
+
+
+class RollAnimation:
+    def __init__(self, frames, result, picks=1):
+        self.frames = frames  # [(time_ms, text), ...], the last one shows the result
+        self.times = [time for time, _ in frames]
+        self.result = result
+        self.picks = picks
+        self.shown = -1  # Index of the frame on screen
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return self.times[-1]
+
+    @property
+    def finished(self):
+        return self.shown == len(self.frames) - 1
+
+    def frame_at(self, elapsed):
+        # Text of the frame due at elapsed ms, or None if it is already on screen
+        index = bisect_right(self.times, elapsed) - 1
+        if index <= self.shown:
+            return None
+        self.skipped += index - self.shown - 1
+        self.shown = index
+        return self.frames[index][1]
+
+
+def build_animation(decision_list, duration, picks, result_rng, animation_rng):
+    # The result and the frames before it come from separate streams, so the
+    # result does not depend on the duration or the number of frames
+    times = frame_times(duration)
+    shuffles = len(times) - 1
+    # The frames before the result are only for show: one batch of draws with
+    # replacement, rather than an O(n) distinct draw per frame
+    indices = decision_list.draw_indices(shuffles * picks, animation_rng).tolist()
+    options = [decision_list.option(index) for index in indices]
+    if picks > 1:
+        result = decision_list.draw_distinct(picks, result_rng)
+        texts = [", ".join(options[start:start + picks]) for start in range(0, len(options), picks)]
+        texts.append(", ".join(result))
+    else:
+        result = decision_list.draw_one(result_rng)
+        texts = options
+        texts.append(result)
+    return RollAnimation(list(zip(times, texts)), result, picks)
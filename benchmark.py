@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import itertools
+import subprocess
+
+import numpy as np
+
+import decision_core
+from decision_core import DecisionList
+from list_cache import list_cache
+from option_store import ALPHABETICAL, WEIGHT
+
+# Benchmarks for the paths that matter to the app: list I/O, compiling and
+# rolling a list, and the main window's per-tick, load, save and re-sort work.
+#
+# Results are written as JSON so runs from different versions can be compared:
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+#
+# The GUI benchmarks run offscreen; they are skipped if PyQt5 is missing.
+
+
+DEFAULT_SIZES = [10, 1_000, 100_000, 1_000_000]
+# An OptionStore of 10^7 options needs several GB, so the GUI stops earlier by default
+DEFAULT_GUI_MAX_SIZE = 1_000_000
+# Draws per call in the bulk draw benchmark
+BULK_DRAWS = 1_000_000
+# Every measurement repeats until it has run this long (or MAX_REPEATS times)
+MIN_TIME = 0.5
+MIN_REPEATS = 3
+MAX_REPEATS = 1000
+RESULTS_VERSION = 1
+
+
+def synthetic_list(size, seed=0):
+    # Zipf-like weights: a few heavy options and a long tail of weight 1,
+    # in shuffled order so nothing benefits from the options being pre-sorted
+    rng = np.random.default_rng(seed)
+    ranks = rng.permutation(size) + 1
+    weights = np.maximum(1, (1_000_000 / ranks ** 1.2).astype(np.int64))
+    return [(f"option {i}", weight) for i, weight in enumerate(weights.tolist())]
+
+
+def percentile_ms(times, q):
+    return float(np.percentile(times, q) * 1000)
+
+
+def measure(function, setup=None, min_time=MIN_TIME, max_repeats=MAX_REPEATS):
+    # Returns the wall time of each call; setup runs before every call, untimed
+    times = []
+    started = time.perf_counter()
+    while len(times) < MIN_REPEATS or (time.perf_counter() - started < min_time and len(times) < max_repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_memory(function, setup=None):
+    # Peak Python-heap (and NumPy) allocation of one call, on top of what already exists
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(name, size, function, setup=None, items=1, unit='calls', max_repeats=MAX_REPEATS):
+    # items is how many units one call processes, e.g. the options in the list
+    times = measure(function, setup, max_repeats=max_repeats)
+    result = {
+        'benchmark': name,
+        'size': size,
+        'repeats': len(times),
+        'throughput': items / float(np.median(times)),
+        'unit': f'{unit}/s',
+        'latency_ms': {
+            'p50': percentile_ms(times, 50),
+            'p90': percentile_ms(times, 90),
+            'p99': percentile_ms(times, 99),
+            'max': max(times) * 1000,
+        },
+        'peak_memory_bytes': peak_memory(function, setup),
+    }
+    print(f"{name:<30}{size:>10}  p50 {result['latency_ms']['p50']:10.3f} ms  "
+          f"p99 {result['latency_ms']['p99']:10.3f} ms  {result['throughput']:14.1f} {result['unit']:<13}"
+          f"{result['peak_memory_bytes'] / 1024 / 1024:9.1f} MB", file=sys.stderr)
+    return result
+
+
+def core_benchmarks(size, lists_directory):
+    name = f'bench_{size}'
+    options = synthetic_list(size)
+    decision_core.write_list(name, options, lists_directory)
+    decision_list = DecisionList(options)
+    return [
+        run_case('write_list', size, lambda: decision_core.write_list(name, options, lists_directory),
+                 items=size, unit='options'),
+        run_case('read_list', size, lambda: decision_core.read_list(name, lists_directory),
+                 items=size, unit='options'),
+        run_case('compile', size, lambda: DecisionList(options), items=size, unit='options'),
+        run_case('draw_one', size, decision_list.draw_one, unit='draws'),
+        run_case('draw_bulk', size, lambda: decision_list.draw_indices(BULK_DRAWS), items=BULK_DRAWS, unit='draws'),
+    ]
+
+
+def gui_benchmarks(size, app):
+    import main
+
+    name = f'bench_{size}'
+    window = main.DecisionMaker9000()
+    window.show()
+    # Settings and the list catalog load after the first paint
+    while 'ready' not in window.startup_marks:
+        app.processEvents()
+
+    def process_events():
+        app.processEvents()
+
+    def load():
+        window.load_options(name)
+        while window.loader is not None:
+            app.processEvents()
+        process_events()
+
+    def set_sort_order(sort_order):
+        window.sort_order = sort_order
+        window.refresh_options_list()
+        process_events()
+
+    def resort():
+        # Alternate, so every call really changes the order
+        set_sort_order(WEIGHT if window.sort_order == ALPHABETICAL else ALPHABETICAL)
+
+    def start_roll():
+        window.start_decision_process()
+
+    def stop_roll():
+        window.timer.stop()
+        window.animation = None
+
+    def forget_saved_list():
+        # The next save writes the whole list again
+        window.saved_list = None
+
+    edit_weights = itertools.count(2)
+
+    def edit_one_option():
+        # The next save appends this one change to the journal. A compaction
+        # that finished must be picked up first, or the save writes it all.
+        while window.compactor is not None:
+            app.processEvents()
+        window.options.set_weight(0, next(edit_weights))
+
+    # Long enough that no measured tick reaches the end of a roll
+    window.duration = 60_000
+    slow_repeats = 20 if size >= 100_000 else MAX_REPEATS
+    results = [
+        run_case('load_options', size, load, setup=list_cache.clear, items=size, unit='options',
+                 max_repeats=slow_repeats),
+        run_case('load_options_cached', size, load, items=size, unit='options', max_repeats=slow_repeats),
+        run_case('fetch_list_data', size, lambda: list_cache.options(name, window.store),
+                 setup=list_cache.clear, items=size, unit='options', max_repeats=slow_repeats),
+        run_case('start_decision_process', size, start_roll, unit='rolls'),
+        run_case('update_display', size, window.update_display, unit='ticks'),
+    ]
+    # Rolls of a list that was edited after loading use the store's live sampler
+    window.options.add('edited', 1)
+    window.invalidate_sampler()
+    results.append(run_case('start_decision_process_edited', size, start_roll, unit='rolls'))
+    stop_roll()
+    results.append(run_case('refresh_options_list', size, resort, items=size, unit='options',
+                            max_repeats=slow_repeats))
+    results.append(run_case('save_options', size, lambda: window.write_options(name), setup=forget_saved_list,
+                            items=size + 1, unit='options', max_repeats=slow_repeats))
+    results.append(run_case('save_options_journal', size, lambda: window.write_options(name),
+                            setup=edit_one_option, unit='saves'))
+    window.close()
+    window.deleteLater()
+    process_events()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    # Prints how each benchmark's median latency changed since the baseline run
+    previous = {(result['benchmark'], result['size']): result for result in baseline['results']}
+    print(f"{'benchmark':<30}{'size':>10}{'before ms':>14}{'after ms':>14}{'change':>10}")
+    for result in results:
+        old = previous.get((result['benchmark'], result['size']))
+        if old is None:
+            continue
+        before = old['latency_ms']['p50']
+        after = result['latency_ms']['p50']
+        change = (after - before) / before if before else 0.0
+        print(f"{result['benchmark']:<30}{result['size']:>10}{before:14.3f}{after:14.3f}{change:+10.1%}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark list I/O, sampling and the main window.')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='Comma separated list sizes (default: %(default)s)')
+    parser.add_argument('--gui-max-size', type=int, default=DEFAULT_GUI_MAX_SIZE,
+                        help='Largest size for the GUI benchmarks (default: %(default)s)')
+    parser.add_argument('--no-gui', action='store_true', help='Only run the benchmarks that do not need Qt')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--compare', metavar='FILE', help='Results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+    try:
+        args.sizes = [int(size) for size in args.sizes.split(',')]
+    except ValueError:
+        parser.error('--sizes must be comma separated integers')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_directory = tempfile.mkdtemp(prefix='dm9k-bench-')
+    original_directory = os.getcwd()
+    app = None
+    if not args.no_gui:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        try:
+            from PyQt5.QtWidgets import QApplication
+            app = QApplication.instance() or QApplication([])
+        except ImportError:
+            print("PyQt5 is not installed, skipping the GUI benchmarks", file=sys.stderr)
+
+    results = []
+    try:
+        # The main window keeps its lists and settings in the working directory
+        os.chdir(work_directory)
+        lists_directory = decision_core.DEFAULT_LISTS_DIRECTORY
+        os.makedirs(lists_directory, exist_ok=True)
+        with open('settings.json', 'w') as file:
+            json.dump({'duration': 1, 'theme': 'Dark', 'sort_order': 'Alphabetical', 'font_size': 14}, file)
+        for size in args.sizes:
+            results.extend(core_benchmarks(size, lists_directory))
+            if app is not None and size <= args.gui_max_size:
+                results.extend(gui_benchmarks(size, app))
+            list_cache.clear()
+    finally:
+        os.chdir(original_directory)
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(results, json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+import os
+import sys
+import mmap
+import json
+import struct
+import argparse
+
+from sampling import draw_cumulative_indices
+from journal import read_journal, remove_journal, replay
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Compact binary list format (.dmb), opened with mmap.
+#
+# Layout (little endian, every section starts on an 8 byte boundary):
+#   header      magic, version, weight kind, option count, text size
+#   offsets     uint64[count + 1]   start of each option in the text section
+#   weights     int64/float64[count]
+#   cumulative  int64/float64[count]
+#   int mask    uint8[count]        only for WEIGHTS_MIXED: 1 where the JSON weight was an int
+#   int weights int64[count]        only for WEIGHTS_MIXED: the exact weight where the mask is 1,
+#                                   as float64 loses ints above 2**53 (new in version 2)
+#   text        UTF-8 option text, concatenated
+
+
+BINARY_EXTENSION = '.dmb'
+MAGIC = b'DM9KLIST'
+VERSION = 2
+READABLE_VERSIONS = (1, 2)  # Version 1 has no int weights section
+HEADER = struct.Struct('<8sIIQQ')
+HEADER_SIZE = 64
+
+WEIGHTS_INT = 0
+WEIGHTS_FLOAT = 1
+WEIGHTS_MIXED = 2
+
+INT64_MAX = (1 << 63) - 1
+
+
+def padded(size):
+    return (size + 7) & ~7
+
+
+def section_offsets(count, weight_kind, version=VERSION):
+    offsets_start = HEADER_SIZE
+    weights_start = offsets_start + padded(8 * (count + 1))
+    cumulative_start = weights_start + 8 * count
+    mask_start = cumulative_start + 8 * count
+    mask_size = count if weight_kind == WEIGHTS_MIXED else 0
+    ints_start = mask_start + padded(mask_size)
+    ints_size = 8 * count if weight_kind == WEIGHTS_MIXED and version >= 2 else 0
+    text_start = ints_start + ints_size
+    return offsets_start, weights_start, cumulative_start, mask_start, ints_start, text_start
+
+
+def write_binary_list(path, weighted_options):
+    labels = []
+    weights = []
+    for option, weight in weighted_options:
+        if not isinstance(option, str):
+            raise ValueError(f"Binary lists only hold text options, got {option!r}")
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+            raise ValueError(f"Invalid weight {weight!r} for option {option!r}")
+        labels.append(option.encode('utf-8'))
+        weights.append(weight)
+
+    int_mask = np.array([isinstance(weight, int) for weight in weights], dtype=np.uint8)
+    if any(isinstance(weight, int) and weight > INT64_MAX for weight in weights):
+        raise ValueError(f"Binary lists only hold integer weights up to {INT64_MAX}")
+    if int_mask.all():
+        if sum(weights) > INT64_MAX:
+            raise ValueError(f"Binary lists only hold integer weights that add up to at most {INT64_MAX}")
+        weight_kind, dtype = WEIGHTS_INT, np.int64
+    elif not int_mask.any():
+        weight_kind, dtype = WEIGHTS_FLOAT, np.float64
+    else:
+        weight_kind, dtype = WEIGHTS_MIXED, np.float64
+
+    count = len(labels)
+    weight_array = np.array(weights, dtype=dtype).reshape(count)
+    if (weight_array < 0).any():
+        raise ValueError("Option weights must not be negative")
+    text_offsets = np.zeros(count + 1, dtype=np.uint64)
+    np.cumsum([len(label) for label in labels], out=text_offsets[1:])
+    text = b''.join(labels)
+
+    offsets_start, weights_start, cumulative_start, mask_start, ints_start, text_start = section_offsets(
+        count, weight_kind)
+    # Write next to the target and rename, so readers never see a half-written file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, weight_kind, count, len(text)).ljust(HEADER_SIZE, b'\0'))
+        file.write(text_offsets.astype('<u8').tobytes().ljust(weights_start - offsets_start, b'\0'))
+        file.write(weight_array.astype(weight_array.dtype.newbyteorder('<')).tobytes())
+        file.write(np.cumsum(weight_array).astype(weight_array.dtype.newbyteorder('<')).tobytes())
+        if weight_kind == WEIGHTS_MIXED:
+            file.write(int_mask.tobytes().ljust(ints_start - mask_start, b'\0'))
+            int_weights = [weight if is_int else 0 for weight, is_int in zip(weights, int_mask.tolist())]
+            file.write(np.array(int_weights, dtype='<i8').reshape(count).tobytes())
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+class BinaryList:
+    # Read-only view of a .dmb file. Draws search the mapped cumulative weights
+    # directly; option text is only decoded for the options that are picked.
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError(f"{path} is not a DecisionMaker9000 binary list")
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.weight_kind, count, text_size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a DecisionMaker9000 binary list")
+        if version not in READABLE_VERSIONS:
+            raise ValueError(f"{path} uses unsupported binary list version {version}")
+
+        offsets_start, weights_start, cumulative_start, mask_start, ints_start, text_start = section_offsets(
+            count, self.weight_kind, version)
+        dtype = np.dtype('<i8') if self.weight_kind == WEIGHTS_INT else np.dtype('<f8')
+        self.count = count
+        self.text_offsets = np.frombuffer(self.buffer, dtype='<u8', count=count + 1, offset=offsets_start)
+        self.weights = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=weights_start)
+        self.cumulative = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=cumulative_start)
+        self.int_mask = None
+        self.int_weights = None
+        if self.weight_kind == WEIGHTS_MIXED:
+            self.int_mask = np.frombuffer(self.buffer, dtype=np.uint8, count=count, offset=mask_start)
+            if version >= 2:
+                self.int_weights = np.frombuffer(self.buffer, dtype='<i8', count=count, offset=ints_start)
+            else:
+                self.int_weights = self.weights
+        self.text = memoryview(self.buffer)[text_start:text_start + text_size]
+        self.total = self.cumulative[-1] if count else 0
+
+    def __len__(self):
+        return self.count if self.total > 0 else 0
+
+    def option(self, index):
+        return str(self.text[int(self.text_offsets[index]):int(self.text_offsets[index + 1])], 'utf-8')
+
+    def weight(self, index):
+        if self.weight_kind == WEIGHTS_INT:
+            return int(self.weights[index])
+        if self.int_mask is not None and self.int_mask[index]:
+            return int(self.int_weights[index])
+        return self.weights[index].item()
+
+    def labels(self):
+        labels = np.empty(self.count, dtype=object)
+        labels[:] = [self.option(i) for i in range(self.count)]
+        return labels
+
+    def to_pairs(self):
+        return self.pairs_range(0, self.count)
+
+    def pairs_range(self, start, stop):
+        weights = self.weights[start:stop].tolist()
+        if self.weight_kind == WEIGHTS_MIXED:
+            int_mask = self.int_mask[start:stop].tolist()
+            int_weights = self.int_weights[start:stop].tolist()
+            weights = [int(exact) if is_int else w for w, exact, is_int in zip(weights, int_weights, int_mask)]
+        return [(self.option(i), weight) for i, weight in zip(range(start, stop), weights)]
+
+    def memory_usage(self):
+        # The mapped pages belong to the OS page cache, not to the process heap
+        return HEADER_SIZE
+
+    def draw_indices(self, k, rng=None):
+        return draw_cumulative_indices(self.cumulative, k, rng)
+
+    def draw(self, k=1, rng=None):
+        picks = np.empty(k if len(self) else 0, dtype=object)
+        if not len(self):
+            return picks
+        indices = self.draw_indices(k, rng)
+        # Decode each distinct pick once
+        unique, inverse = np.unique(indices, return_inverse=True)
+        decoded = np.empty(len(unique), dtype=object)
+        decoded[:] = [self.option(i) for i in unique.tolist()]
+        picks[:] = decoded[inverse]
+        return picks
+
+    def draw_one(self, rng=None):
+        if not len(self):
+            return None
+        return self.option(self.draw_indices(1, rng)[0])
+
+
+def open_binary_list(path):
+    return BinaryList(path)
+
+
+def with_journal(path, pairs):
+    # Changes still in the journal are carried over to the converted list
+    changes = read_journal(path)
+    return replay(pairs, changes) if changes else pairs
+
+
+def json_to_binary(json_path, binary_path):
+    with open(json_path, 'r') as file:
+        pairs = [(item[0], item[1]) for item in json.load(file)]
+    write_binary_list(binary_path, with_journal(json_path, pairs))
+    remove_journal(binary_path)
+
+
+def binary_to_json(binary_path, json_path):
+    pairs = with_journal(binary_path, open_binary_list(binary_path).to_pairs())
+    with open(json_path, 'w') as file:
+        json.dump(pairs, file)
+    remove_journal(json_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert saved lists between JSON and the binary .dmb format.')
+    parser.add_argument('direction', choices=['to-binary', 'to-json'])
+    parser.add_argument('list_name')
+    parser.add_argument('--lists-directory', default='lists')
+    parser.add_argument('--remove-source', action='store_true', help='Delete the original file after converting')
+    args = parser.parse_args(argv)
+
+    json_path = os.path.join(args.lists_directory, f"{args.list_name}.json")
+    binary_path = os.path.join(args.lists_directory, f"{args.list_name}{BINARY_EXTENSION}")
+    if args.direction == 'to-binary':
+        source = json_path
+        json_to_binary(json_path, binary_path)
+    else:
+        source = binary_path
+        binary_to_json(binary_path, json_path)
+    if args.remove_source:
+        os.remove(source)
+        remove_journal(source)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
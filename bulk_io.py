@@ -0,0 +1,201 @@
+import io
+import os
+import csv
+import sys
+import math
+import argparse
+
+import decision_core
+from list_store import as_list_store
+
+# Streaming import and export of options as CSV, TSV or plain text.
+#
+# CSV and TSV rows are "option,weight" (the weight may be left out and then
+# counts as 1); an optional header row is skipped. Plain text is one option
+# per line with weight 1. Files are read a row at a time, and options that
+# appear more than once are merged into one entry whose weight is the sum, so
+# memory grows with the number of different options, not with the file.
+# Exports write the options a chunk at a time as they are iterated.
+#
+#   python bulk_io.py import options.csv my_list [--merge]
+#   python bulk_io.py export my_list options.tsv
+
+
+FORMATS = ('csv', 'tsv', 'text')
+EXTENSION_FORMATS = {'.csv': 'csv', '.tsv': 'tsv', '.tab': 'tsv'}
+# Rows read between progress reports, and rows written per write call
+CHUNK_SIZE = 50_000
+
+
+def detect_format(path):
+    return EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower(), 'text')
+
+
+def parse_weight(text):
+    # Whole numbers stay ints, like the weights the app saves
+    try:
+        weight = int(text)
+    except ValueError:
+        weight = float(text)
+    if not math.isfinite(weight) or weight <= 0:
+        raise ValueError(f"weight must be a positive number, not {text!r}")
+    return weight
+
+
+def iter_rows(file, fmt):
+    # Yields (line number, option, weight text or None) for every non-blank row
+    if fmt == 'text':
+        for line_number, line in enumerate(file, 1):
+            option = line.strip()
+            if option:
+                yield line_number, option, None
+        return
+    reader = csv.reader(file, delimiter='\t' if fmt == 'tsv' else ',')
+    for row in reader:
+        if not row or not row[0].strip():
+            continue
+        yield reader.line_num, row[0].strip(), row[1].strip() if len(row) > 1 and row[1].strip() else None
+
+
+class ImportResult:
+    def __init__(self):
+        self.weights = {}  # option -> summed weight, in first-seen order
+        self.rows = 0
+        self.skipped = []  # (line number, reason) of rows that were not imported
+
+    @property
+    def merged(self):
+        # Rows that went into an option seen before
+        return self.rows - len(self.weights)
+
+    def pairs(self):
+        return list(self.weights.items())
+
+
+def read_options(path, fmt=None, progress=None, cancelled=None):
+    # Reads and merges every row of path. progress(fraction) is called after
+    # every CHUNK_SIZE rows; cancelled() returning True stops the read (and
+    # returns None).
+    fmt = fmt or detect_format(path)
+    result = ImportResult()
+    weights = result.weights
+    size = max(os.path.getsize(path), 1)
+    with open(path, 'rb') as raw:
+        # utf-8-sig: spreadsheet exports often start with a byte order mark
+        file = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        for line_number, option, weight_text in iter_rows(file, fmt):
+            if weight_text is None:
+                weight = 1
+            else:
+                try:
+                    weight = parse_weight(weight_text)
+                except ValueError as error:
+                    if line_number == 1:
+                        continue  # A header row
+                    result.skipped.append((line_number, str(error)))
+                    continue
+            result.rows += 1
+            weights[option] = weights.get(option, 0) + weight
+            if result.rows % CHUNK_SIZE == 0:
+                if cancelled is not None and cancelled():
+                    return None
+                if progress is not None:
+                    progress(min(raw.tell() / size, 1.0))
+    return result
+
+
+def merge_weights(pairs, weights):
+    # Merges summed weights into [(option, weight), ...]: an option that is
+    # already there gets the weight added to its first entry. Returns the merged
+    # pairs, [(option, old weight, new weight), ...] for the options that were
+    # there and [(option, weight), ...] for the new ones.
+    weights = dict(weights)
+    merged = []
+    reweighted = []
+    for option, weight in pairs:
+        extra = weights.pop(option, None)
+        if extra is not None:
+            reweighted.append((option, weight, weight + extra))
+            weight += extra
+        merged.append((option, weight))
+    added = list(weights.items())
+    merged.extend(added)
+    return merged, reweighted, added
+
+
+def write_options(path, pairs, fmt=None):
+    # Streams (option, weight) pairs to path; plain text keeps only the options
+    fmt = fmt or detect_format(path)
+    temp_path = path + '.tmp'
+    written = 0
+    with open(temp_path, 'w', encoding='utf-8', newline='') as file:
+        if fmt == 'text':
+            writer = None
+        else:
+            writer = csv.writer(file, delimiter='\t' if fmt == 'tsv' else ',', lineterminator='\n')
+        chunk = []
+        for pair in pairs:
+            chunk.append(pair)
+            if len(chunk) == CHUNK_SIZE:
+                write_chunk(file, writer, chunk)
+                written += len(chunk)
+                chunk = []
+        write_chunk(file, writer, chunk)
+        written += len(chunk)
+    os.replace(temp_path, path)
+    return written
+
+
+def write_chunk(file, writer, chunk):
+    if writer is None:
+        file.write(''.join(f"{option}\n" for option, _ in chunk))
+    else:
+        writer.writerows(chunk)
+
+
+def iter_saved_options(list_name, store):
+    for chunk, _ in store.iter_chunks(list_name):
+        yield from chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import options from, or export them to, CSV, TSV or text files.')
+    parser.add_argument('--lists-directory', default=decision_core.DEFAULT_LISTS_DIRECTORY)
+    parser.add_argument('--format', choices=FORMATS, help='File format (default: from the file extension)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='Save the options of a file as a list')
+    import_parser.add_argument('file')
+    import_parser.add_argument('list_name')
+    import_parser.add_argument('--merge', action='store_true', help='Merge into the list if it exists')
+    export_parser = commands.add_parser('export', help='Write the options of a list to a file')
+    export_parser.add_argument('list_name')
+    export_parser.add_argument('file')
+    args = parser.parse_args(argv)
+
+    store = as_list_store(args.lists_directory)
+    store.prepare()
+    if args.command == 'export':
+        if not store.exists(args.list_name):
+            print(f'List "{args.list_name}" not found.', file=sys.stderr)
+            return 1
+        count = write_options(args.file, iter_saved_options(args.list_name, store), args.format)
+        print(f"Exported {count} options to {args.file}", file=sys.stderr)
+        return 0
+
+    result = read_options(args.file, args.format)
+    for line_number, reason in result.skipped:
+        print(f"{args.file}:{line_number}: skipped, {reason}", file=sys.stderr)
+    pairs = result.pairs()
+    if args.merge and store.exists(args.list_name):
+        pairs, _, _ = merge_weights(store.read(args.list_name), result.weights)
+    elif store.exists(args.list_name):
+        print(f'List "{args.list_name}" already exists; use --merge to add to it.', file=sys.stderr)
+        return 1
+    store.write(args.list_name, pairs)
+    print(f"Imported {result.rows} rows as {len(result.weights)} options ({result.merged} merged) "
+          f"into {args.list_name}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
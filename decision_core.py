@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+
+from sampling import AliasSampler, sample_without_replacement
+from binary_lists import BINARY_EXTENSION, open_binary_list, write_binary_list
+from instrumentation import timed
+from journal import (journal_path, lock_for, read_journal, append_changes, remove_journal, replay,
+                     snapshot_base, write_journal, JOURNAL_VERSION)
+
+# Qt-free list handling shared by the GUI and scripts
+
+
+DEFAULT_LISTS_DIRECTORY = 'lists'
+LIST_EXTENSIONS = ('.json', BINARY_EXTENSION)
+
+# Streaming loads read the file in blocks of this many characters and hand
+# options over in chunks of LOAD_CHUNK_SIZE
+JSON_BLOCK_SIZE = 1 << 20
+LOAD_CHUNK_SIZE = 20000
+
+# Rough per-option overhead of a materialized (option, weight) pair and its list slot
+PAIR_OVERHEAD_BYTES = 56 + 32 + 8
+
+
+def list_path(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    return os.path.join(lists_directory, f"{list_name}.json")
+
+
+def binary_list_path(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    return os.path.join(lists_directory, f"{list_name}{BINARY_EXTENSION}")
+
+
+def find_list_path(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    # A binary copy of a list takes precedence over its JSON file
+    binary_path = binary_list_path(list_name, lists_directory)
+    if os.path.exists(binary_path):
+        return binary_path
+    return list_path(list_name, lists_directory)
+
+
+def is_binary_path(path):
+    return path.endswith(BINARY_EXTENSION)
+
+
+def get_saved_lists(lists_directory=DEFAULT_LISTS_DIRECTORY):
+    names = {}
+    for file in os.listdir(lists_directory):
+        name, extension = os.path.splitext(file)
+        if extension in LIST_EXTENSIONS:
+            names[name] = None
+    return list(names)
+
+
+@timed('list.read')
+def read_list(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    # Returns the [(option, weight), ...] pairs of a saved list, or [] if it does not exist
+    path = find_list_path(list_name, lists_directory)
+    try:
+        pairs = read_snapshot(path)
+        changes = read_journal(path)
+    except FileNotFoundError:
+        return []
+    if changes:
+        pairs = replay(pairs, changes)
+    return pairs
+
+
+def read_snapshot(path):
+    # The list file alone, without its journal
+    if is_binary_path(path):
+        return open_binary_list(path).to_pairs()
+    with open(path, 'r') as file:
+        return [(item[0], item[1]) for item in json.load(file)]
+
+
+def iter_json_array(file, block_size=JSON_BLOCK_SIZE):
+    # Yields (item, characters consumed) for each element of a top-level JSON
+    # array, reading the file a block at a time instead of all at once
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    consumed = 0
+    eof = False
+    started = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer) or (started and buffer[position] != ']' and not eof and len(buffer) - position < block_size):
+            # Keep at least a block of lookahead so items are never split across reads
+            if not eof:
+                block = file.read(block_size)
+                eof = not block
+                consumed += position
+                buffer = buffer[position:] + block
+                position = 0
+                continue
+            if position == len(buffer):
+                raise ValueError("Unexpected end of list file")
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError("A list file must contain a JSON array")
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # An item longer than the lookahead; read more and try again
+            block = file.read(block_size)
+            eof = not block
+            buffer += block
+            continue
+        position = end
+        yield item, consumed + position
+
+
+def iter_list_chunks(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY, chunk_size=LOAD_CHUNK_SIZE):
+    # Yields ([(option, weight), ...], fraction done) without holding the whole file as text
+    path = find_list_path(list_name, lists_directory)
+    if os.path.exists(journal_path(path)):
+        # Journal changes can touch any part of the list, so it is replayed as a whole
+        pairs = read_list(list_name, lists_directory)
+        for start in range(0, len(pairs), chunk_size):
+            stop = min(start + chunk_size, len(pairs))
+            yield pairs[start:stop], stop / len(pairs)
+        if not pairs:
+            yield [], 1.0
+        return
+    if is_binary_path(path):
+        binary_list = open_binary_list(path)
+        for start in range(0, binary_list.count, chunk_size):
+            stop = min(start + chunk_size, binary_list.count)
+            yield binary_list.pairs_range(start, stop), stop / binary_list.count
+        return
+
+    size = max(os.path.getsize(path), 1)
+    chunk = []
+    with open(path, 'r') as file:
+        for item, consumed in iter_json_array(file):
+            chunk.append((item[0], item[1]))
+            if len(chunk) >= chunk_size:
+                yield chunk, min(consumed / size, 1.0)
+                chunk = []
+    yield chunk, 1.0
+
+
+@timed('list.write')
+def write_list(list_name, options, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    # Lists keep the format they were saved in. A full save supersedes the journal.
+    path = find_list_path(list_name, lists_directory)
+    with lock_for(path):
+        write_snapshot(path, options, is_binary_path(path))
+        remove_journal(path)
+
+
+def write_snapshot(path, options, binary):
+    # Writes next to path and renames, so readers never see a half-written list
+    if binary:
+        write_binary_list(path, options)
+        return
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(options, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+@timed('list.append')
+def append_list_changes(list_name, changes, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    # Saves only what changed since the list was loaded or last saved, see journal.py
+    path = find_list_path(list_name, lists_directory)
+    with lock_for(path):
+        append_changes(path, changes)
+
+
+@timed('list.compact')
+def compact_list(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    # Folds the journal into a new snapshot; returns whether it did. Meant for a
+    # background thread: saves appended meanwhile move over to a fresh journal.
+    path = find_list_path(list_name, lists_directory)
+    journal = journal_path(path)
+    lock = lock_for(path)
+    with lock:
+        if not os.path.exists(journal):
+            return False
+        snapshot_stat = os.stat(path)
+        end = os.path.getsize(journal)
+    changes = read_journal(path, end)
+    if changes is None:
+        with lock:
+            # Stale: the snapshot was replaced after the journal was started
+            if os.stat(path).st_mtime_ns == snapshot_stat.st_mtime_ns and os.path.getsize(journal) == end:
+                remove_journal(path)
+        return False
+
+    temp_path = path + '.compact'
+    write_snapshot(temp_path, replay(read_snapshot(path), changes), is_binary_path(path))
+    header = json.dumps({'journal': JOURNAL_VERSION, 'base': snapshot_base(temp_path)}).encode('utf-8')
+    with lock:
+        if os.stat(path).st_mtime_ns != snapshot_stat.st_mtime_ns or not os.path.exists(journal):
+            os.remove(temp_path)  # A full save happened meanwhile
+            return False
+        with open(journal, 'rb') as file:
+            file.seek(end)
+            tail = file.read()
+        tail = tail[:tail.rfind(b'\n') + 1]
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            # e.g. the binary list is memory-mapped on Windows; try again later
+            os.remove(temp_path)
+            return False
+        if tail:
+            write_journal(journal, [header] + tail.rstrip(b'\n').split(b'\n'))
+        else:
+            remove_journal(path)
+    return True
+
+
+def delete_list(list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+    removed = False
+    for path in (binary_list_path(list_name, lists_directory), list_path(list_name, lists_directory)):
+        remove_journal(path)
+        if os.path.exists(path):
+            os.remove(path)
+            removed = True
+    if not removed:
+        raise FileNotFoundError(list_path(list_name, lists_directory))
+
+
+class DecisionList:
+    # A list of weighted options compiled for fast repeated draws
+    def __init__(self, weighted_options, name=None, sampler=None):
+        self.name = name
+        if sampler is None:
+            weighted_options = list(weighted_options)
+            sampler = AliasSampler(weighted_options)
+        self._options = weighted_options
+        self.sampler = sampler
+
+    @classmethod
+    def load(cls, list_name, lists_directory=DEFAULT_LISTS_DIRECTORY):
+        path = find_list_path(list_name, lists_directory)
+        if is_binary_path(path) and not os.path.exists(journal_path(path)):
+            # Memory-mapped: nothing is materialized until it is asked for
+            return cls(None, name=list_name, sampler=open_binary_list(path))
+        return cls(read_list(list_name, lists_directory), name=list_name)
+
+    @property
+    def options(self):
+        if self._options is None:
+            self._options = self.sampler.to_pairs()
+        return self._options
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def option(self, index):
+        return self.sampler.option(index)
+
+    def labels(self):
+        return self.sampler.labels()
+
+    def memory_usage(self):
+        usage = self.sampler.memory_usage()
+        if self._options is not None:
+            usage += PAIR_OVERHEAD_BYTES * len(self._options)
+            if not isinstance(self.sampler, AliasSampler):
+                usage += sum(sys.getsizeof(option) for option, _ in self._options)
+        return usage
+
+    def draw(self, k=1, rng=None):
+        # k picks in a single vectorized call, returned as a numpy object array
+        return self.sampler.draw(k, rng)
+
+    def draw_indices(self, k=1, rng=None):
+        return self.sampler.draw_indices(k, rng)
+
+    def draw_one(self, rng=None):
+        return self.sampler.draw_one(rng)
+
+    def draw_distinct_indices(self, k, rng=None):
+        # Up to k different options in one O(n) pass, weighted like repeated
+        # draws that skip options already picked
+        return sample_without_replacement(self.sampler.weights, k, rng)
+
+    def draw_distinct(self, k, rng=None):
+        return [self.option(index) for index in self.draw_distinct_indices(k, rng).tolist()]
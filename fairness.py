@@ -0,0 +1,273 @@
+import sys
+import math
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import decision_core
+from list_store import DEFAULT_STORAGE, DEFAULT_DATABASE, open_list_store
+from nested_lists import sampling_graphs
+from rng import RandomStreams, format_stream
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Monte Carlo check that a saved list rolls with the weights it was given.
+#
+# Draws `samples` picks in chunks, optionally spread over worker processes,
+# and only keeps a count per option, so memory depends on the size of the
+# list, not on the number of samples. Chunk i always comes from the random
+# stream ('verify', i), so a run gives the same counts however many processes
+# it uses. The counts are then compared with the expected probabilities
+# (for nested lists, the combined ones, see nested_lists.py) with a
+# chi-square test and the largest deviations.
+#
+#   python main.py --verify my_list --samples 1e9 --processes 8
+
+
+DEFAULT_SAMPLES = 10_000_000
+DEFAULT_CHUNK_SIZE = 1_000_000
+# The list passes if the chi-square test's p-value is at least this
+DEFAULT_ALPHA = 0.001
+# Options whose expected count is below this are pooled into one chi-square bin
+MIN_EXPECTED = 5
+# Options listed in the report, by how far they are from their expected count
+TOP_DEVIATIONS = 10
+# Chunks per worker task; more tasks than processes keeps them all busy to the end
+TASKS_PER_PROCESS = 4
+
+
+def count_chunk(counts, indices):
+    if len(counts) <= 4 * len(indices):
+        counts += np.bincount(indices, minlength=len(counts))
+    else:
+        # A bincount over a list much longer than the chunk would mostly add zeros
+        unique, unique_counts = np.unique(indices, return_counts=True)
+        counts[unique] += unique_counts
+
+
+def chunk_sizes(samples, chunk_size, first, last):
+    for chunk in range(first, last):
+        yield chunk, min(chunk_size, samples - chunk * chunk_size)
+
+
+def count_draws(decision_list, samples, chunk_size, seed, first, last):
+    # Counts per option of chunks first..last-1 of a run
+    streams = RandomStreams(seed)
+    counts = np.zeros(len(decision_list), dtype=np.int64)
+    for chunk, size in chunk_sizes(samples, chunk_size, first, last):
+        count_chunk(counts, decision_list.draw_indices(size, streams.stream('verify', chunk)))
+    return counts
+
+
+def resolve(list_name, storage):
+    store = open_list_store(storage, storage['lists_directory'])
+    signature = store.signature(list_name)
+    return store, signature, sampling_graphs.get(list_name, store)
+
+
+def count_task(list_name, storage, signature, samples, chunk_size, seed, first, last):
+    # Runs in a worker process, which loads the list itself
+    store, current, decision_list = resolve(list_name, storage)
+    if current != signature:
+        raise ValueError(f'List "{list_name}" changed while it was being verified')
+    return count_draws(decision_list, samples, chunk_size, seed, first, last)
+
+
+def expected_probabilities(decision_list):
+    weights = np.asarray(decision_list.sampler.weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def chi_square_sf(statistic, df):
+    # P(X >= statistic) for X ~ chi-square(df): the regularized upper incomplete
+    # gamma function Q(df / 2, statistic / 2), by its series below a + 1 and its
+    # continued fraction above (Numerical Recipes' gammq)
+    if df <= 0:
+        return 1.0
+    a, x = df / 2, statistic / 2
+    if x <= 0:
+        return 1.0
+    log_prefix = -x + a * math.log(x) - math.lgamma(a)
+    iterations = 100 + int(10 * math.sqrt(a))
+    if x < a + 1:
+        term = total = 1 / a
+        for n in range(1, iterations * 10):
+            term *= x / (a + n)
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for n in range(1, iterations * 10):
+        an = -n * (n - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
+
+def analyze(decision_list, counts, alpha=DEFAULT_ALPHA):
+    samples = int(counts.sum())
+    probabilities = expected_probabilities(decision_list)
+    expected = probabilities * samples
+    possible = expected > 0
+    unexpected = int(counts[~possible].sum())  # Picks of options that have no weight at all
+
+    # Chi-square over the options expected often enough, the rest pooled into one bin
+    large = expected >= MIN_EXPECTED
+    observed_bins = counts[large].astype(np.float64)
+    expected_bins = expected[large]
+    small = possible & ~large
+    if small.any():
+        observed_bins = np.append(observed_bins, counts[small].sum())
+        expected_bins = np.append(expected_bins, expected[small].sum())
+    statistic = float(((observed_bins - expected_bins) ** 2 / expected_bins).sum())
+    df = len(expected_bins) - 1
+    p_value = chi_square_sf(statistic, df)
+
+    frequencies = counts / samples
+    deviations = np.abs(frequencies - probabilities)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(possible, (counts - expected) / np.sqrt(expected * (1 - probabilities)), 0.0)
+    worst = np.argsort(-np.abs(z), kind='stable')[:TOP_DEVIATIONS]
+    largest = int(np.argmax(deviations))
+    return {
+        'samples': samples,
+        'options': len(counts),
+        'chi_square': statistic,
+        'degrees_of_freedom': df,
+        'p_value': p_value,
+        'pooled_options': int(small.sum()),
+        'max_abs_deviation': {
+            'option': str(decision_list.option(largest)),
+            'expected': float(probabilities[largest]),
+            'observed': float(frequencies[largest]),
+            'deviation': float(deviations[largest]),
+        },
+        'largest_z': [{'option': str(decision_list.option(index)), 'expected_count': float(expected[index]),
+                       'observed_count': int(counts[index]), 'z': float(z[index])} for index in worst.tolist()],
+        'unexpected_picks': unexpected,
+        'alpha': alpha,
+        'passed': p_value >= alpha and unexpected == 0,
+    }
+
+
+def verify(list_name, samples=DEFAULT_SAMPLES, chunk_size=DEFAULT_CHUNK_SIZE, processes=1, seed=None,
+           storage=None, alpha=DEFAULT_ALPHA, progress=None):
+    # Draws and checks, returns the report. storage: {'lists_directory', 'storage', 'database'}.
+    # progress(samples done), if given, is called as chunks finish.
+    storage = storage or {'lists_directory': decision_core.DEFAULT_LISTS_DIRECTORY}
+    store, signature, decision_list = resolve(list_name, storage)
+    if not decision_list:
+        raise ValueError(f'List "{list_name}" has no options to roll')
+    streams = RandomStreams(seed)
+    chunks = -(-samples // chunk_size)
+    start = time.perf_counter()
+    if processes <= 1:
+        counts = np.zeros(len(decision_list), dtype=np.int64)
+        done = 0
+        for chunk, size in chunk_sizes(samples, chunk_size, 0, chunks):
+            count_chunk(counts, decision_list.draw_indices(size, streams.stream('verify', chunk)))
+            done += size
+            if progress is not None:
+                progress(done)
+    else:
+        tasks = min(chunks, processes * TASKS_PER_PROCESS)
+        bounds = [chunks * task // tasks for task in range(tasks + 1)]
+        counts = np.zeros(len(decision_list), dtype=np.int64)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [(executor.submit(count_task, list_name, storage, signature, samples, chunk_size,
+                                        streams.seed, first, last), first, last)
+                       for first, last in zip(bounds, bounds[1:])]
+            done = 0
+            for future, first, last in futures:
+                counts += future.result()
+                done += sum(size for _, size in chunk_sizes(samples, chunk_size, first, last))
+                if progress is not None:
+                    progress(done)
+    elapsed = time.perf_counter() - start
+    if store.signature(list_name) != signature:
+        raise ValueError(f'List "{list_name}" changed while it was being verified')
+
+    report = {'list': list_name, 'seed': streams.seed, 'streams': format_stream(('verify', '<chunk>')),
+              'chunk_size': chunk_size, 'processes': processes}
+    report.update(analyze(decision_list, counts, alpha))
+    report['elapsed_s'] = elapsed
+    report['samples_per_s'] = samples / elapsed if elapsed else 0.0
+    return report
+
+
+def summary(report):
+    deviation = report['max_abs_deviation']
+    lines = [
+        f"{report['list']}: {report['samples']:,} samples over {report['options']:,} options "
+        f"in {report['elapsed_s']:.1f} s ({report['samples_per_s']:,.0f}/s)",
+        f"chi-square {report['chi_square']:.1f} with {report['degrees_of_freedom']:,} degrees of freedom, "
+        f"p = {report['p_value']:.4g}",
+        f"largest deviation: {deviation['option']!r} expected {deviation['expected']:.6g}, "
+        f"observed {deviation['observed']:.6g}",
+    ]
+    if report['unexpected_picks']:
+        lines.append(f"{report['unexpected_picks']} picks of options with no weight")
+    lines.append("PASS" if report['passed'] else f"FAIL (alpha {report['alpha']})")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='main.py --verify',
+                                     description='Check that a saved list rolls with the weights it was given.')
+    parser.add_argument('list_name')
+    parser.add_argument('-n', '--samples', type=lambda text: int(float(text)), default=DEFAULT_SAMPLES,
+                        help='Number of draws, e.g. 1e9 (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=lambda text: int(float(text)), default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('-p', '--processes', type=int, default=1, help='Worker processes (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed to replay a run (a new one is used if omitted)')
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA,
+                        help='Lowest chi-square p-value that passes (default: %(default)s)')
+    parser.add_argument('--lists-directory', default=decision_core.DEFAULT_LISTS_DIRECTORY)
+    parser.add_argument('--storage', choices=('files', 'sqlite'), default=DEFAULT_STORAGE)
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite database, with --storage sqlite')
+    parser.add_argument('-o', '--output', help='Write the JSON report here instead of to stdout')
+    args = parser.parse_args(argv)
+    if args.samples < 1 or args.chunk_size < 1 or args.processes < 1:
+        parser.error('--samples, --chunk-size and --processes must be positive')
+
+    storage = {'lists_directory': args.lists_directory, 'storage': args.storage, 'database': args.database}
+    last_report = [time.perf_counter()]
+
+    def progress(done):
+        now = time.perf_counter()
+        if now - last_report[0] >= 5 or done == args.samples:
+            print(f"{done:,} / {args.samples:,} samples", file=sys.stderr)
+            last_report[0] = now
+
+    try:
+        report = verify(args.list_name, args.samples, args.chunk_size, args.processes, args.seed, storage,
+                        args.alpha, progress)
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    print(summary(report), file=sys.stderr)
+    return 0 if report['passed'] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+class FenwickTree:
+    # Binary indexed tree over a list of numbers: O(log n) point updates,
+    # prefix sums and "which element does this running total fall into" searches
+    def __init__(self, values=()):
+        self.tree = [0] + list(values)
+        size = len(self.tree)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                self.tree[parent] += self.tree[i]
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def add(self, index, delta):
+        i = index + 1
+        size = len(self.tree)
+        while i < size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def append(self, value):
+        # The new node covers (i - lowbit(i), i]; fill in the part already stored
+        i = len(self.tree)
+        total = value
+        step = 1
+        lowbit = i & -i
+        while step < lowbit:
+            total += self.tree[i - step]
+            step <<= 1
+        self.tree.append(total)
+
+    def prefix_sum(self, count):
+        # Sum of the first count values
+        total = 0
+        i = count
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.prefix_sum(len(self))
+
+    def value(self, index):
+        return self.prefix_sum(index + 1) - self.prefix_sum(index)
+
+    def find(self, target):
+        # Returns (index, prefix) for the element whose running-total interval
+        # [prefix, prefix + value) contains target; values must be non-negative
+        position = 0
+        prefix = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(self.tree) and prefix + self.tree[following] <= target:
+                position = following
+                prefix += self.tree[following]
+            step >>= 1
+        return position, prefix
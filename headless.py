@@ -0,0 +1,113 @@
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from decision_core import DEFAULT_LISTS_DIRECTORY
+from nested_lists import sampling_graphs, is_reference
+from rng import RandomStreams, AuditLog
+
+# Batch rolls from the command line. Never imports Qt.
+
+
+OUTPUT_FORMATS = ['lines', 'jsonl', 'histogram', 'histogram-json']
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='main.py --headless', description='Roll a saved list without the GUI.')
+    parser.add_argument('list_name', help='Name of a list in the lists directory')
+    parser.add_argument('-n', '--count', type=int, default=1, help='Number of draws (default: 1)')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='lines',
+                        help='lines/jsonl stream every draw, histogram/histogram-json print counts per option')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Draws generated per vectorized call')
+    parser.add_argument('--lists-directory', default=DEFAULT_LISTS_DIRECTORY)
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for reproducible output (a new one is printed to stderr if omitted)')
+    parser.add_argument('--audit', metavar='FILE', help='Append a record of this run (seed, streams, chunk size) to FILE')
+    args = parser.parse_args(argv)
+    if args.count < 0:
+        parser.error('--count must not be negative')
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be positive')
+    return args
+
+
+def chunk_draws(decisions, count, chunk_size, streams):
+    # Chunk i is drawn from stream ('headless', i): a run is replayed exactly
+    # by the same seed and chunk size
+    chunk = 0
+    while count > 0:
+        size = min(count, chunk_size)
+        yield decisions.draw_indices(size, streams.stream('headless', chunk))
+        count -= size
+        chunk += 1
+
+
+def stream_draws(decisions, count, chunk_size, streams, out, encode):
+    # Each option is encoded once; a chunk is then written with a single join
+    encoded = np.empty(len(decisions), dtype=object)
+    encoded[:] = [encode(option) for option in decisions.labels()]
+    for indices in chunk_draws(decisions, count, chunk_size, streams):
+        out.write(b''.join(encoded[indices].tolist()))
+
+
+def histogram(decisions, count, chunk_size, streams):
+    counts = np.zeros(len(decisions), dtype=np.int64)
+    for indices in chunk_draws(decisions, count, chunk_size, streams):
+        counts += np.bincount(indices, minlength=len(decisions))
+    return counts
+
+
+def write_histogram(decisions, counts, output_format, out):
+    # Options that refer to other lists are only ever expanded, never picked,
+    # so they are left out; an option found in several nested lists is one row
+    totals = {}
+    for option, n in zip(decisions.labels().tolist(), counts.tolist()):
+        if not is_reference(option):
+            totals[option] = totals.get(option, 0) + n
+    if output_format == 'histogram-json':
+        data = {str(option): n for option, n in totals.items()}
+        out.write(json.dumps(data).encode('utf-8') + b'\n')
+    else:
+        out.write(''.join(f"{option}\t{n}\n" for option, n in totals.items()).encode('utf-8'))
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    # Options that refer to other lists are resolved into what they roll on
+    try:
+        decisions = sampling_graphs.get(args.list_name, args.lists_directory)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    if not decisions:
+        print(f'List "{args.list_name}" has no options to roll.', file=sys.stderr)
+        return 1
+
+    streams = RandomStreams(args.seed)
+    if args.seed is None:
+        print(f"seed: {streams.seed}", file=sys.stderr)
+    if args.audit:
+        AuditLog(args.audit).record(seed=streams.seed, stream='headless/<chunk>', list=args.list_name,
+                                    count=args.count, chunk_size=args.chunk_size, format=args.format)
+
+    out = sys.stdout.buffer
+    try:
+        if args.format == 'lines':
+            stream_draws(decisions, args.count, args.chunk_size, streams, out, lambda option: f"{option}\n".encode('utf-8'))
+        elif args.format == 'jsonl':
+            stream_draws(decisions, args.count, args.chunk_size, streams, out, lambda option: (json.dumps(option) + '\n').encode('utf-8'))
+        else:
+            counts = histogram(decisions, args.count, args.chunk_size, streams)
+            write_histogram(decisions, counts, args.format, out)
+        out.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); stop quietly
+        sys.stderr.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -36,7 +36,7 @@ if not defined PIP_PATH (
 )
 
 echo Installing required Python packages...
-%PIP_PATH% install PyQt5 requests Pillow
+%PIP_PATH% install PyQt5 numpy requests Pillow
 
 echo Installation complete. You can now run your Python program.
 :End
@@ -0,0 +1,185 @@
+import io
+import json
+import time
+import threading
+from functools import wraps
+
+# Timing counters for the hot paths (list parsing, sorting, styling, rolling).
+#
+# Collection is off by default. While it is off, an instrumented function costs
+# one attribute check and a timer block costs entering an empty context manager.
+
+
+class Metric:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  # seconds
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.last = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'max_ms': self.max * 1000,
+            'last_ms': self.last * 1000,
+        }
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+        self.counters = {}
+        self.lock = threading.Lock()  # Lists are loaded and rolled on worker threads
+
+    def record(self, name, elapsed):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric()
+            metric.add(elapsed)
+
+    def increment(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timer(self, name):
+        # with metrics.timer('list.parse'): ...
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def reset(self):
+        with self.lock:
+            self.metrics.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'timings': {name: metric.to_dict() for name, metric in sorted(self.metrics.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def dump(self, path):
+        snapshot = self.snapshot()
+        snapshot['created'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        with open(path, 'w') as file:
+            json.dump(snapshot, file, indent=2)
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    # Decorator version of metrics.timer()
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def timed_iter(name, iterable):
+    # Records how long each item takes to produce, e.g. each parsed chunk of a list
+    iterator = iter(iterable)
+    while True:
+        with metrics.timer(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ProfileSession:
+    # cProfile (calling thread only) plus tracemalloc (all threads) between
+    # start() and stop(). stop() writes <prefix>.prof, <prefix>-profile.txt,
+    # <prefix>-memory.txt and <prefix>-metrics.json.
+    TOP_STATS = 40
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.profiler = None
+        self.was_enabled = False
+
+    @property
+    def running(self):
+        return self.profiler is not None
+
+    def start(self):
+        # Imported here: the profilers are slow to import and rarely needed
+        import cProfile
+        import tracemalloc
+
+        self.was_enabled = metrics.enabled
+        metrics.enabled = True
+        tracemalloc.start()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self):
+        import pstats
+        import tracemalloc
+
+        self.profiler.disable()
+        memory = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        metrics.enabled = self.was_enabled
+
+        self.profiler.dump_stats(self.prefix + '.prof')
+        text = io.StringIO()
+        pstats.Stats(self.profiler, stream=text).sort_stats('cumulative').print_stats(self.TOP_STATS)
+        with open(self.prefix + '-profile.txt', 'w') as file:
+            file.write(text.getvalue())
+        with open(self.prefix + '-memory.txt', 'w') as file:
+            file.write(f"current {current} bytes, peak {peak} bytes\n\n")
+            for statistic in memory.statistics('lineno')[:self.TOP_STATS]:
+                file.write(f"{statistic}\n")
+        metrics.dump(self.prefix + '-metrics.json')
+        self.profiler = None
+        return [self.prefix + suffix for suffix in ('.prof', '-profile.txt', '-memory.txt', '-metrics.json')]
@@ -0,0 +1,178 @@
+import os
+import json
+import zlib
+import threading
+
+# Append-only change journals for saved lists.
+#
+# A list is its snapshot file (lists/<name>.json or .dmb) plus, optionally,
+# lists/<name>.<ext>.journal. The journal's first line identifies the snapshot it
+# applies to by size and CRC-32; every other line is one save:
+#   {"changes": [{"op": "add", "options": [[option, weight], ...]},
+#                {"op": "remove", "options": [[option, weight], ...]},
+#                {"op": "weight", "option": option, "old": weight, "new": weight}]}
+# A save is a single line, so a crash mid-append loses that save and nothing
+# else. A journal whose snapshot was replaced (e.g. by a full save) is stale
+# and ignored. Compaction (decision_core.compact_list) folds the journal back
+# into the snapshot.
+
+
+JOURNAL_EXTENSION = '.journal'
+JOURNAL_VERSION = 1
+BLOCK_SIZE = 1 << 20
+
+# Journals are compacted once they are this large and at least
+# COMPACT_RATIO times the size of their snapshot
+COMPACT_MIN_BYTES = 1 << 20
+COMPACT_RATIO = 0.5
+
+locks = {}
+locks_lock = threading.Lock()
+
+
+def journal_path(list_path):
+    return list_path + JOURNAL_EXTENSION
+
+
+def lock_for(list_path):
+    # Serializes appends and compaction of one list within this process
+    key = os.path.abspath(list_path)
+    with locks_lock:
+        lock = locks.get(key)
+        if lock is None:
+            lock = locks[key] = threading.Lock()
+        return lock
+
+
+def snapshot_base(list_path):
+    crc = 0
+    size = 0
+    with open(list_path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+    return {'size': size, 'crc32': crc}
+
+
+def journal_signature(list_path):
+    try:
+        stat = os.stat(journal_path(list_path))
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def read_journal(list_path, end=None):
+    # The changes of every complete save, in order, or None if the list has no
+    # journal or the journal belongs to an older snapshot. end limits reading
+    # to the first end bytes.
+    path = journal_path(list_path)
+    try:
+        with open(path, 'rb') as file:
+            data = file.read() if end is None else file.read(end)
+    except FileNotFoundError:
+        return None
+    lines = data.split(b'\n')
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        return None
+    if header.get('journal') != JOURNAL_VERSION:
+        raise ValueError(f"{path} uses unsupported journal version {header.get('journal')}")
+    # Cheap size check first; the CRC reads the whole snapshot
+    if os.path.getsize(list_path) != header['base']['size'] or snapshot_base(list_path) != header['base']:
+        return None
+    changes = []
+    # The last element is empty after a complete line, or a save that was cut off
+    for line in lines[1:-1]:
+        changes.extend(json.loads(line)['changes'])
+    return changes
+
+
+def append_changes(list_path, changes):
+    # Records one save; the caller holds lock_for(list_path)
+    path = journal_path(list_path)
+    if not os.path.exists(path):
+        header = {'journal': JOURNAL_VERSION, 'base': snapshot_base(list_path)}
+        write_journal(path, [json.dumps(header).encode('utf-8')])
+    else:
+        drop_partial_line(path)
+    with open(path, 'ab') as file:
+        file.write(json.dumps({'changes': changes}).encode('utf-8') + b'\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def write_journal(path, lines):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(b''.join(line + b'\n' for line in lines))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def drop_partial_line(path):
+    # Cuts off a save that a crash left half written, so the next one starts on its own line
+    with open(path, 'rb+') as file:
+        size = file.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            file.seek(start)
+            block = file.read(end - start)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            file.truncate(end)
+
+
+def remove_journal(list_path):
+    try:
+        os.remove(journal_path(list_path))
+    except FileNotFoundError:
+        pass
+
+
+def needs_compaction(list_path):
+    try:
+        journal_size = os.path.getsize(journal_path(list_path))
+    except FileNotFoundError:
+        return False
+    return journal_size >= max(COMPACT_MIN_BYTES, COMPACT_RATIO * os.path.getsize(list_path))
+
+
+def replay(pairs, changes):
+    # Applies journal changes to [(option, weight), ...]. Options are matched by
+    # value; which of several equal entries a change hits does not matter.
+    entries = list(pairs)
+    positions = {}
+    for index, pair in enumerate(entries):
+        positions.setdefault(pair, []).append(index)
+
+    def take(pair):
+        indices = positions.get(pair)
+        if not indices:
+            raise ValueError(f"Journal refers to {pair!r}, which is not in the list")
+        return indices.pop()
+
+    for change in changes:
+        op = change['op']
+        if op == 'add':
+            for option, weight in change['options']:
+                positions.setdefault((option, weight), []).append(len(entries))
+                entries.append((option, weight))
+        elif op == 'remove':
+            for option, weight in change['options']:
+                entries[take((option, weight))] = None
+        elif op == 'weight':
+            option = change['option']
+            index = take((option, change['old']))
+            entries[index] = (option, change['new'])
+            positions.setdefault(entries[index], []).append(index)
+        else:
+            raise ValueError(f"Unknown journal operation {op!r}")
+    return [entry for entry in entries if entry is not None]
@@ -0,0 +1,22 @@
+import sys
+import importlib.util
+
+# Modules that are only executed when one of their attributes is first used.
+# NumPy alone is about half of the app's import time and nothing needs it
+# before the first list is loaded or rolled.
+
+
+def lazy_import(name):
+    # Not thread-safe on first use before Python 3.12: touch the module on one
+    # thread (see DecisionMaker9000.finish_startup) before others can use it
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
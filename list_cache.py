@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+import decision_core
+from decision_core import DecisionList
+from list_store import as_list_store
+
+# Shared cache of parsed and compiled lists, keyed by list store and name.
+# An entry is reused while the store's signature of the list (for files, the
+# mtime and size of the file and its journal) is unchanged; the least recently
+# used entries are evicted once the estimated memory use goes over budget.
+#
+# Wherever a store is expected, a lists directory works too.
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def estimate_size(decision_list):
+    return decision_list.memory_usage()
+
+
+class ListCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # cache key -> (signature, decision_list, size)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, list_name, store=decision_core.DEFAULT_LISTS_DIRECTORY):
+        # Returns the compiled DecisionList for a saved list; callers must not mutate it
+        store = as_list_store(store)
+        key = store.cache_key(list_name)
+        try:
+            signature = store.signature(list_name)
+        except FileNotFoundError:
+            self.invalidate_key(key)
+            return DecisionList([], name=list_name)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Parse outside the lock so other lists stay available meanwhile
+        decision_list = store.load(list_name)
+        self.put(key, signature, decision_list)
+        return decision_list
+
+    def lookup(self, list_name, store=decision_core.DEFAULT_LISTS_DIRECTORY):
+        # The cached DecisionList if it is still current, else None; never reads the list
+        store = as_list_store(store)
+        key = store.cache_key(list_name)
+        try:
+            signature = store.signature(list_name)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != signature:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def add(self, list_name, store, signature, decision_list):
+        # Stores a list that was loaded elsewhere (e.g. by a background loader);
+        # signature must be taken before the list was read
+        with self.lock:
+            self.misses += 1
+        self.put(as_list_store(store).cache_key(list_name), signature, decision_list)
+
+    def options(self, list_name, store=decision_core.DEFAULT_LISTS_DIRECTORY):
+        return self.get(list_name, store).options
+
+    def put(self, key, signature, decision_list):
+        size = estimate_size(decision_list)
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return  # Never cache something that alone exceeds the budget
+            self.entries[key] = (signature, decision_list, size)
+            self.current_bytes += size
+            self._evict()
+
+    def invalidate(self, list_name, store=decision_core.DEFAULT_LISTS_DIRECTORY):
+        for key in as_list_store(store).cache_keys(list_name):
+            self.invalidate_key(key)
+
+    def invalidate_key(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.entries:
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+
+list_cache = ListCache()
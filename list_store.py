@@ -0,0 +1,106 @@
+import os
+
+import decision_core
+from decision_core import DecisionList
+from journal import journal_signature, needs_compaction
+
+# Where saved lists live. The GUI, the cache and Multi-Roll only talk to a
+# store, so lists can be files (FileListStore, the default) or rows in an
+# SQLite database (sqlite_store.SqliteListStore), chosen by the "storage"
+# setting.
+#
+# signature(name) changes whenever the list does and raises FileNotFoundError
+# if there is no such list; append_changes(name, changes) takes the changes of
+# an OptionStore (see journal.py for their format).
+
+
+DEFAULT_STORAGE = 'files'
+DEFAULT_DATABASE = 'lists.db'
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def list_signature(path):
+    # A saved list is its file plus its journal, if any
+    return file_signature(path) + (journal_signature(path),)
+
+
+class FileListStore:
+    # One .json or .dmb file per list, plus its journal
+    def __init__(self, lists_directory=decision_core.DEFAULT_LISTS_DIRECTORY):
+        self.lists_directory = lists_directory
+
+    def __repr__(self):
+        return f"FileListStore({self.lists_directory!r})"
+
+    def path(self, list_name):
+        return decision_core.find_list_path(list_name, self.lists_directory)
+
+    def prepare(self):
+        os.makedirs(self.lists_directory, exist_ok=True)
+
+    def list_names(self):
+        return decision_core.get_saved_lists(self.lists_directory)
+
+    def exists(self, list_name):
+        return os.path.exists(self.path(list_name))
+
+    def watch_paths(self):
+        # What to watch for lists being added, removed or renamed by other programs
+        return [self.lists_directory]
+
+    def cache_key(self, list_name):
+        return os.path.abspath(self.path(list_name))
+
+    def cache_keys(self, list_name):
+        # Every key the list may be cached under, e.g. before it was converted to binary
+        return [os.path.abspath(path) for path in (decision_core.list_path(list_name, self.lists_directory),
+                                                   decision_core.binary_list_path(list_name, self.lists_directory))]
+
+    def signature(self, list_name):
+        return list_signature(self.path(list_name))
+
+    def read(self, list_name):
+        return decision_core.read_list(list_name, self.lists_directory)
+
+    def load(self, list_name):
+        return DecisionList.load(list_name, self.lists_directory)
+
+    def iter_chunks(self, list_name, chunk_size=decision_core.LOAD_CHUNK_SIZE):
+        return decision_core.iter_list_chunks(list_name, self.lists_directory, chunk_size)
+
+    def write(self, list_name, options):
+        decision_core.write_list(list_name, options, self.lists_directory)
+
+    def append_changes(self, list_name, changes):
+        decision_core.append_list_changes(list_name, changes, self.lists_directory)
+
+    def needs_compaction(self, list_name):
+        return needs_compaction(self.path(list_name))
+
+    def compact(self, list_name):
+        return decision_core.compact_list(list_name, self.lists_directory)
+
+    def delete(self, list_name):
+        decision_core.delete_list(list_name, self.lists_directory)
+
+
+def as_list_store(store):
+    # Functions that used to take a lists directory accept either
+    if isinstance(store, (str, os.PathLike)):
+        return FileListStore(store)
+    return store
+
+
+def open_list_store(settings, lists_directory=decision_core.DEFAULT_LISTS_DIRECTORY):
+    storage = settings.get('storage', DEFAULT_STORAGE)
+    if storage == 'sqlite':
+        # Imported here: only needed by those who opted in
+        from sqlite_store import SqliteListStore
+        return SqliteListStore(settings.get('database', DEFAULT_DATABASE))
+    if storage != 'files':
+        raise ValueError(f"Unknown storage {storage!r}, expected 'files' or 'sqlite'")
+    return FileListStore(lists_directory)
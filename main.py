@@ -1,11 +1,84 @@
+import time
+
+STARTED = time.perf_counter()  # For --startup-time
+
 import sys
 import os
 import json
-import random
-from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QHeaderView, QTableWidget, QTableWidgetItem, QInputDialog, QVBoxLayout, QHBoxLayout, QWidget, QCheckBox, QLineEdit, QSpinBox, QPushButton, QLabel, QSlider, QComboBox, QFormLayout, QDialog, QListWidget
-from PyQt5.QtCore import Qt, QTimer
+from bisect import bisect_left, bisect_right
+
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    # Batch rolls from the command line, without loading Qt
+    import headless
+    sys.exit(headless.main([arg for arg in sys.argv[1:] if arg != "--headless"]))
+if __name__ == "__main__" and "--serve" in sys.argv[1:]:
+    # Local HTTP roll service, also without Qt
+    import server
+    sys.exit(server.main([arg for arg in sys.argv[1:] if arg != "--serve"]))
+if __name__ == "__main__" and "--verify" in sys.argv[1:]:
+    # Monte Carlo check of a list's weights, also without Qt
+    import fairness
+    sys.exit(fairness.main([arg for arg in sys.argv[1:] if arg != "--verify"]))
+
+from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QHeaderView, QTableWidget, QTableWidgetItem, QInputDialog, QVBoxLayout, QHBoxLayout, QWidget, QCheckBox, QLineEdit, QSpinBox, QPushButton, QLabel, QSlider, QComboBox, QFormLayout, QDialog, QListView, QAbstractItemView, QProgressBar, QFileDialog
+from PyQt5.QtCore import Qt, QTimer, QElapsedTimer, QAbstractListModel, QModelIndex, QObject, QRunnable, QThreadPool, QFileSystemWatcher, QStringListModel, pyqtSignal
 from PyQt5.QtGui import QPalette, QColor, QIntValidator
 import subprocess
+import bulk_io
+from decision_core import DecisionList
+from list_cache import list_cache, DEFAULT_MAX_BYTES
+from list_store import FileListStore, open_list_store
+from option_store import OptionStore, build_index_from
+from multi_roll import MultiRollEngine, RollRequest
+from nested_lists import compile_graph, graph_current
+from rng import RandomStreams, AuditLog, format_stream, new_seed
+from instrumentation import metrics, timed, timed_iter, ProfileSession
+from animation import build_animation
+
+IMPORTED = (time.perf_counter() - STARTED) * 1000
+
+
+DEFAULT_CACHE_SIZE_MB = DEFAULT_MAX_BYTES // (1024 * 1024)
+
+# How many of the most frequent picks a repeated Multi-Roll row shows
+RESULT_SUMMARY_SIZE = 5
+# How many picks a distinct Multi-Roll row lists before cutting off
+DISTINCT_SUMMARY_SIZE = 20
+# Milliseconds between checks for the next animation frame
+ANIMATION_TICK_MS = 16
+# How often the open list's journal is checked for compaction (it is also checked after every save)
+COMPACTION_INTERVAL_MS = 10 * 60 * 1000
+# Changes to the lists are read this long after the last file system notification
+CATALOG_RESCAN_DELAY_MS = 200
+# The option filter runs this long after the last keystroke
+FILTER_DELAY_MS = 150
+
+
+class MultiRollSignals(QObject):
+    row_rolled = pyqtSignal(object)  # RollResult
+    failed = pyqtSignal(str)
+    finished = pyqtSignal()
+
+
+class MultiRollWorker(QRunnable):
+    def __init__(self, engine, requests, streams, batch, unique=False, avoid=()):
+        super().__init__()
+        self.engine = engine
+        self.requests = requests
+        self.streams = streams
+        self.batch = batch
+        self.unique = unique
+        self.avoid = avoid
+        self.signals = MultiRollSignals()
+
+    def run(self):
+        try:
+            self.engine.roll(self.requests, on_result=self.signals.row_rolled.emit,
+                             streams=self.streams, batch=self.batch, unique=self.unique, avoid=self.avoid)
+        except (OSError, ValueError) as error:
+            self.signals.failed.emit(str(error))
+        finally:
+            self.signals.finished.emit()
 
 
 class MultiRollDialog(QDialog):
@@ -14,6 +87,8 @@ class MultiRollDialog(QDialog):
         self.setWindowTitle("Multi-Roll")
         self.resize(800, 400)
         self.layout = QVBoxLayout(self)
+        self.engine = MultiRollEngine(self.parent().store)
+        self.worker = None
 
         # Initialize table and buttons
         self.init_ui()
@@ -24,8 +99,8 @@ class MultiRollDialog(QDialog):
 
     def init_ui(self):
         # Table for lists and results
-        self.table = QTableWidget(0, 4)  # Start with no rows
-        self.table.setHorizontalHeaderLabels(['List Name', 'Result', 'Delete', 'Lock'])
+        self.table = QTableWidget(0, 7)  # Start with no rows
+        self.table.setHorizontalHeaderLabels(['List Name', 'Result', 'Delete', 'Lock', 'Repeats', 'Distinct', 'Exclude'])
         self.layout.addWidget(self.table)
         
         self.init_table()
@@ -35,6 +110,14 @@ class MultiRollDialog(QDialog):
         self.add_button.clicked.connect(self.add_row)
         self.layout.addWidget(self.add_button)
 
+        # Constraints between rows; with any of them (or exclusions) the rows are rolled jointly
+        constraints_layout = QHBoxLayout()
+        self.unique_checkbox = QCheckBox("No repeats across rows")
+        constraints_layout.addWidget(self.unique_checkbox)
+        self.avoid_locked_checkbox = QCheckBox("Differ from locked rows")
+        constraints_layout.addWidget(self.avoid_locked_checkbox)
+        self.layout.addLayout(constraints_layout)
+
         # Button to start the roll process
         self.start_button = QPushButton("Start Roll", self)
         self.start_button.clicked.connect(self.start_roll)
@@ -47,6 +130,9 @@ class MultiRollDialog(QDialog):
         self.table.setColumnWidth(0, 250)  # 'List Name'
         self.table.setColumnWidth(2, 150)  # 'Delete'
         self.table.setColumnWidth(3, 150)  # 'Lock'
+        self.table.setColumnWidth(4, 120)  # 'Repeats'
+        self.table.setColumnWidth(5, 100)  # 'Distinct'
+        self.table.setColumnWidth(6, 200)  # 'Exclude'
         
         # Setting the 'Result' column to dynamically resize with the window
         header = self.table.horizontalHeader()
@@ -100,7 +186,8 @@ class MultiRollDialog(QDialog):
         # Adding a combo box with list selections
         list_selector = QComboBox()
         MultiRollDialog.apply_dark_theme_to_combobox(list_selector)
-        list_selector.addItems(self.parent().get_saved_lists())
+        # Shared with every other row, so no row reads the lists or copies their names
+        list_selector.setModel(self.parent().catalog.model)
         self.table.setCellWidget(row_position, 0, list_selector)
 
         # Placeholder for result display
@@ -120,42 +207,96 @@ class MultiRollDialog(QDialog):
         checkbox_layout.setContentsMargins(0, 0, 0, 0)  # Remove margins to ensure it stays centered
         self.table.setCellWidget(row_position, 3, checkbox_container)  # Add the container to the table
 
+        # How many times to roll this row; more than one shows the distribution
+        repeats_input = QSpinBox()
+        repeats_input.setRange(1, 1000000000)
+        self.table.setCellWidget(row_position, 4, repeats_input)
+
+        # Checkbox for making the repeats different options (no replacement)
+        distinct_checkbox = QCheckBox()
+        distinct_container = QWidget()
+        distinct_layout = QHBoxLayout(distinct_container)
+        distinct_layout.addWidget(distinct_checkbox)
+        distinct_layout.setAlignment(Qt.AlignCenter)
+        distinct_layout.setContentsMargins(0, 0, 0, 0)
+        self.table.setCellWidget(row_position, 5, distinct_container)
+
+        # Options this row must not pick
+        exclude_input = QLineEdit()
+        exclude_input.setPlaceholderText("Options, comma separated")
+        self.table.setCellWidget(row_position, 6, exclude_input)
+
     def delete_row(self, row):
         if self.table.rowCount() > 1:
             self.table.removeRow(row)
 
     def start_roll(self):
+        requests = []
+        locked_picks = []
         for row in range(self.table.rowCount()):
             checkbox_container = self.table.cellWidget(row, 3)  # Get the container widget
             checkbox = checkbox_container.layout().itemAt(0).widget()  # Access the QCheckBox from the layout
             if not checkbox.isChecked():  # Check if the lock checkbox is not checked
-                self.finish_roll(row)
-
-
-    def finish_roll(self, row):
-        list_name = self.table.cellWidget(row, 0).currentText()
-        result = self.roll_for_list(list_name)
-        self.table.item(row, 1).setText(result)
-
-    def roll_for_list(self, list_name):
-        weighted_options = self.fetch_list_data(list_name)
-        if not weighted_options:
+                list_name = self.table.cellWidget(row, 0).currentText()
+                repeats = self.table.cellWidget(row, 4).value()
+                distinct = self.table.cellWidget(row, 5).layout().itemAt(0).widget().isChecked()
+                exclude = tuple(option.strip() for option in self.table.cellWidget(row, 6).text().split(',') if option.strip())
+                requests.append(RollRequest(row, list_name, repeats, distinct, exclude))
+            else:
+                locked_picks.extend(self.table.item(row, 1).data(Qt.UserRole) or [])
+        if not requests:
+            return
+        unique = self.unique_checkbox.isChecked()
+        # Locked rows count as taken whenever rows must not repeat each other, too
+        avoid = tuple(locked_picks) if unique or self.avoid_locked_checkbox.isChecked() else ()
+
+        # Rows are rolled in the background; keep the table fixed until all results are in
+        self.set_rolling(True)
+        main_window = self.parent()
+        self.worker = MultiRollWorker(self.engine, requests, main_window.streams, main_window.next_multi_roll_batch(),
+                                      unique, avoid)
+        self.worker.signals.row_rolled.connect(self.finish_roll)
+        self.worker.signals.failed.connect(self.on_roll_failed)
+        self.worker.signals.finished.connect(self.on_roll_finished)
+        QThreadPool.globalInstance().start(self.worker)
+
+    def set_rolling(self, rolling):
+        self.table.setEnabled(not rolling)
+        self.add_button.setEnabled(not rolling)
+        self.start_button.setEnabled(not rolling)
+        self.unique_checkbox.setEnabled(not rolling)
+        self.avoid_locked_checkbox.setEnabled(not rolling)
+
+    def on_roll_finished(self):
+        self.worker = None
+        self.set_rolling(False)
+
+    def on_roll_failed(self, message):
+        QMessageBox.warning(self, 'Error', f'Could not roll: {message}')
+
+    def finish_roll(self, roll_result):
+        item = self.table.item(roll_result.row, 1)
+        item.setText(self.format_result(roll_result))
+        item.setToolTip(f"Seed {roll_result.seed}, stream {roll_result.stream}")
+        # What the row picked, for rows that must differ from it once it is locked
+        item.setData(Qt.UserRole, [option for option, _ in roll_result.counts])
+        self.parent().record_roll(roll_result.list_name, roll_result.stream, roll_result.result,
+                                  repeats=sum(count for _, count in roll_result.counts), distinct=roll_result.distinct)
+
+    def format_result(self, roll_result):
+        if roll_result.result is None:
             return "No data available"
-        options, weights = zip(*weighted_options)  # Separate the options and weights
-        result = random.choices(options, weights=weights, k=1)[0]  # Use random.choices to consider weights
-        return result
-
-
-
-    def fetch_list_data(self, list_name):
-        path = os.path.join(self.parent().lists_directory, f"{list_name}.json")
-        try:
-            with open(path, 'r') as file:
-                data = json.load(file)
-                return [(item[0], item[1]) for item in data]  # Adjust to handle new data format
-        except FileNotFoundError:
-            return []
-
+        if roll_result.distinct:
+            picks = [option for option, _ in roll_result.counts]
+            return ", ".join(picks[:DISTINCT_SUMMARY_SIZE]) + (", ..." if len(picks) > DISTINCT_SUMMARY_SIZE else "")
+        total = sum(count for _, count in roll_result.counts)
+        if total == 1:
+            return roll_result.result
+        summary = ", ".join(f"{option}: {count} ({count / total:.1%})"
+                            for option, count in roll_result.counts[:RESULT_SUMMARY_SIZE])
+        if len(roll_result.counts) > RESULT_SUMMARY_SIZE:
+            summary += ", ..."
+        return summary
 
 
 class HandCursorButton(QPushButton):
@@ -236,11 +377,12 @@ class SettingsDialog(QDialog):
 
 
     def save_settings(self):
-        settings = {
+        settings = dict(self.settings)  # Keep keys that have no widget here (e.g. cache_size_mb)
+        settings.update({
             'duration': int(self.duration_input.text()),
             'sort_order': self.sort_order_selection.currentText(),
             'font_size': self.font_size_input.value()
-        }
+        })
 
         # Save the settings to a JSON file
         with open('settings.json', 'w') as file:
@@ -250,9 +392,11 @@ class SettingsDialog(QDialog):
         self.accept()  # Close the dialog after saving settings
 
     def load_settings(self):
+        self.settings = {}
         try:
             with open('settings.json', 'r') as file:
                 settings = json.load(file)
+                self.settings = settings
                 self.duration_input.setText(str(settings.get('duration', 5)))
                 self.sort_order_selection.setCurrentText(settings.get('sort_order', 'Alphabetical'))
                 self.font_size_input.setValue(settings.get('font_size', 14))
@@ -260,24 +404,561 @@ class SettingsDialog(QDialog):
             pass  # If the file is not found, default settings will be used
 
 
+class DiagnosticsDialog(QDialog):
+    # Live view of the instrumentation counters and the list cache
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setWindowTitle('Diagnostics')
+        self.resize(700, 400)
+        layout = QVBoxLayout(self)
+
+        self.enabled_checkbox = QCheckBox("Collect timings")
+        self.enabled_checkbox.setChecked(metrics.enabled)
+        self.enabled_checkbox.toggled.connect(self.set_enabled)
+        layout.addWidget(self.enabled_checkbox)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(['Name', 'Count', 'Total (ms)', 'Mean (ms)', 'Max (ms)'])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        self.cache_label = QLabel()
+        layout.addWidget(self.cache_label)
+
+        button_layout = QHBoxLayout()
+        reset_button = QPushButton('Reset')
+        reset_button.clicked.connect(self.reset)
+        button_layout.addWidget(reset_button)
+        save_button = QPushButton('Save...')
+        save_button.clicked.connect(self.save)
+        button_layout.addWidget(save_button)
+        self.profile_button = QPushButton()
+        self.profile_button.clicked.connect(self.toggle_profiling)
+        button_layout.addWidget(self.profile_button)
+        layout.addLayout(button_layout)
+
+        # Keep the numbers live while the dialog is open
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+        self.refresh()
+
+        if hasattr(parent, 'apply_dark_theme_to_dialog'):
+            parent.apply_dark_theme_to_dialog(self)
+
+    def set_enabled(self, enabled):
+        metrics.enabled = enabled
+
+    def refresh(self):
+        snapshot = metrics.snapshot()
+        rows = [(name, timing['count'], f"{timing['total_ms']:.1f}", f"{timing['mean_ms']:.3f}", f"{timing['max_ms']:.3f}")
+                for name, timing in snapshot['timings'].items()]
+        rows += [(name, count, "", "", "") for name, count in snapshot['counters'].items()]
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(str(value)))
+
+        cache = list_cache.stats()
+        self.cache_label.setText(f"List cache: {cache['entries']} lists, {cache['bytes'] / 1024 / 1024:.1f} of "
+                                 f"{cache['max_bytes'] / 1024 / 1024:.0f} MB, {cache['hits']} hits, "
+                                 f"{cache['misses']} misses, {cache['evictions']} evictions")
+        profiling = self.parent().profile_session is not None
+        self.profile_button.setText('Stop Profiling' if profiling else 'Start Profiling')
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def save(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Diagnostics', 'diagnostics.json', 'JSON files (*.json)')
+        if not path:
+            return
+        try:
+            metrics.dump(path)
+        except OSError as error:
+            QMessageBox.warning(self, 'Error', f'Could not save the diagnostics: {error}')
+
+    def toggle_profiling(self):
+        main_window = self.parent()
+        if main_window.profile_session is None:
+            main_window.start_profiling(time.strftime('profile-%Y%m%d-%H%M%S'))
+            self.enabled_checkbox.setChecked(True)
+        else:
+            files = main_window.stop_profiling()
+            self.enabled_checkbox.setChecked(metrics.enabled)
+            QMessageBox.information(self, 'Profiling', 'Profile written to:\n' + '\n'.join(files))
+        self.refresh()
+
+
+class OptionsModel(QAbstractListModel):
+    # Exposes the window's OptionStore to a QListView; row text is only
+    # formatted for the rows the view actually paints. The store reports its
+    # changes through the begin_*/end_* methods below.
+    #
+    # While a filter is set, only the matching options are shown. Their sort
+    # keys are kept in display order, and the store's row-based changes are
+    # translated to rows of that subset.
+    def __init__(self, options, parent=None):
+        super().__init__(parent)
+        self.options = options
+        options.listener = self
+        self.query = ''
+        self.filtered = None  # Sort keys of the shown options while filtering
+        self.pending = None  # What a begin_* call found out for its end_* call
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.options) if self.filtered is None else len(self.filtered)
+
+    def entry(self, row):
+        if self.filtered is None:
+            return self.options[row]
+        return self.options.entries[self.filtered[row][-1]]
+
+    def store_row(self, row):
+        # The store's row for a row of this model
+        if self.filtered is None:
+            return row
+        return self.options.current().bisect(self.filtered[row])
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        option_text, weight = self.entry(index.row())
+        return f"{option_text} (Weight: {weight})"
+
+    def set_filter(self, query):
+        self.beginResetModel()
+        self.query = query
+        self.filtered = self.matching_keys() if query else None
+        self.endResetModel()
+
+    def matching_keys(self):
+        with metrics.timer('options.filter'):
+            return self.options.keys_for(self.options.search(self.query))
+
+    def shown(self, key):
+        return bool(self.options.search_entries([key[-1]], self.query))
+
+    def find(self, key):
+        # Position of the entry behind key among the shown options, or None;
+        # its shown key may be outdated by a weight change, see row_changed()
+        position = bisect_left(self.filtered, key)
+        for candidate in (position, position - 1):
+            if 0 <= candidate < len(self.filtered) and self.filtered[candidate][-1] == key[-1]:
+                return candidate
+        return None
+
+    def begin_reset(self):
+        self.beginResetModel()
+
+    def end_reset(self):
+        if self.filtered is not None:
+            self.filtered = self.matching_keys()
+        self.endResetModel()
+
+    def begin_insert(self, first, last):
+        if self.filtered is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+        else:
+            self.pending = (first, last)  # Whether they are shown is known once they are in
+
+    def end_insert(self):
+        if self.filtered is None:
+            self.endInsertRows()
+            return
+        first, last = self.pending
+        current = self.options.current()
+        keys = [current[row] for row in range(first, last + 1)]
+        keys = [key for key in keys if self.shown(key)]
+        if keys:
+            row = bisect_left(self.filtered, keys[0])
+            self.beginInsertRows(QModelIndex(), row, row + len(keys) - 1)
+            self.filtered[row:row] = keys
+            self.endInsertRows()
+
+    def begin_remove(self, first, last):
+        if self.filtered is None:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            return
+        # Adjacent in the store, so adjacent among the shown options too
+        current = self.options.current()
+        start = bisect_left(self.filtered, current[first])
+        stop = bisect_right(self.filtered, current[last])
+        self.pending = (start, stop)
+        if stop > start:
+            self.beginRemoveRows(QModelIndex(), start, stop - 1)
+
+    def end_remove(self):
+        if self.filtered is None:
+            self.endRemoveRows()
+            return
+        start, stop = self.pending
+        if stop > start:
+            del self.filtered[start:stop]
+            self.endRemoveRows()
+
+    def begin_move(self, row, destination):
+        if self.filtered is None:
+            self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), destination)
+            return
+        # Shown as a removal here and an insertion in end_move()
+        key = self.options.current()[row]
+        position = self.find(key)
+        self.pending = key[-1] if position is not None else None
+        if position is not None:
+            self.beginRemoveRows(QModelIndex(), position, position)
+            del self.filtered[position]
+            self.endRemoveRows()
+
+    def end_move(self):
+        if self.filtered is None:
+            self.endMoveRows()
+            return
+        if self.pending is not None:
+            key = self.options.current_key(self.pending, self.options.entries[self.pending])
+            row = bisect_left(self.filtered, key)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.filtered.insert(row, key)
+            self.endInsertRows()
+
+    def row_changed(self, row):
+        if self.filtered is not None:
+            key = self.options.current()[row]
+            row = self.find(key)
+            if row is None:
+                return
+            self.filtered[row] = key
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+
+class ListLoadSignals(QObject):
+    chunk_loaded = pyqtSignal(int, list, int)  # load id, options, percent done
+    finished = pyqtSignal(int, object)  # load id, DecisionList
+    failed = pyqtSignal(int, str)
+
+
+class ListLoader(QRunnable):
+    # Parses a saved list on a pool thread and hands the options over in chunks
+    def __init__(self, load_id, list_name, store):
+        super().__init__()
+        self.load_id = load_id
+        self.list_name = list_name
+        self.store = store
+        self.cancelled = False
+        self.signature = None  # Store signature of the list as it was read
+        self.signals = ListLoadSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            self.signature = signature = self.store.signature(self.list_name)
+            options = []
+            metrics.increment('list.loads')
+            chunks = self.store.iter_chunks(self.list_name)
+            for chunk, done in timed_iter('list.parse_chunk', chunks):
+                if self.cancelled:
+                    return
+                options.extend(chunk)
+                self.signals.chunk_loaded.emit(self.load_id, chunk, int(done * 100))
+            # Compile here too, so the list is rollable the moment it arrives
+            with metrics.timer('list.compile'):
+                decision_list = DecisionList(options, name=self.list_name)
+            list_cache.add(self.list_name, self.store, signature, decision_list)
+            if not self.cancelled:
+                self.signals.finished.emit(self.load_id, decision_list)
+        except (OSError, ValueError) as error:
+            if not self.cancelled:
+                self.signals.failed.emit(self.load_id, str(error))
+
+
+class IndexSignals(QObject):
+    finished = pyqtSignal(object, object, object)  # TrigramIndex, store generation, next entry id
+
+
+class IndexBuilder(QRunnable):
+    # Builds the filter index of the loaded options on a pool thread
+    def __init__(self, options):
+        super().__init__()
+        self.generation, self.next_id, self.entries = options.index_snapshot()
+        self.signals = IndexSignals()
+
+    def run(self):
+        with metrics.timer('options.build_index'):
+            index = build_index_from(self.entries)
+        self.signals.finished.emit(index, self.generation, self.next_id)
+
+
+class ImportSignals(QObject):
+    progress = pyqtSignal(int)  # percent done
+    finished = pyqtSignal(object)  # bulk_io.ImportResult
+    failed = pyqtSignal(str)
+
+
+class ImportWorker(QRunnable):
+    # Reads and dedupes an options file on a pool thread
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.cancelled = False
+        self.signals = ImportSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            with metrics.timer('options.import'):
+                result = bulk_io.read_options(self.path, progress=lambda done: self.signals.progress.emit(int(done * 100)),
+                                              cancelled=lambda: self.cancelled)
+        except (OSError, ValueError) as error:
+            if not self.cancelled:
+                self.signals.failed.emit(str(error))
+            return
+        if result is not None and not self.cancelled:
+            self.signals.finished.emit(result)
+
+
+class CompactionSignals(QObject):
+    finished = pyqtSignal(str, bool)  # list name, compacted
+
+
+class CompactionWorker(QRunnable):
+    # Folds a list's journal into its file on a pool thread
+    def __init__(self, list_name, store):
+        super().__init__()
+        self.list_name = list_name
+        self.store = store
+        self.signals = CompactionSignals()
+
+    def run(self):
+        try:
+            compacted = self.store.compact(self.list_name)
+        except (OSError, ValueError) as error:
+            print(f"Could not compact {self.list_name}: {error}")
+            compacted = False
+        self.signals.finished.emit(self.list_name, compacted)
+
+
+class StartupSignals(QObject):
+    finished = pyqtSignal(object, list, dict, object)  # list store, list names, settings, seed (a 128-bit int, too big for int)
+
+
+class StartupLoader(QRunnable):
+    # Startup work that does not need the GUI thread
+    def __init__(self, lists_directory):
+        super().__init__()
+        self.lists_directory = lists_directory
+        self.signals = StartupSignals()
+
+    def run(self):
+        settings = read_settings()
+        try:
+            store = open_list_store(settings, self.lists_directory)
+            store.prepare()
+        except (OSError, ValueError) as error:
+            print(f"Could not open the list storage, using {self.lists_directory}/ instead: {error}")
+            store = FileListStore(self.lists_directory)
+            store.prepare()
+        list_names = store.list_names()
+        # Drawing a seed imports NumPy, here rather than on the first roll
+        seed = new_seed()
+        self.signals.finished.emit(store, list_names, settings, seed)
+
+
+def read_settings(path='settings.json'):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}  # Defaults are used
+    except (OSError, ValueError) as error:
+        print(f"Could not read {path}: {error}")
+        return {}
+
+
+class ListCatalog(QObject):
+    # Names of the saved lists, read once at startup and then kept up to date
+    # by a file system watcher. Comboboxes either share the model or follow
+    # the signals, so none of them has to read the lists itself.
+    added = pyqtSignal(str)
+    removed = pyqtSignal(str)
+    renamed = pyqtSignal(str, str)  # old name, new name
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.store = None
+        self.model = QStringListModel(self)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_rescan)
+        self.watcher.fileChanged.connect(self.schedule_rescan)
+        # Notifications come in bursts (a save writes a temporary file and renames it)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(CATALOG_RESCAN_DELAY_MS)
+        self.rescan_timer.timeout.connect(self.rescan)
+
+    def start(self, store, list_names):
+        self.store = store
+        self.model.setStringList(list_names)
+        self.watch()
+
+    def names(self):
+        return self.model.stringList()
+
+    def __contains__(self, list_name):
+        return bool(self.model.match(self.model.index(0), Qt.DisplayRole, list_name, 1, Qt.MatchExactly))
+
+    def watch(self):
+        # Watched files that were replaced or removed drop out of the watcher, so this runs after every rescan
+        watched = set(self.watcher.files() + self.watcher.directories())
+        paths = [path for path in self.store.watch_paths() if path not in watched and os.path.exists(path)]
+        if paths:
+            self.watcher.addPaths(paths)
+
+    def schedule_rescan(self, path):
+        self.rescan_timer.start()
+
+    def rescan(self):
+        try:
+            names = self.store.list_names()
+        except OSError as error:
+            print(f"Could not read the saved lists: {error}")
+            return
+        current = set(self.names())
+        new = set(names)
+        added = [name for name in names if name not in current]
+        removed = [name for name in self.names() if name not in new]
+        if len(added) == 1 and len(removed) == 1:
+            self.rename(removed[0], added[0])
+        else:
+            for list_name in removed:
+                self.remove(list_name)
+            for list_name in added:
+                self.add(list_name)
+        self.watch()
+
+    def add(self, list_name):
+        if list_name in self:
+            return
+        row = self.model.rowCount()
+        self.model.insertRows(row, 1)
+        self.model.setData(self.model.index(row), list_name)
+        self.added.emit(list_name)
+
+    def remove(self, list_name):
+        matches = self.model.match(self.model.index(0), Qt.DisplayRole, list_name, 1, Qt.MatchExactly)
+        if matches:
+            self.model.removeRows(matches[0].row(), 1)
+            self.removed.emit(list_name)
+
+    def rename(self, old_name, new_name):
+        # Rows that showed the old name show the new one
+        matches = self.model.match(self.model.index(0), Qt.DisplayRole, old_name, 1, Qt.MatchExactly)
+        if matches:
+            self.model.setData(matches[0], new_name)
+            self.renamed.emit(old_name, new_name)
+
+
 class DecisionMaker9000(QMainWindow):
+    startup_finished = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle('DecisionMaker9000')
         self.setGeometry(100, 100, 800, 600)
         self.lists_directory = 'lists'
-        os.makedirs(self.lists_directory, exist_ok=True)
-        self.options = []
+        # Where lists are loaded from and saved to, see list_store.py; replaced
+        # in finish_startup() if settings.json picks another storage
+        self.store = FileListStore(self.lists_directory)
+        self.catalog = ListCatalog(self)  # Saved list names, filled in by finish_startup()
+        self.catalog.added.connect(self.on_list_added)
+        self.catalog.removed.connect(self.on_list_removed)
+        self.catalog.renamed.connect(self.on_list_renamed)
+        self.options = OptionStore()  # Kept in display order, see refresh_options_list()
+        # DecisionList to roll from: the compiled list right after a load, else
+        # a view of the store's live sampler, which follows every edit
+        self.sampler = None
+        self.nested_graph = None  # CompiledGraph of self.sampler, if the options refer to other lists
+        self.loader = None  # ListLoader of the list being loaded, if any
+        self.importer = None  # ImportWorker of the file being imported, if any
+        self.indexer = None  # IndexBuilder, while one runs
+        # (list name, store signature) of the saved list that the store's
+        # changes are relative to; saves of that list only append the changes
+        self.saved_list = None
+        self.compactor = None  # CompactionWorker, while one runs
+        self.load_id = 0
+        self.thread_pool = QThreadPool.globalInstance()
+        # Every roll gets its own stream of this seed, so recorded rolls can be replayed.
+        # Created in finish_startup(), since the seed comes from NumPy.
+        self.streams = None
+        self.audit_log = None
+        self.roll_number = 0
+        self.multi_roll_batch = 0
+        self.roll_stream = None
+        self.animation = None  # RollAnimation being played
+        self.animation_clock = QElapsedTimer()
+        self.last_tick = None
+        self.profile_session = None  # ProfileSession while profiling
+        # Defaults until finish_startup() has read settings.json
+        self.duration = 5000
+        self.current_theme = 'Dark'
+        self.current_font_size = 14
+        self.sort_order = 'Alphabetical'
+        # Milliseconds since STARTED at each startup step, see finish_startup()
+        self.startup_marks = {'imports': IMPORTED}
+        self.startup_loader = None
+        self.painted = False
         self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
         self.timer.timeout.connect(self.update_display)
+        self.compaction_timer = QTimer()
+        self.compaction_timer.timeout.connect(self.compact_open_list)
+        self.compaction_timer.start(COMPACTION_INTERVAL_MS)
 
-        # Set up dark palette
+        # Set up dark palette; the style sheet is applied once the settings are read
         self.dark_palette = self.get_dark_palette()
         self.setPalette(self.dark_palette)
-        self.setStyleSheet(self.get_dark_style_sheet())
 
         self.init_ui()
-        self.load_settings()
+        self.mark_startup('window_built')
+
+    def mark_startup(self, step):
+        self.startup_marks[step] = (time.perf_counter() - STARTED) * 1000
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            # The window is on screen; everything else can wait until now
+            self.painted = True
+            self.mark_startup('first_paint')
+            QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        # The list catalog, settings and NumPy load on a pool thread; controls
+        # that need them stay disabled until then
+        self.centralWidget().setEnabled(False)
+        self.startup_loader = StartupLoader(self.lists_directory)
+        self.startup_loader.signals.finished.connect(self.on_startup_loaded)
+        self.thread_pool.start(self.startup_loader)
+
+    def on_startup_loaded(self, store, list_names, settings, seed):
+        self.startup_loader = None
+        self.store = store
+        self.catalog.start(store, list_names)
+        self.load_combobox.addItems(list_names)
+        self.streams = RandomStreams(seed)
+        self.apply_settings(settings)
+        self.centralWidget().setEnabled(True)
+        self.mark_startup('ready')
+        self.startup_finished.emit()
 
 
     def init_ui(self):
@@ -303,8 +984,7 @@ class DecisionMaker9000(QMainWindow):
         self.save_button.clicked.connect(self.save_options)
 
         self.load_combobox = QComboBox()
-        self.load_combobox.addItem("Select a list to load")
-        self.load_combobox.addItems(self.get_saved_lists())
+        self.load_combobox.addItem("Select a list to load")  # Saved lists are added by on_startup_loaded()
         self.load_combobox.activated[str].connect(self.load_options)
 
         self.delete_list_button = QPushButton('Delete List')
@@ -322,19 +1002,57 @@ class DecisionMaker9000(QMainWindow):
         save_load_layout.addWidget(self.delete_list_button)
         layout.addLayout(save_load_layout)
 
+        import_export_layout = QHBoxLayout()
+        self.import_button = QPushButton('Import...')
+        self.import_button.setCursor(Qt.PointingHandCursor)
+        self.import_button.clicked.connect(self.import_options)
+        import_export_layout.addWidget(self.import_button)
+        self.export_button = QPushButton('Export...')
+        self.export_button.setCursor(Qt.PointingHandCursor)
+        self.export_button.clicked.connect(self.export_options)
+        import_export_layout.addWidget(self.export_button)
+        layout.addLayout(import_export_layout)
+
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setVisible(False)
+        layout.addWidget(self.load_progress)
+
         self.display_area = QLabel("Your options will appear here!")
         self.display_area.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.display_area)
 
-        self.options_list = QListWidget()
-        self.options_list.setSelectionMode(QListWidget.MultiSelection)
-        self.options_list.itemDoubleClicked.connect(self.edit_option)
+        # Search as you type; see option_index.py for what matches
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("Filter options")
+        self.filter_input.setClearButtonEnabled(True)
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_input.textChanged.connect(self.filter_timer.start)
+        layout.addWidget(self.filter_input)
+
+        self.options_model = OptionsModel(self.options, self)
+        self.options_list = QListView()
+        self.options_list.setModel(self.options_model)
+        self.options_list.setUniformItemSizes(True)  # Lets the view skip measuring every row
+        self.options_list.setSelectionMode(QAbstractItemView.MultiSelection)
+        self.options_list.doubleClicked.connect(self.edit_option)
         layout.addWidget(self.options_list)
 
         self.start_button = QPushButton('Start')
         self.start_button.setCursor(Qt.PointingHandCursor)
         self.start_button.clicked.connect(self.start_decision_process)
-        layout.addWidget(self.start_button)
+
+        # More than one pick draws that many different options at once
+        self.picks_input = QSpinBox()
+        self.picks_input.setRange(1, 1000)
+        self.picks_input.setPrefix("Picks: ")
+        start_layout = QHBoxLayout()
+        start_layout.addWidget(self.start_button, 1)
+        start_layout.addWidget(self.picks_input)
+        layout.addLayout(start_layout)
 
         action_buttons_layout = QHBoxLayout()
         self.selectAllCheckBox = QCheckBox("Select/Deselect All")
@@ -359,6 +1077,11 @@ class DecisionMaker9000(QMainWindow):
         self.settings_button.clicked.connect(self.show_settings_dialog)
         layout.addWidget(self.settings_button)
 
+        self.diagnostics_button = QPushButton('Diagnostics')
+        self.diagnostics_button.setCursor(Qt.PointingHandCursor)
+        self.diagnostics_button.clicked.connect(self.show_diagnostics_dialog)
+        layout.addWidget(self.diagnostics_button)
+
         central_widget.setLayout(layout)
 
     def open_multi_roll_dialog(self):
@@ -366,16 +1089,19 @@ class DecisionMaker9000(QMainWindow):
         dialog.exec_()
 
     def new_list(self):
-        self.options = []  # Clear current options
-        self.refresh_options_list()
+        self.cancel_loading()
+        self.clear_filter()
+        self.options.reset([])  # Clear current options
+        self.saved_list = None
+        self.invalidate_sampler()
         self.load_combobox.setCurrentIndex(0)  # Reset to the default "Select a list to load"
 
 
     def toggle_select_all(self, state):
-        is_checked = state == Qt.Checked
-        for index in range(self.options_list.count()):
-            item = self.options_list.item(index)
-            item.setSelected(is_checked)
+        if state == Qt.Checked:
+            self.options_list.selectAll()
+        else:
+            self.options_list.clearSelection()
             
     def delete_list(self):
         list_name = self.load_combobox.currentText()
@@ -385,10 +1111,10 @@ class DecisionMaker9000(QMainWindow):
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
 
             if reply == QMessageBox.Yes:
-                file_path = os.path.join(self.lists_directory, f"{list_name}.json")
                 try:
-                    os.remove(file_path)
-                    self.load_combobox.removeItem(self.load_combobox.currentIndex())
+                    self.store.delete(list_name)
+                    list_cache.invalidate(list_name, self.store)
+                    self.catalog.remove(list_name)
                     QMessageBox.information(self, 'Deleted', f'List "{list_name}" deleted successfully.')
                 except FileNotFoundError:
                     QMessageBox.warning(self, 'Error', f'List "{list_name}" not found.')
@@ -398,49 +1124,138 @@ class DecisionMaker9000(QMainWindow):
         weight = self.weight_input.value()
         if option_text:
             options = [opt.strip() for opt in option_text.split(',') if opt.strip()]
-            for opt in options:
-                self.options.append((opt, weight))
+            self.options.add_many([(opt, weight) for opt in options])
+            self.invalidate_sampler()
             self.option_input.clear()
             self.weight_input.setValue(1)
-            self.refresh_options_list()
 
-    def edit_option(self, item):
-        index = self.options_list.row(item)
-        option_text, _ = self.options[index]
+    def edit_option(self, index):
+        row = self.options_model.store_row(index.row())
+        option_text, _ = self.options[row]
         new_weight, ok = QInputDialog.getInt(self, "Edit Weight", "Set new weight for option:", min=1)
         if ok:
-            self.options[index] = (option_text, new_weight)
-            item.setText(f"{option_text} (Weight: {new_weight})")
+            self.options.set_weight(row, new_weight)
+            self.invalidate_sampler()
 
     def delete_selected_options(self):
-        selected_items = self.options_list.selectedItems()
-        if not selected_items:
+        # Walk the selected ranges rather than one QModelIndex per selected row
+        selected_rows = set()
+        for selection_range in self.options_list.selectionModel().selection():
+            selected_rows.update(range(selection_range.top(), selection_range.bottom() + 1))
+        if not selected_rows:
             return
+        selected_rows = {self.options_model.store_row(row) for row in selected_rows}
 
         reply = QMessageBox.question(self, 'Confirm Deletion', 'Are you sure you want to delete the selected options?',
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
 
         if reply == QMessageBox.Yes:
-            while selected_items:
-                item = selected_items.pop()
-                index = self.options_list.row(item)
-                del self.options[index]  # Remove from the options list
-                self.options_list.takeItem(index)  # Remove from the QListWidget
+            self.options_list.clearSelection()
+            self.options.remove_rows(selected_rows)
+            self.invalidate_sampler()
 
     def start_decision_process(self):
-        self.timer.start(100)
-        QTimer.singleShot(self.duration, self.timer.stop)
+        if self.loader is not None:
+            self.display_area.setText("Loading list...")
+            return
+        try:
+            sampler = self.get_sampler() if self.options else None
+        except (OSError, ValueError) as error:
+            # e.g. lists that refer to each other in a cycle
+            self.display_area.setText(str(error))
+            return
+        if not sampler:
+            self.display_area.setText("No options to display")
+            return
+        self.roll_number += 1
+        self.roll_stream = ('roll', self.roll_number)
+        # The whole roll, result included, is drawn now; the timer only plays it back
+        with metrics.timer('roll.precompute'):
+            self.animation = build_animation(sampler, self.duration, self.picks_input.value(),
+                                             self.streams.stream(*self.roll_stream),
+                                             self.streams.stream(*self.roll_stream, 'animation'))
+        self.display_area.setToolTip("")
+        self.last_tick = None
+        self.animation_clock.start()
+        self.timer.start(ANIMATION_TICK_MS)
+        self.update_display()
+
+    def finish_decision_process(self):
+        self.timer.stop()
+        animation = self.animation
+        self.animation = None
+        metrics.increment('roll.frames_skipped', animation.skipped)
+        stream = format_stream(self.roll_stream)
+        self.display_area.setToolTip(f"Seed {self.streams.seed}, stream {stream}")
+        list_name = self.load_combobox.currentText()
+        if list_name == "Select a list to load":
+            list_name = None
+        self.record_roll(list_name, stream, animation.result, picks=animation.picks)
+
+    def record_roll(self, list_name, stream, result, **details):
+        if self.audit_log is None:
+            return
+        try:
+            self.audit_log.record(seed=self.streams.seed, stream=stream, list=list_name, result=result, **details)
+        except OSError as error:
+            print(f"Could not write to the audit log: {error}")
+
+    def next_multi_roll_batch(self):
+        self.multi_roll_batch += 1
+        return self.multi_roll_batch
 
+    @timed('roll.tick')
     def update_display(self):
-        if not self.options:
-            self.display_area.setText("No options to display")
+        if self.animation is None:
             return
-        weighted_options = [opt for opt, weight in self.options for _ in range(weight)]
-        random_option = random.choice(weighted_options)
-        self.display_area.setText(random_option)
+        if metrics.enabled:
+            # A tick interval well above ANIMATION_TICK_MS means the event loop is starved
+            now = time.perf_counter()
+            if self.last_tick is not None:
+                metrics.record('roll.tick_interval', now - self.last_tick)
+            self.last_tick = now
+        # Show whichever frame is due now; frames missed by a late tick are skipped
+        text = self.animation.frame_at(self.animation_clock.elapsed())
+        if text is not None:
+            self.display_area.setText(text)
+        if self.animation.finished:
+            self.finish_decision_process()
+
+    def get_sampler(self):
+        if self.sampler is None:
+            self.sampler = DecisionList(None, sampler=self.options.sampler)
+        if not self.options.references:
+            return self.sampler
+        # Some options roll on other lists: compiled once, again when they or the options change
+        graph = self.nested_graph
+        if graph is None or graph.root is not self.sampler or not graph_current(graph, self.store):
+            root_name = self.saved_list[0] if self.saved_list is not None else None
+            with metrics.timer('roll.compile_nested'):
+                self.nested_graph = graph = compile_graph(self.sampler, self.store, list_cache, root_name)
+        return graph.decision_list
+
+    def invalidate_sampler(self):
+        # Cheap: falls back to the store's sampler, which is already up to date
+        self.sampler = None
+        self.nested_graph = None
 
     def get_saved_lists(self):
-        return [os.path.splitext(file)[0] for file in os.listdir(self.lists_directory) if file.endswith('.json')]
+        return self.catalog.names()
+
+    def on_list_added(self, list_name):
+        self.load_combobox.addItem(list_name)
+
+    def on_list_removed(self, list_name):
+        index = self.load_combobox.findText(list_name, Qt.MatchExactly)
+        if index > 0:  # Never the "Select a list to load" item
+            self.load_combobox.removeItem(index)
+
+    def on_list_renamed(self, old_name, new_name):
+        index = self.load_combobox.findText(old_name, Qt.MatchExactly)
+        if index > 0:
+            self.load_combobox.setItemText(index, new_name)
+        if self.saved_list is not None and self.saved_list[0] == old_name:
+            self.saved_list = None  # The next save writes the list in full
 
     def set_dialog_dark_theme(self, dialog):
         dialog.setPalette(self.dark_palette)
@@ -466,10 +1281,8 @@ class DecisionMaker9000(QMainWindow):
         list_name = dialog.textValue()
 
         if result == QDialog.Accepted and list_name:
-            file_path = os.path.join(self.lists_directory, f"{list_name}.json")
-
             # Check if the list with the entered name already exists and prompt for overwrite
-            if os.path.exists(file_path):
+            if self.store.exists(list_name):
                 reply = QMessageBox.question(
                     self, 'Overwrite List',
                     f'The list "{list_name}" already exists. Do you want to overwrite it?',
@@ -480,55 +1293,231 @@ class DecisionMaker9000(QMainWindow):
                     return  # Do not proceed with saving if the user decides not to overwrite
 
             # Proceed with saving the list
-            with open(file_path, 'w') as file:
-                json.dump(self.options, file)
-
-            # Update the combo box if the list name is not already present
-            if list_name not in [self.load_combobox.itemText(i) for i in range(self.load_combobox.count())]:
-                self.load_combobox.addItem(list_name)
-            else:
-                # If the list is being overwritten, we might need to update the list in the UI or other data structures as needed
-                pass
-                
-    def refresh_options_list(self):
-        if self.sort_order == 'Weight':
-            # Sort by weight (highest first) and then alphabetically
-            self.options.sort(key=lambda x: (-x[1], x[0]))
+            self.write_options(list_name)
+
+    @timed('list.save')
+    def write_options(self, list_name):
+        # Drop cached copies first; a memory-mapped list cannot be replaced while it is open on Windows
+        list_cache.invalidate(list_name, self.store)
+        self.invalidate_sampler()
+        if (self.saved_list is not None and self.saved_list[0] == list_name and self.options.changes is not None
+                and self.store.exists(list_name) and self.store.signature(list_name) == self.saved_list[1]):
+            # The list is as it was loaded or last saved: append only what changed since
+            if self.options.changes:
+                self.store.append_changes(list_name, self.options.changes)
         else:
-            # Default alphabetical sort
-            self.options.sort(key=lambda x: x[0])
+            self.store.write(list_name, self.options.pairs())
+        self.options.mark_saved()
+        self.saved_list = (list_name, self.store.signature(list_name))
+        self.compact_list(list_name)
+        # New lists show up in every combobox right away rather than on the watcher's next rescan
+        self.catalog.add(list_name)
+                
+    def compact_open_list(self):
+        if self.saved_list is not None:
+            self.compact_list(self.saved_list[0])
+
+    def compact_list(self, list_name):
+        # Rewrites the list file in the background once its journal has grown
+        if self.compactor is not None or not self.store.needs_compaction(list_name):
+            return
+        self.compactor = CompactionWorker(list_name, self.store)
+        self.compactor.signals.finished.connect(self.on_list_compacted)
+        self.thread_pool.start(self.compactor)
 
-        self.options_list.clear()
-        for option_text, weight in self.options:
-            self.options_list.addItem(f"{option_text} (Weight: {weight})")
+    def on_list_compacted(self, list_name, compacted):
+        self.compactor = None
+        if compacted and self.saved_list is not None and self.saved_list[0] == list_name:
+            # Same contents, new file: keep appending to it
+            self.saved_list = (list_name, self.store.signature(list_name))
+
+    @timed('options.sort')
+    def refresh_options_list(self):
+        # The store keeps both orders up to date; this only picks which one is shown
+        self.options.set_sort_order(self.sort_order)
 
     def load_options(self, list_name):
         if list_name == "Select a list to load" or not list_name.strip():
             return
-        file_path = os.path.join(self.lists_directory, f"{list_name}.json")
+        if not self.store.exists(list_name):
+            print(f"No saved list found for {list_name}.")
+            return
+        self.cancel_loading()
+        self.clear_filter()
+
+        cached = list_cache.lookup(list_name, self.store)
+        if cached is not None:
+            # The store copies the options, so the shared cached list is never edited
+            with metrics.timer('options.reset'):
+                self.options.reset(cached.options)
+            self.options.mark_saved()
+            self.saved_list = (list_name, self.store.signature(list_name))
+            self.sampler = cached
+            self.build_option_index()
+            return
+
+        # Parse in the background and fill the view as chunks arrive
+        self.options.reset([])
+        self.options.mark_saved()  # Edits made while loading are still journaled
+        self.saved_list = None
+        self.invalidate_sampler()
+        self.load_id += 1
+        self.loader = ListLoader(self.load_id, list_name, self.store)
+        self.loader.signals.chunk_loaded.connect(self.on_list_chunk_loaded)
+        self.loader.signals.finished.connect(self.on_list_loaded)
+        self.loader.signals.failed.connect(self.on_list_load_failed)
+        self.set_loading(True)
+        self.thread_pool.start(self.loader)
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+            self.set_loading(False)
+        if self.importer is not None:
+            # Its options were meant for the list that is being replaced
+            self.importer.cancel()
+            self.finish_import()
+
+    def set_loading(self, loading):
+        self.load_progress.setValue(0)
+        self.load_progress.setVisible(loading)
+        # Saving a half-loaded list would truncate it
+        self.save_button.setEnabled(not loading)
+        self.start_button.setEnabled(not loading)
+
+    def on_list_chunk_loaded(self, load_id, chunk, percent):
+        if load_id != self.load_id or self.loader is None:
+            return  # Chunk from a load that was cancelled
+        with metrics.timer('options.add_chunk'):
+            self.options.add_many(chunk, record=False)
+        self.load_progress.setValue(percent)
+
+    def on_list_loaded(self, load_id, decision_list):
+        if load_id != self.load_id or self.loader is None:
+            return
+        self.saved_list = (self.loader.list_name, self.loader.signature)
+        self.loader = None
+        self.set_loading(False)
+        if not self.options.changes:
+            self.sampler = decision_list
+        # Otherwise edits made while loading left it to be rebuilt from the store
+        self.build_option_index()
+
+    def on_list_load_failed(self, load_id, message):
+        if load_id != self.load_id or self.loader is None:
+            return
+        self.loader = None
+        self.set_loading(False)
+        QMessageBox.warning(self, 'Error', f'Could not load the list: {message}')
+
+    def import_options(self):
+        if self.loader is not None or self.importer is not None:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, 'Import Options', '',
+                                              'Option files (*.csv *.tsv *.tab *.txt);;All files (*)')
+        if not path:
+            return
+        self.importer = ImportWorker(path)
+        self.importer.signals.progress.connect(self.load_progress.setValue)
+        self.importer.signals.finished.connect(self.on_options_imported)
+        self.importer.signals.failed.connect(self.on_options_import_failed)
+        self.set_loading(True)
+        self.import_button.setEnabled(False)
+        self.thread_pool.start(self.importer)
+
+    def finish_import(self):
+        self.importer = None
+        self.set_loading(False)
+        self.import_button.setEnabled(True)
+
+    def on_options_imported(self, result):
+        self.finish_import()
+        # One batch and one view reset, however many rows the file had
+        with metrics.timer('options.merge'):
+            reweighted, added = self.options.merge(result.weights)
+        self.invalidate_sampler()
+        self.build_option_index()
+        message = (f"Imported {result.rows} rows: {added} new options, {reweighted} existing ones reweighted, "
+                   f"{result.merged} duplicate rows merged.")
+        if result.skipped:
+            line_number, reason = result.skipped[0]
+            message += f"\n\n{len(result.skipped)} rows were skipped, the first on line {line_number}: {reason}"
+        QMessageBox.information(self, 'Import', message)
+
+    def on_options_import_failed(self, message):
+        self.finish_import()
+        QMessageBox.warning(self, 'Error', f'Could not import the file: {message}')
+
+    def export_options(self):
+        if not self.options:
+            QMessageBox.warning(self, 'Export', 'There are no options to export.')
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Options', 'options.csv',
+                                              'CSV files (*.csv);;TSV files (*.tsv);;Text files (*.txt)')
+        if not path:
+            return
         try:
-            with open(file_path, 'r') as file:
-                self.options = json.load(file)
-                self.refresh_options_list()
-        except FileNotFoundError:
-            print(f"No saved list file found for {file_path}.")
+            with metrics.timer('options.export'):
+                count = bulk_io.write_options(path, iter(self.options))
+        except OSError as error:
+            QMessageBox.warning(self, 'Error', f'Could not export the options: {error}')
+            return
+        self.display_area.setText(f"Exported {count} options")
+
+    def apply_filter(self):
+        query = self.filter_input.text()
+        if not query.strip():
+            query = ''
+        if query and self.options.index is None:
+            self.build_option_index()  # Until it is ready, filtering scans every option
+        self.options_model.set_filter(query)
+
+    def clear_filter(self):
+        # At once, rather than after FILTER_DELAY_MS, so a list being loaded is not filtered chunk by chunk
+        self.filter_timer.stop()
+        self.filter_input.blockSignals(True)
+        self.filter_input.clear()
+        self.filter_input.blockSignals(False)
+        self.options_model.set_filter('')
+
+    def build_option_index(self):
+        # Once per load, in the background; the store keeps it up to date after that
+        if self.indexer is not None or self.options.index is not None or not len(self.options):
+            return
+        self.indexer = IndexBuilder(self.options)
+        self.indexer.signals.finished.connect(self.on_option_index_built)
+        self.thread_pool.start(self.indexer)
+
+    def on_option_index_built(self, index, generation, next_id):
+        self.indexer = None
+        if not self.options.attach_index(index, generation, next_id):
+            self.build_option_index()  # The options were replaced while it was built
+
+    def show_diagnostics_dialog(self):
+        dialog = DiagnosticsDialog(self)
+        dialog.exec_()
+
+    def start_profiling(self, prefix):
+        self.profile_session = ProfileSession(prefix)
+        self.profile_session.start()
+
+    def stop_profiling(self):
+        files = self.profile_session.stop()
+        self.profile_session = None
+        return files
 
     def show_settings_dialog(self):
         dialog = SettingsDialog(self)  # Remove the current_theme argument
         dialog.exec_()
 
     def apply_settings(self, settings):
+        list_cache.set_max_bytes(settings.get('cache_size_mb', DEFAULT_CACHE_SIZE_MB) * 1024 * 1024)
         self.duration = settings.get('duration', 5) * 1000
-        theme = settings.get('theme', 'Dark')
-        self.current_theme = settings.get('theme', 'Dark')  # Update current theme
-
-        # Check if the theme has changed and apply the new theme
-        current_theme = "Dark" if self.palette() == self.dark_palette else "Light"
-        if theme != current_theme:
-            if theme == "Light":
-                self.apply_light_theme()
-            else:
-                self.apply_dark_theme()
+        if settings.get('seed') is not None and settings['seed'] != self.streams.seed:
+            self.streams = RandomStreams(settings['seed'])
+        self.audit_log = AuditLog(settings['audit_log']) if settings.get('audit_log') else None
+        self.current_theme = settings.get('theme', 'Dark')  # Applied by apply_font_size() below
 
         self.sort_order = settings.get('sort_order', 'Alphabetical')
         self.refresh_options_list()  # Refresh the list to apply new sort order
@@ -536,6 +1525,7 @@ class DecisionMaker9000(QMainWindow):
         font_size = settings.get('font_size', 14)
         self.apply_font_size(font_size)
 
+    @timed('style.apply_font_size')
     def apply_font_size(self, font_size):
         self.current_font_size = font_size
 
@@ -550,10 +1540,10 @@ class DecisionMaker9000(QMainWindow):
         self.display_area.setFont(display_font)
 
         # Update the styles to reflect the new font size
-        if self.palette() == self.dark_palette:
-            self.apply_dark_theme()
-        else:
+        if self.current_theme == "Light":
             self.apply_light_theme()
+        else:
+            self.apply_dark_theme()
 
     def update_widget_fonts(self, widget, font):
         if isinstance(widget, QWidget):  # Ensure widget is an instance of QWidget
@@ -561,65 +1551,17 @@ class DecisionMaker9000(QMainWindow):
             for child in widget.children():
                 self.update_widget_fonts(child, font)
 
-    def load_settings(self):
-        try:
-            with open('settings.json', 'r') as file:
-                settings = json.load(file)
-                self.apply_settings(settings)
-        except FileNotFoundError:
-            self.apply_dark_theme()  # Default to dark theme
-
+    @timed('style.apply_dark_theme')
     def apply_dark_theme(self):
-        palette = QPalette()
-        palette.setColor(QPalette.Window, QColor(35, 35, 35))
-        palette.setColor(QPalette.WindowText, Qt.white)
-        palette.setColor(QPalette.Base, QColor(50, 50, 50))
-        palette.setColor(QPalette.AlternateBase, QColor(60, 60, 60))
-        palette.setColor(QPalette.ToolTipBase, Qt.white)
-        palette.setColor(QPalette.ToolTipText, Qt.white)
-        palette.setColor(QPalette.Text, Qt.white)
-        
-        # Update the button color and text color for better contrast
-        buttonColor = QColor(70, 70, 70)  # Dark grey
-        textColor = QColor(Qt.white)  # White text color
-        
-        palette.setColor(QPalette.Button, buttonColor)
-        palette.setColor(QPalette.ButtonText, textColor)
-        palette.setColor(QPalette.BrightText, Qt.red)
-        palette.setColor(QPalette.Link, QColor(42, 130, 218))
-        palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-        palette.setColor(QPalette.HighlightedText, textColor)
-
         # Update the style for the checkbox text color
         self.selectAllCheckBox.setStyleSheet("QCheckBox { color: white; }")
 
-        # Apply the palette to the application
-        self.setPalette(palette)
-
         # Update the label style directly
         self.display_area.setStyleSheet("QLabel { color : yellow;}")
-        
-        # Additional styling to improve button readability
-        button_style = f"""
-            QPushButton {{
-                background-color: {buttonColor.name()};
-                color: {textColor.name()};
-                border-style: outset;
-                border-width: 2px;
-                border-radius: 10px;
-                border-color: beige;
-                font: bold 14px;
-                min-width: 10em;
-                padding: 8px;
-            }}
-            QPushButton:pressed {{
-                background-color: {buttonColor.lighter().name()};
-                border-style: inset;
-            }}
-        """
-        self.setStyleSheet(button_style)
+
+        # One style sheet pass: palette, font size and button colors together
         self.set_custom_style(self.dark_palette, self.current_font_size, QColor(70, 70, 70), QColor(Qt.white))
-            
+
     def get_dark_palette(self):
         palette = QPalette()
         palette.setColor(QPalette.Window, QColor(35, 35, 35))
@@ -637,34 +1579,6 @@ class DecisionMaker9000(QMainWindow):
         palette.setColor(QPalette.HighlightedText, Qt.white)
         return palette
 
-    def get_dark_style_sheet(self):
-        return """
-            QPushButton {
-                background-color: #464646;
-                color: white;
-                border-style: outset;
-                border-width: 2px;
-                border-radius: 10px;
-                border-color: beige;
-                padding: 6px;
-                min-width: 80px;
-            }
-            QPushButton:pressed {
-                background-color: #2c2c2c;
-                border-style: inset;
-            }
-            QComboBox, QLineEdit, QSpinBox, QLabel, QCheckBox, QTableWidget {
-                color: white;
-                background-color: #2c2c2c;
-            }
-            QHeaderView::section {
-                background-color: #353535;
-                color: white;
-                padding-left: 4px;
-                border: none;
-            }
-        """
-
     def apply_dark_theme_to_dialog(self, dialog):
         # Set the palette for dark theme
         dialog.setPalette(self.dark_palette)
@@ -694,6 +1608,7 @@ class DecisionMaker9000(QMainWindow):
             }
         """)
             
+    @timed('style.apply_light_theme')
     def apply_light_theme(self):
         self.setPalette(QApplication.style().standardPalette())
 
@@ -702,6 +1617,7 @@ class DecisionMaker9000(QMainWindow):
         self.selectAllCheckBox.setStyleSheet("QCheckBox { color: black; }")
         self.set_custom_style(QApplication.style().standardPalette(), self.current_font_size, QColor(255, 255, 255), QColor(0, 0, 0))
 
+    @timed('style.set_custom_style')
     def set_custom_style(self, palette, font_size, button_color, text_color):
         self.setPalette(palette)
         # Dynamically setting the font size in the style sheet
@@ -722,11 +1638,47 @@ class DecisionMaker9000(QMainWindow):
             }}
         """
         self.setStyleSheet(button_style)
+def flag_value(argv, flag, default):
+    # --flag gives default, --flag=VALUE gives VALUE, and None if the flag is absent
+    for arg in argv:
+        if arg == flag:
+            return default
+        if arg.startswith(flag + '='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+def report_startup(main_window, path):
+    # One JSON line of startup timings, for launchers that track them over time
+    line = json.dumps(main_window.startup_marks)
+    if path == '-':
+        print(line)
+    else:
+        with open(path, 'a') as file:
+            file.write(line + '\n')
+    QApplication.instance().quit()
+
+
 def main():
+    # Start profiling before anything is built, so startup is covered too
+    prefix = flag_value(sys.argv[1:], '--profile', 'profile')
+    session = None
+    if prefix:
+        session = ProfileSession(prefix)
+        session.start()
+    startup_report = flag_value(sys.argv[1:], '--startup-time', '-')
     app = QApplication(sys.argv)
     main_window = DecisionMaker9000()
+    main_window.profile_session = session
+    if startup_report:
+        # Measure time to first paint and to a usable window, then exit
+        main_window.startup_finished.connect(lambda: report_startup(main_window, startup_report))
     main_window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    if main_window.profile_session is not None:
+        files = main_window.stop_profiling()
+        print("Profile written to " + ", ".join(files))
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
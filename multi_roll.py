@@ -0,0 +1,190 @@
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import decision_core
+from list_cache import list_cache
+from nested_lists import sampling_graphs
+from list_store import as_list_store
+from rng import RandomStreams, format_stream
+from sampling import ExclusionSampler
+from instrumentation import timed
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Qt-free Multi-Roll: every distinct list is resolved once, each row is drawn
+# in vectorized chunks from its own random stream, and lists are rolled in
+# parallel on a thread pool (NumPy releases the GIL for the heavy parts of a draw).
+#
+# Rows with constraints (no option in two rows, options a row must not pick,
+# options no row may pick) are rolled jointly instead: one row after the
+# other in row order, each from its list with the weight of every option it
+# may not pick taken out (see sampling.ExclusionSampler), so no draw is ever
+# thrown away and redrawn.
+
+
+# Draws are generated and counted in chunks of at most this size
+DRAW_CHUNK_SIZE = 1_000_000
+
+# distinct rows pick `repeats` different options instead of rolling `repeats` times;
+# exclude holds options this row must not pick
+RollRequest = namedtuple('RollRequest', ['row', 'list_name', 'repeats', 'distinct', 'exclude'], defaults=[False, ()])
+# result is the first pick of the row (None if the list is empty); counts is
+# [(option, count), ...], most frequent first, or the picks in order for distinct rows.
+# seed and stream identify the random stream the row was drawn from.
+RollResult = namedtuple('RollResult', ['row', 'list_name', 'result', 'counts', 'distinct', 'seed', 'stream'],
+                        defaults=[False, None, None])
+
+
+def summarize(decision_list, index_chunks):
+    first = None
+    counts = Counter()
+    for indices in index_chunks:
+        if not len(indices):
+            continue
+        if first is None:
+            first = decision_list.option(indices[0])
+        unique, unique_counts = np.unique(indices, return_counts=True)
+        for index, count in zip(unique.tolist(), unique_counts.tolist()):
+            counts[decision_list.option(index)] += count
+    return first, counts.most_common()
+
+
+def chunked_draws(decision_list, count, rng):
+    while count > 0:
+        size = min(count, DRAW_CHUNK_SIZE)
+        yield decision_list.draw_indices(size, rng)
+        count -= size
+
+
+class JointList:
+    # A list being rolled jointly: its weights with the options rows may no
+    # longer pick taken out, found by their text
+    def __init__(self, decision_list):
+        self.decision_list = decision_list
+        self.sampler = ExclusionSampler(decision_list.sampler.weights)
+        self.positions = None  # option -> [index, ...], built when first needed
+        self.taken = set()  # Options taken out for good
+
+    def indices_of(self, option):
+        if self.positions is None:
+            self.positions = {}
+            for index, label in enumerate(self.decision_list.labels().tolist()):
+                self.positions.setdefault(label, []).append(index)
+        return self.positions.get(option, ())
+
+    def take(self, options):
+        for option in options:
+            if option not in self.taken:
+                self.taken.add(option)
+                for index in self.indices_of(option):
+                    self.sampler.remove(index)
+
+    def exclude(self, options):
+        # Takes options out for one row; returns what to give to restore()
+        removed = []
+        for option in options:
+            if option not in self.taken:
+                removed.extend(index for index in self.indices_of(option) if self.sampler.remove(index))
+        return removed
+
+    def restore(self, removed):
+        for index in removed:
+            self.sampler.restore(index)
+
+
+class MultiRollEngine:
+    def __init__(self, store=decision_core.DEFAULT_LISTS_DIRECTORY, cache=list_cache, max_workers=None):
+        self.store = as_list_store(store)
+        self.cache = cache
+        self.max_workers = max_workers
+
+    @timed('multi_roll.roll')
+    def roll(self, requests, on_result=None, streams=None, batch=0, unique=False, avoid=()):
+        # Rolls every request and returns the results in row order. on_result,
+        # if given, is called from this thread as soon as each list is done.
+        # Row r of a batch always uses stream ('multi-roll', batch, r), so the
+        # results do not depend on the number of threads. unique keeps an
+        # option from coming up in two rows; no row picks an option in avoid
+        # (e.g. the results of locked rows).
+        streams = streams or RandomStreams()
+        if unique or avoid or any(request.exclude for request in requests):
+            results = self.roll_joint(requests, streams, batch, unique, avoid)
+            if on_result is not None:
+                for result in results:
+                    on_result(result)
+            return results
+        groups = OrderedDict()
+        for request in requests:
+            groups.setdefault(request.list_name, []).append(request)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.roll_group, list_name, group, streams, batch)
+                       for list_name, group in groups.items()]
+            for future in as_completed(futures):
+                for result in future.result():
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+        results.sort(key=lambda result: result.row)
+        return results
+
+    def roll_group(self, list_name, requests, streams, batch):
+        # The list, and the lists it refers to, are resolved once for all of its rows
+        decision_list = sampling_graphs.get(list_name, self.store, self.cache)
+        return [self.roll_row(decision_list, request, streams, ('multi-roll', batch, request.row))
+                for request in requests]
+
+    @timed('multi_roll.joint')
+    def roll_joint(self, requests, streams, batch, unique, avoid):
+        names = list(OrderedDict.fromkeys(request.list_name for request in requests))
+        # Lists are still resolved in parallel; only the draws depend on each other
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            decision_lists = dict(zip(names, executor.map(
+                lambda list_name: sampling_graphs.get(list_name, self.store, self.cache), names)))
+        joint_lists = {}
+        taken = set(avoid)
+        results = []
+        for request in sorted(requests, key=lambda request: request.row):
+            joint = joint_lists.get(request.list_name)
+            if joint is None:
+                joint = joint_lists[request.list_name] = JointList(decision_lists[request.list_name])
+            joint.take(taken)
+            removed = joint.exclude(request.exclude)
+            result = self.roll_joint_row(joint, request, streams, ('multi-roll', batch, request.row))
+            joint.restore(removed)
+            if unique:
+                taken.update(option for option, _ in result.counts)
+            results.append(result)
+        return results
+
+    def roll_joint_row(self, joint, request, streams, stream_id):
+        stream = format_stream(stream_id)
+        decision_list, sampler = joint.decision_list, joint.sampler
+        if not sampler:
+            # Empty, or every option is taken
+            return RollResult(request.row, request.list_name, None, [], request.distinct, streams.seed, stream)
+        rng = streams.stream(*stream_id)
+        if request.distinct:
+            picks = [decision_list.option(index) for index in sampler.draw_distinct_indices(request.repeats, rng).tolist()]
+            return RollResult(request.row, request.list_name, picks[0] if picks else None,
+                              [(pick, 1) for pick in picks], True, streams.seed, stream)
+        if request.repeats == 1:
+            pick = decision_list.option(sampler.draw_one(rng))
+            return RollResult(request.row, request.list_name, pick, [(pick, 1)], False, streams.seed, stream)
+        result, counts = summarize(decision_list, chunked_draws(sampler, request.repeats, rng))
+        return RollResult(request.row, request.list_name, result, counts, False, streams.seed, stream)
+
+    @timed('multi_roll.row')
+    def roll_row(self, decision_list, request, streams, stream_id):
+        stream = format_stream(stream_id)
+        if not decision_list:
+            return RollResult(request.row, request.list_name, None, [], request.distinct, streams.seed, stream)
+        rng = streams.stream(*stream_id)
+        if request.distinct:
+            picks = decision_list.draw_distinct(request.repeats, rng)
+            return RollResult(request.row, request.list_name, picks[0] if picks else None,
+                              [(pick, 1) for pick in picks], True, streams.seed, stream)
+        result, counts = summarize(decision_list, chunked_draws(decision_list, request.repeats, rng))
+        return RollResult(request.row, request.list_name, result, counts, False, streams.seed, stream)
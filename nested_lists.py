@@ -0,0 +1,288 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+
+import decision_core
+from decision_core import DecisionList
+from list_cache import list_cache
+from list_store import as_list_store
+from sampling import default_rng
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Options that roll on another list. An option "@Desserts" in a list means
+# "roll on the list Desserts", which may refer to further lists in turn. A
+# reference to a list that does not exist, or has nothing to roll, stays a
+# plain option.
+#
+# A list and everything it refers to is compiled once into a graph: one node
+# per distinct list (a list referred to from several places is shared), in
+# topological order, with reference cycles reported as errors. When the graph
+# is small enough it is flattened into a single DecisionList of effective
+# weights (the product of the probabilities along every path to an option),
+# so a roll is one alias-table draw. Bigger graphs are drawn level by level,
+# each level in one vectorized call per referenced list. Compiled graphs are
+# kept until any list in them changes.
+
+
+REFERENCE_PREFIX = '@'
+# Graphs with at most this many options in all their lists together are
+# flattened. Flattening takes about two seconds per million options, while a
+# level-by-level draw costs little more than a flat one unless the graph is
+# deep, so bigger graphs are not worth it.
+FLATTEN_LIMIT = 100_000
+# Compiled graphs kept by SamplingGraphCache
+MAX_GRAPHS = 64
+
+# decision_list is what to roll; signatures maps every list it refers to, directly
+# or not, to its store signature (None if there was no such list); root is the
+# DecisionList it was compiled from
+CompiledGraph = namedtuple('CompiledGraph', ['decision_list', 'signatures', 'root', 'nested'])
+
+
+def reference_name(option):
+    # The list an option refers to, or None for a plain option
+    if isinstance(option, str) and len(option) > len(REFERENCE_PREFIX) and option.startswith(REFERENCE_PREFIX):
+        return option[len(REFERENCE_PREFIX):]
+    return None
+
+
+def is_reference(option):
+    return reference_name(option) is not None
+
+
+def find_references(decision_list):
+    # [(index, list name), ...] of the options of decision_list that refer to a list
+    references = []
+    for index, option in enumerate(decision_list.labels().tolist()):
+        name = reference_name(option)
+        if name is not None:
+            references.append((index, name))
+    return references
+
+
+class ListNode:
+    def __init__(self, name, decision_list):
+        self.name = name
+        self.decision_list = decision_list
+        self.sampler = decision_list.sampler
+        self.size = len(self.sampler.weights)  # Index space of the list, removed slots included
+        self.offset = 0  # Where the list's indices start in the graph's index space
+        self.children = {}  # option index -> ListNode it refers to
+
+    def probabilities(self):
+        weights = np.asarray(self.sampler.weights, dtype=np.float64)
+        return weights / weights.sum()
+
+
+def compile_graph(root, store=decision_core.DEFAULT_LISTS_DIRECTORY, cache=list_cache, root_name=None):
+    # Compiles the DecisionList root (e.g. a saved list, or the options being
+    # edited) and the lists it refers to. root_name is the list root was
+    # loaded from, if any, so a list referring back to it counts as a cycle.
+    # Raises ValueError for a cycle.
+    store = as_list_store(store)
+    nodes = {}  # list name -> ListNode, for every list with something to roll
+    signatures = {}
+    order = []
+
+    def visit(node, path):
+        for index, name in find_references(node.decision_list):
+            if name in path:
+                cycle = " -> ".join("(this list)" if step is None else step for step in path[path.index(name):] + [name])
+                raise ValueError(f"Lists refer to each other in a cycle: {cycle}")
+            if name not in signatures:
+                try:
+                    signatures[name] = store.signature(name)
+                except FileNotFoundError:
+                    signatures[name] = None
+                    continue
+                decision_list = cache.get(name, store)
+                if decision_list:
+                    nodes[name] = visit(ListNode(name, decision_list), path + [name])
+            child = nodes.get(name)
+            if child is not None:
+                node.children[index] = child
+        order.append(node)
+        return node
+
+    if not root:
+        return CompiledGraph(root, signatures, root, False)
+    root_node = visit(ListNode(root_name, root), [root_name])
+    if not root_node.children:
+        return CompiledGraph(root, signatures, root, False)
+
+    # Children were appended before their parents; parents first is topological order
+    order.reverse()
+    size = 0
+    for node in order:
+        node.offset = size
+        size += node.size
+    if size <= FLATTEN_LIMIT:
+        decision_list = flatten(order, size, root.name)
+    else:
+        decision_list = DecisionList(None, name=root.name, sampler=NestedSampler(order, size))
+    return CompiledGraph(decision_list, signatures, root, True)
+
+
+def graph_current(graph, store):
+    # Whether every list the graph was compiled from is unchanged
+    for name, signature in graph.signatures.items():
+        try:
+            current = store.signature(name)
+        except FileNotFoundError:
+            current = None
+        if current != signature:
+            return False
+    return True
+
+
+def effective_weights(nodes, size):
+    # Probability of every index of the graph's index space; references get
+    # 0 and pass their probability on to the list they refer to. nodes must be
+    # in topological order, so a list has all of its mass when it is reached.
+    weights = np.zeros(size, dtype=np.float64)
+    mass = {nodes[0]: 1.0}
+    for node in nodes:
+        probabilities = node.probabilities() * mass.pop(node, 0.0)
+        for index, child in node.children.items():
+            mass[child] = mass.get(child, 0.0) + probabilities[index]
+            probabilities[index] = 0.0
+        weights[node.offset:node.offset + node.size] = probabilities
+    return weights
+
+
+def graph_labels(nodes):
+    return np.concatenate([np.asarray(node.sampler.labels(), dtype=object) for node in nodes])
+
+
+def flatten(nodes, size, name=None):
+    # One DecisionList of the effective weights; the same text in two lists becomes one option
+    merged = {}
+    for option, weight in zip(graph_labels(nodes).tolist(), effective_weights(nodes, size).tolist()):
+        if weight > 0:
+            merged[option] = merged.get(option, 0.0) + weight
+    return DecisionList(list(merged.items()), name=name)
+
+
+class NestedSampler:
+    # Draws a graph too big to flatten. Indices are those of the graph's index
+    # space, i.e. a list's own option indices shifted by its offset.
+    def __init__(self, nodes, size):
+        self.nodes = nodes
+        self.root = nodes[0]
+        self.size = size
+        self.offsets = [node.offset for node in nodes]
+        self._weights = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def weights(self):
+        # Only needed for distinct draws, so computed on first use
+        if self._weights is None:
+            self._weights = effective_weights(self.nodes, self.size)
+        return self._weights
+
+    def node_at(self, index):
+        return self.nodes[bisect_right(self.offsets, index) - 1]
+
+    def option(self, index):
+        node = self.node_at(index)
+        return node.sampler.option(index - node.offset)
+
+    def labels(self):
+        return graph_labels(self.nodes)
+
+    def to_pairs(self):
+        return [(option, weight) for option, weight in zip(self.labels().tolist(), self.weights.tolist()) if weight > 0]
+
+    def memory_usage(self):
+        # The lists themselves are accounted for by the list cache
+        return 8 * len(self.offsets) + (self._weights.nbytes if self._weights is not None else 0)
+
+    def draw_indices(self, k, rng=None):
+        return self.draw_node(self.root, k, rng or default_rng())
+
+    def draw_node(self, node, k, rng):
+        local = np.asarray(node.sampler.draw_indices(k, rng), dtype=np.int64)
+        picks = local + node.offset
+        if not node.children:
+            return picks
+        positions = np.flatnonzero(np.isin(local, list(node.children)))
+        if not len(positions):
+            return picks
+        # Group the picks by the list they refer to and draw each group in one call
+        references = local[positions]
+        order = np.argsort(references, kind='stable')
+        positions, references = positions[order], references[order]
+        starts = np.flatnonzero(np.concatenate(([True], references[1:] != references[:-1])))
+        ends = np.append(starts[1:], len(references))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            child = node.children[int(references[start])]
+            picks[positions[start:end]] = self.draw_node(child, end - start, rng)
+        return picks
+
+    def draw(self, k=1, rng=None):
+        indices = self.draw_indices(k, rng)
+        # Look up each distinct pick once
+        unique, inverse = np.unique(indices, return_inverse=True)
+        decoded = np.empty(len(unique), dtype=object)
+        decoded[:] = [self.option(index) for index in unique.tolist()]
+        return decoded[inverse]
+
+    def draw_one(self, rng=None):
+        return self.option(int(self.draw_indices(1, rng)[0]))
+
+
+class SamplingGraphCache:
+    # Compiled graphs of saved lists, keyed like the list cache. A list
+    # without references is only remembered as such, and is rolled straight
+    # from the list cache.
+    def __init__(self, max_graphs=MAX_GRAPHS):
+        self.max_graphs = max_graphs
+        self.entries = OrderedDict()  # cache key -> CompiledGraph
+        self.lock = threading.Lock()
+
+    def get(self, list_name, store=decision_core.DEFAULT_LISTS_DIRECTORY, cache=list_cache):
+        # What to roll for a saved list: a DecisionList whose options never refer to a list
+        store = as_list_store(store)
+        key = store.cache_key(list_name)
+        with self.lock:
+            graph = self.entries.get(key)
+        if graph is not None and graph_current(graph, store):
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+            return graph.decision_list if graph.nested else cache.get(list_name, store)
+
+        try:
+            signature = store.signature(list_name)
+        except FileNotFoundError:
+            self.invalidate_key(key)
+            return cache.get(list_name, store)
+        root = cache.get(list_name, store)
+        # Compiled outside the lock, like the list cache parses
+        graph = compile_graph(root, store, cache, list_name)
+        graph.signatures[list_name] = signature
+        if not graph.nested:
+            # Not kept alive here, so the list cache alone decides when it is evicted
+            graph = graph._replace(decision_list=None, root=None)
+        with self.lock:
+            self.entries[key] = graph
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_graphs:
+                self.entries.popitem(last=False)
+        return graph.decision_list if graph.nested else root
+
+    def invalidate_key(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+sampling_graphs = SamplingGraphCache()
@@ -0,0 +1,132 @@
+from itertools import islice
+
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Trigram index over option text, for filtering the options of a loaded list.
+#
+# Options are indexed by the trigrams of their case-folded text, padded with
+# two NULs in front, so the trigrams '\0\0p' and '\0pi' find the options that
+# start with "p" and "pi". Queries of three or more characters match anywhere
+# in an option, shorter ones match its start (see matches()). The index only
+# narrows a query down to candidates; OptionStore.search() checks those
+# against the options themselves, which also drops removed options.
+#
+# Bulk-built segments are sorted NumPy arrays: the distinct trigram codes,
+# where each code's entry ids start, and the entry ids. Options added after
+# the build go to a dict of Python lists, which is frozen into a segment of
+# its own once it is big enough.
+
+
+PAD = '\0\0'
+# Options per bulk-built segment; bounds the memory a build needs on top of the result
+SEGMENT_SIZE = 200_000
+# Options added after a build that are kept in Python lists before they are frozen
+DELTA_LIMIT = 50_000
+
+
+def fold(text):
+    return text.casefold()
+
+
+def matches(folded_option, folded_query):
+    if len(folded_query) < 3:
+        return folded_option.startswith(folded_query)
+    return folded_query in folded_option
+
+
+def trigram_code(trigram):
+    # Code points are at most 21 bits, so three fit one int64
+    return (ord(trigram[0]) << 42) | (ord(trigram[1]) << 21) | ord(trigram[2])
+
+
+def trigram_codes(folded_option):
+    text = PAD + folded_option
+    return {trigram_code(text[i:i + 3]) for i in range(len(text) - 2)}
+
+
+def query_codes(folded_query):
+    if len(folded_query) < 3:
+        return [trigram_code(PAD[len(folded_query) - 1:] + folded_query)]
+    return [trigram_code(folded_query[i:i + 3]) for i in range(len(folded_query) - 2)]
+
+
+class Segment:
+    def __init__(self, entry_ids, options):
+        # Case-folds all options in one call, unless that changes a length (e.g. 'ß' -> 'ss')
+        text = PAD + PAD.join(options)
+        folded = fold(text)
+        if len(folded) != len(text):
+            options = [fold(option) for option in options]
+            folded = PAD + PAD.join(options)
+        points = np.frombuffer(folded.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        lengths = np.fromiter(map(len, options), dtype=np.int64, count=len(options)) + len(PAD)
+        ids = np.asarray(entry_ids, dtype=np.int64)
+        owners = np.repeat(ids, lengths)
+        codes = (points[:-2] << 42) | (points[1:-1] << 21) | points[2:]
+        # Trigrams that run into the next option's padding belong to no option
+        inside = owners[:-2] == owners[2:]
+        codes = codes[inside]
+        order = np.argsort(codes)
+        codes = codes[order]
+        # An option that has a trigram twice is listed twice; search() dedupes
+        self.ids = owners[:-2][inside][order].astype(np.int32 if ids.max() < 2 ** 31 else np.int64)
+        # No codes at all if every option is empty
+        self.starts = np.flatnonzero(np.concatenate(([len(codes) > 0], codes[1:] != codes[:-1])))
+        self.codes = codes[self.starts]
+        self.ends = np.append(self.starts[1:], len(codes))
+
+    def postings(self, code):
+        index = np.searchsorted(self.codes, code)
+        if index == len(self.codes) or self.codes[index] != code:
+            return self.ids[:0]
+        return self.ids[self.starts[index]:self.ends[index]]
+
+    def memory_usage(self):
+        return self.ids.nbytes + self.codes.nbytes + self.starts.nbytes + self.ends.nbytes
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.segments = []
+        self.delta = {}  # trigram code -> [entry id, ...] of options added since the last freeze
+        self.delta_options = []  # (entry id, option) behind self.delta
+
+    @classmethod
+    def build(cls, entries):
+        # entries: iterable of (entry_id, option). Meant to run off the GUI thread.
+        index = cls()
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, SEGMENT_SIZE))
+            if not batch:
+                return index
+            index.add_segment(batch)
+
+    def add_segment(self, batch):
+        entry_ids, options = zip(*batch)
+        self.segments.append(Segment(entry_ids, options))
+
+    def add(self, entry_id, option):
+        for code in trigram_codes(fold(option)):
+            self.delta.setdefault(code, []).append(entry_id)
+        self.delta_options.append((entry_id, option))
+        if len(self.delta_options) >= DELTA_LIMIT:
+            self.add_segment(self.delta_options)
+            self.delta = {}
+            self.delta_options = []
+
+    def candidates(self, query):
+        # Entry ids that may match query, possibly including removed ones. From
+        # each part of the index, only the shortest posting list is taken.
+        codes = query_codes(fold(query))
+        result = []
+        for segment in self.segments:
+            result.extend(min((segment.postings(code) for code in codes), key=len).tolist())
+        if self.delta:
+            result.extend(min((self.delta.get(code, ()) for code in codes), key=len))
+        return result
+
+    def memory_usage(self):
+        return sum(segment.memory_usage() for segment in self.segments)
@@ -0,0 +1,356 @@
+from bisect import bisect_left, insort
+
+from fenwick import FenwickTree
+from sampling import FenwickSampler
+from option_index import TrigramIndex, fold, matches
+from bulk_io import merge_weights
+from nested_lists import is_reference
+
+# Options kept sorted both alphabetically and by weight, updated incrementally.
+#
+# Each entry gets a unique id, so the sort keys (option, id) and
+# (-weight, option, id) are unique even for duplicate options. A listener
+# (e.g. a Qt item model) is told about every change with begin_*/end_* calls
+# that mirror QAbstractItemModel's, using rows of the current sort order.
+# A FenwickSampler follows every change, so the store can be rolled at any
+# time without rebuilding a sampler. Edits since mark_saved() are kept as
+# journal changes (see journal.py), so a save only has to write those.
+# A trigram index over the option text (option_index.py), once attached,
+# follows every added option as well. The store also counts the options that
+# refer to other lists (see nested_lists.py), so rolling a list without any
+# never has to look for them.
+
+
+ALPHABETICAL = 'Alphabetical'
+WEIGHT = 'Weight'
+
+# Batches bigger than this are applied as a single reset instead of row by row
+BULK_CHANGE_THRESHOLD = 256
+# Search results bigger than this share of the list are put in display order
+# by walking the order instead of sorting the results
+SEARCH_WALK_RATIO = 8
+
+
+class SortedKeyList:
+    # Sorted list split into sublists of about LOAD keys; a Fenwick tree over
+    # the sublist lengths turns positions into (sublist, offset) in O(log n)
+    LOAD = 1000
+
+    def __init__(self, keys=()):
+        self._build(sorted(keys))
+
+    def _build(self, keys):
+        self.lists = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self.maxes = [sublist[-1] for sublist in self.lists]
+        self.lengths = FenwickTree(len(sublist) for sublist in self.lists)
+        self.length = len(keys)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for sublist in self.lists:
+            yield from sublist
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('position out of range')
+        i, offset = self.lengths.find(position)
+        return self.lists[i][position - offset]
+
+    def bisect(self, key):
+        # Position at which key would be inserted
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            return self.length
+        return self.lengths.prefix_sum(i) + bisect_left(self.lists[i], key)
+
+    def add(self, key):
+        if not self.lists:
+            self._build([key])
+            return
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            i -= 1
+            self.lists[i].append(key)
+            self.maxes[i] = key
+        else:
+            insort(self.lists[i], key)
+        self.lengths.add(i, 1)
+        self.length += 1
+        if len(self.lists[i]) > 2 * self.LOAD:
+            self._split(i)
+
+    def remove(self, key):
+        i = bisect_left(self.maxes, key)
+        sublist = self.lists[i] if i < len(self.lists) else []
+        j = bisect_left(sublist, key)
+        if j == len(sublist) or sublist[j] != key:
+            raise ValueError(f'{key!r} is not in the list')
+        del sublist[j]
+        self.length -= 1
+        if not sublist:
+            del self.lists[i]
+            del self.maxes[i]
+            self.lengths = FenwickTree(len(sublist) for sublist in self.lists)
+            return
+        self.maxes[i] = sublist[-1]
+        self.lengths.add(i, -1)
+
+    def _split(self, i):
+        sublist = self.lists[i]
+        half = len(sublist) // 2
+        self.lists[i:i + 1] = [sublist[:half], sublist[half:]]
+        self.maxes[i:i + 1] = [sublist[half - 1], sublist[-1]]
+        self.lengths = FenwickTree(len(sublist) for sublist in self.lists)
+
+
+def build_index_from(entries):
+    # entries from OptionStore.index_snapshot()
+    return TrigramIndex.build((entry_id, entry[0]) for entry_id, entry in entries)
+
+
+class OptionStore:
+    def __init__(self, options=(), sort_order=ALPHABETICAL, listener=None):
+        self.sort_order = sort_order
+        self.listener = listener
+        self.entries = {}  # id -> (option, weight)
+        self.slots = {}  # id -> slot in self.sampler
+        self.next_id = 0
+        self.changes = None  # Journal changes since mark_saved(); None after a reset
+        self.index = None  # TrigramIndex of the current entries, see attach_index()
+        self.generation = 0  # Bumped whenever all entries are replaced
+        self.references = 0  # Options that refer to another list
+        self._rebuild(options)
+
+    def _rebuild(self, options):
+        self.generation += 1
+        self.index = None
+        self.entries = {}
+        for option, weight in options:
+            self.entries[self.next_id] = (option, weight)
+            self.next_id += 1
+        self.by_name = SortedKeyList(self.name_key(entry_id, entry) for entry_id, entry in self.entries.items())
+        self.by_weight = SortedKeyList(self.weight_key(entry_id, entry) for entry_id, entry in self.entries.items())
+        self.sampler = FenwickSampler(self.entries.values())
+        self.slots = {entry_id: slot for slot, entry_id in enumerate(self.entries)}
+        self.references = sum(1 for option, _ in self.entries.values() if is_reference(option))
+
+    @staticmethod
+    def name_key(entry_id, entry):
+        return (entry[0], entry_id)
+
+    @staticmethod
+    def weight_key(entry_id, entry):
+        return (-entry[1], entry[0], entry_id)
+
+    def current(self):
+        return self.by_weight if self.sort_order == WEIGHT else self.by_name
+
+    def current_key(self, entry_id, entry):
+        if self.sort_order == WEIGHT:
+            return self.weight_key(entry_id, entry)
+        return self.name_key(entry_id, entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, row):
+        return self.entries[self.current()[row][-1]]
+
+    def __iter__(self):
+        for key in self.current():
+            yield self.entries[key[-1]]
+
+    def pairs(self):
+        return list(self)
+
+    def _notify(self, method, *args):
+        if self.listener is not None:
+            getattr(self.listener, method)(*args)
+
+    def set_sort_order(self, sort_order):
+        if sort_order == self.sort_order:
+            return
+        self._notify('begin_reset')
+        self.sort_order = sort_order
+        self._notify('end_reset')
+
+    def reset(self, options):
+        self._reset(options)
+        self.changes = None
+
+    def _reset(self, options):
+        self._notify('begin_reset')
+        self._rebuild(options)
+        self._notify('end_reset')
+
+    def mark_saved(self):
+        self.changes = []
+
+    def _record(self, change):
+        if self.changes is not None:
+            self.changes.append(change)
+
+    def add(self, option, weight):
+        self._record({'op': 'add', 'options': [(option, weight)]})
+        return self._add(option, weight)
+
+    def _add(self, option, weight):
+        entry_id = self.next_id
+        self.next_id += 1
+        entry = (option, weight)
+        row = self.current().bisect(self.current_key(entry_id, entry))
+        self._notify('begin_insert', row, row)
+        self._insert(entry_id, entry)
+        self._notify('end_insert')
+        return row
+
+    def _insert(self, entry_id, entry):
+        self.entries[entry_id] = entry
+        self.by_name.add(self.name_key(entry_id, entry))
+        self.by_weight.add(self.weight_key(entry_id, entry))
+        self.slots[entry_id] = self.sampler.insert(*entry)
+        if is_reference(entry[0]):
+            self.references += 1
+        if self.index is not None:
+            self.index.add(entry_id, entry[0])
+
+    def add_many(self, options, record=True):
+        # record=False for options that are already saved, e.g. chunks of a list being loaded
+        options = list(options)
+        if record:
+            self._record({'op': 'add', 'options': options})
+        if len(options) <= BULK_CHANGE_THRESHOLD:
+            for option, weight in options:
+                self._add(option, weight)
+            return
+        self._notify('begin_reset')
+        if len(options) > len(self.entries) // 16:
+            # Cheaper to merge everything in one sort than to insert one by one
+            self._rebuild(list(self.entries.values()) + options)
+        else:
+            for entry in options:
+                self._insert(self.next_id, tuple(entry))
+                self.next_id += 1
+        self._notify('end_reset')
+
+    def merge(self, weights):
+        # Adds {option: weight, ...} as one batch (e.g. an import): an option the
+        # store already has gets the weight added to its first entry instead of
+        # a second entry. A single reset, however many options there are.
+        merged, reweighted, added = merge_weights(self.entries.values(), weights)
+        for option, old_weight, new_weight in reweighted:
+            self._record({'op': 'weight', 'option': option, 'old': old_weight, 'new': new_weight})
+        if added:
+            self._record({'op': 'add', 'options': added})
+        self._reset(merged)
+        return len(reweighted), len(added)
+
+    def remove_rows(self, rows):
+        removed = set(rows)
+        if len(removed) > BULK_CHANGE_THRESHOLD:
+            kept = []
+            removed_entries = []
+            for row, key in enumerate(self.current()):
+                (removed_entries if row in removed else kept).append(self.entries[key[-1]])
+            self._record({'op': 'remove', 'options': removed_entries})
+            self._reset(kept)
+            return
+        self._record({'op': 'remove', 'options': [self[row] for row in removed]})
+        rows = sorted(removed, reverse=True)
+        # Remove runs of adjacent rows together, from the bottom up so rows stay valid
+        runs = []
+        for row in rows:
+            if runs and runs[-1][0] == row + 1:
+                runs[-1][0] = row
+            else:
+                runs.append([row, row])
+        for first, last in runs:
+            keys = [self.current()[row] for row in range(first, last + 1)]
+            self._notify('begin_remove', first, last)
+            for key in keys:
+                self._remove(key[-1])
+            self._notify('end_remove')
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        self.by_name.remove(self.name_key(entry_id, entry))
+        self.by_weight.remove(self.weight_key(entry_id, entry))
+        self.sampler.remove(self.slots.pop(entry_id))
+        if is_reference(entry[0]):
+            self.references -= 1
+
+    def _reweight(self, entry_id, weight):
+        entry = self.entries[entry_id]
+        new_entry = (entry[0], weight)
+        self.entries[entry_id] = new_entry
+        # Only the weight order depends on the weight
+        self.by_weight.remove(self.weight_key(entry_id, entry))
+        self.by_weight.add(self.weight_key(entry_id, new_entry))
+        self.sampler.update(self.slots[entry_id], weight)
+
+    def set_weight(self, row, weight):
+        key = self.current()[row]
+        entry_id = key[-1]
+        option, old_weight = self.entries[entry_id]
+        self._record({'op': 'weight', 'option': option, 'old': old_weight, 'new': weight})
+        new_entry = (option, weight)
+        if self.sort_order == WEIGHT:
+            # Qt's move destination is counted before the row is taken out
+            destination = self.by_weight.bisect(self.weight_key(entry_id, new_entry))
+            if destination not in (row, row + 1):
+                self._notify('begin_move', row, destination)
+                self._reweight(entry_id, weight)
+                self._notify('end_move')
+                self._notify('row_changed', self.by_weight.bisect(self.weight_key(entry_id, new_entry)))
+                return
+        self._reweight(entry_id, weight)
+        self._notify('row_changed', self.current().bisect(self.current_key(entry_id, new_entry)))
+
+    def index_snapshot(self):
+        # Cheap enough for the GUI thread; build_index_from() can then run on another
+        return self.generation, self.next_id, list(self.entries.items())
+
+    def build_index(self):
+        generation, next_id, entries = self.index_snapshot()
+        self.attach_index(build_index_from(entries), generation, next_id)
+
+    def attach_index(self, index, generation, next_id):
+        # Takes an index built from index_snapshot() and catches it up with the
+        # options added since. Returns False if the entries were replaced meanwhile.
+        if generation != self.generation:
+            return False
+        # Ids only grow and entries keep insertion order, so the new ones are at the end
+        added = []
+        for entry_id in reversed(self.entries):
+            if entry_id < next_id:
+                break
+            added.append(entry_id)
+        for entry_id in reversed(added):
+            index.add(entry_id, self.entries[entry_id][0])
+        self.index = index
+        return True
+
+    def search(self, query):
+        # Entry ids of the options that match query (see option_index.matches),
+        # through the index if there is one, else by scanning every option
+        if self.index is None:
+            return self.search_entries(self.entries, query)
+        return self.search_entries(set(self.index.candidates(query)), query)
+
+    def search_entries(self, entry_ids, query):
+        # Those of entry_ids whose options match query; removed entries never do
+        folded = fold(query)
+        entries = self.entries
+        return [entry_id for entry_id in entry_ids
+                if entry_id in entries and matches(fold(entries[entry_id][0]), folded)]
+
+    def keys_for(self, entry_ids):
+        # Sort keys of the given entries, in the current display order
+        if len(entry_ids) * SEARCH_WALK_RATIO > len(self.entries):
+            wanted = set(entry_ids)
+            return [key for key in self.current() if key[-1] in wanted]
+        return sorted(self.current_key(entry_id, self.entries[entry_id]) for entry_id in entry_ids)
@@ -0,0 +1,50 @@
+import json
+import zlib
+import threading
+
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Reproducible random streams.
+#
+# Every roll draws from its own counter-based Philox generator, keyed by the
+# session seed and a stream id such as ('multi-roll', 3, 12). A stream depends
+# only on (seed, stream id), never on which thread uses it or on what other
+# streams were created before it, so any recorded roll can be replayed exactly.
+
+
+def new_seed():
+    return np.random.SeedSequence().entropy
+
+
+def stream_key(stream_id):
+    # Stream ids are tuples of ints and strings; strings are hashed to ints
+    return tuple(zlib.crc32(part.encode('utf-8')) if isinstance(part, str) else int(part) for part in stream_id)
+
+
+def format_stream(stream_id):
+    return '/'.join(str(part) for part in stream_id)
+
+
+class RandomStreams:
+    def __init__(self, seed=None):
+        self.seed = new_seed() if seed is None else int(seed)
+
+    def stream(self, *stream_id):
+        key = np.random.SeedSequence(self.seed, spawn_key=stream_key(stream_id)).generate_state(2, np.uint64)
+        return np.random.Generator(np.random.Philox(key=key))
+
+
+class AuditLog:
+    # Appends one JSON object per roll to a file, e.g.
+    # {"seed": ..., "stream": "roll/4", "list": "lunch", "result": "Pizza"}
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, **fields):
+        line = json.dumps(fields) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(line)
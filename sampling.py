@@ -0,0 +1,352 @@
+import sys
+from bisect import bisect_right
+from functools import lru_cache
+
+from fenwick import FenwickTree
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+
+@lru_cache(maxsize=None)
+def default_rng():
+    # Generator for draws that are not given one; created on first use
+    return np.random.default_rng()
+
+
+# Above this many options, batched cumulative searches are done on sorted targets
+SORTED_SEARCH_THRESHOLD = 1 << 16
+
+# Weights are scanned in chunks of this size when picking distinct options
+DISTINCT_CHUNK_SIZE = 1 << 20
+
+# FenwickSampler batches up to this size walk the tree once per draw
+FENWICK_BATCH_THRESHOLD = 64
+
+# Tree walks that land on a slot without weight before an exact search is used
+FENWICK_MAX_RETRIES = 8
+
+FREE_SLOT = object()
+
+
+class AliasSampler:
+    # Walker/Vose alias table: O(n) to build, O(1) per draw
+    def __init__(self, weighted_options):
+        options = [option for option, _ in weighted_options]
+        weights = np.asarray([weight for _, weight in weighted_options], dtype=np.float64)
+        if np.any(weights < 0):
+            raise ValueError("Option weights must not be negative")
+
+        count = len(weights)
+        total = float(weights.sum()) if count else 0.0
+        if count == 0 or total <= 0:
+            options = []
+            weights = weights[:0]
+            count = 0
+
+        self.options = np.empty(count, dtype=object)
+        self.options[:] = options
+        self.weights = weights
+        self.prob = np.ones(count, dtype=np.float64)
+        self.alias = np.arange(count, dtype=np.int64)
+        if count == 0:
+            return
+
+        scaled = (weights * (count / total)).tolist()
+        prob = [1.0] * count
+        alias = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+        # Whatever is left over is full (up to floating point error)
+        for i in small + large:
+            prob[i] = 1.0
+
+        self.prob[:] = prob
+        self.alias[:] = alias
+
+    def __len__(self):
+        return len(self.options)
+
+    def option(self, index):
+        return self.options[index]
+
+    def labels(self):
+        return self.options
+
+    def memory_usage(self):
+        text_bytes = sum(sys.getsizeof(option) for option in self.options)
+        return text_bytes + self.options.nbytes + self.weights.nbytes + self.prob.nbytes + self.alias.nbytes
+
+    def draw_indices(self, k, rng=None):
+        rng = rng or default_rng()
+        columns = rng.integers(0, len(self.options), size=k)
+        coins = rng.random(k)
+        return np.where(coins < self.prob[columns], columns, self.alias[columns])
+
+    def draw(self, k=1, rng=None):
+        if not len(self.options):
+            return self.options[:0]
+        return self.options[self.draw_indices(k, rng)]
+
+    def draw_one(self, rng=None):
+        if not len(self.options):
+            return None
+        return self.options[self.draw_indices(1, rng)[0]]
+
+
+def draw_cumulative_indices(cumulative, k, rng=None):
+    # Inverse-CDF draws against a cumulative weight array (any array-like
+    # buffer, e.g. a memory-mapped one), O(log n) per draw
+    rng = rng or default_rng()
+    total = cumulative[-1]
+    if np.issubdtype(cumulative.dtype, np.integer):
+        targets = rng.integers(0, total, size=k)
+    else:
+        targets = rng.random(k) * total
+    indices = search_cumulative(cumulative, targets)
+    if not np.issubdtype(cumulative.dtype, np.integer):
+        # Rounding can push a target onto the total; fall back to the last option that has weight
+        overflow = indices >= len(cumulative)
+        if overflow.any():
+            indices[overflow] = np.searchsorted(cumulative, total, side='left')
+    return indices
+
+
+def search_cumulative(cumulative, targets):
+    if len(cumulative) < SORTED_SEARCH_THRESHOLD or len(targets) < 2:
+        return np.searchsorted(cumulative, targets, side='right')
+    # On big arrays random lookups are dominated by cache misses; searching the
+    # targets in sorted order walks the array once and is about 10x faster
+    order = np.argsort(targets)
+    indices = np.empty(len(targets), dtype=np.int64)
+    indices[order] = np.searchsorted(cumulative, targets[order], side='right')
+    return indices
+
+
+def sample_without_replacement(weights, k, rng=None):
+    # Efraimidis-Spirakis: give each option the key u ** (1 / weight) and keep
+    # the k largest. Keys are compared as log(u) / weight, and the running top k
+    # is kept with argpartition, one chunk of weights at a time, so this is
+    # O(n) overall and works directly on memory-mapped weights. Returns option
+    # indices in the order sequential draws would have picked them.
+    rng = rng or default_rng()
+    best_keys = np.empty(0, dtype=np.float64)
+    best_indices = np.empty(0, dtype=np.int64)
+    if k <= 0:
+        return best_indices
+    for start in range(0, len(weights), DISTINCT_CHUNK_SIZE):
+        chunk = np.asarray(weights[start:start + DISTINCT_CHUNK_SIZE], dtype=np.float64)
+        positive = np.flatnonzero(chunk > 0)
+        with np.errstate(divide='ignore'):
+            keys = np.log(rng.random(len(positive))) / chunk[positive]
+        keys = np.concatenate([best_keys, keys])
+        indices = np.concatenate([best_indices, positive + start])
+        if len(keys) > k:
+            top = np.argpartition(keys, len(keys) - k)[len(keys) - k:]
+            keys, indices = keys[top], indices[top]
+        best_keys, best_indices = keys, indices
+    return best_indices[np.argsort(-best_keys, kind='stable')]
+
+
+class FenwickSampler:
+    # Weighted sampler over a Fenwick tree of the weights, for lists that keep
+    # changing: O(log n) insert, remove, weight update and draw, no rebuilds.
+    # Options live in slots; removed slots are reused by later inserts.
+    def __init__(self, weighted_options=()):
+        pairs = list(weighted_options)
+        self.options = [option for option, _ in pairs]
+        self.slot_weights = [weight for _, weight in pairs]
+        if any(weight < 0 for weight in self.slot_weights):
+            raise ValueError("Option weights must not be negative")
+        self.tree = FenwickTree(self.slot_weights)
+        self.free_slots = []
+        self.positive = sum(1 for weight in self.slot_weights if weight > 0)  # Live slots with weight
+        self._weights = None
+
+    @property
+    def weights(self):
+        # The slot weights as an array, kept until the next edit
+        if self._weights is None:
+            self._weights = np.asarray(self.slot_weights)
+        return self._weights
+
+    def __len__(self):
+        # Not the tree's total: float round-off can leave crumbs there once
+        # every option with weight is gone
+        if not self.positive:
+            return 0
+        return len(self.options) - len(self.free_slots)
+
+    def insert(self, option, weight):
+        if weight < 0:
+            raise ValueError("Option weights must not be negative")
+        self._weights = None
+        if weight > 0:
+            self.positive += 1
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.options[slot] = option
+            self.slot_weights[slot] = weight
+            self.tree.add(slot, weight)
+            return slot
+        self.options.append(option)
+        self.slot_weights.append(weight)
+        self.tree.append(weight)
+        return len(self.options) - 1
+
+    def remove(self, slot):
+        self._weights = None
+        if self.slot_weights[slot] > 0:
+            self.positive -= 1
+        self.tree.add(slot, -self.slot_weights[slot])
+        self.options[slot] = FREE_SLOT
+        self.slot_weights[slot] = 0
+        self.free_slots.append(slot)
+
+    def update(self, slot, weight):
+        if weight < 0:
+            raise ValueError("Option weights must not be negative")
+        self._weights = None
+        self.positive += int(weight > 0) - int(self.slot_weights[slot] > 0)
+        self.tree.add(slot, weight - self.slot_weights[slot])
+        self.slot_weights[slot] = weight
+
+    def option(self, slot):
+        return self.options[slot]
+
+    def labels(self):
+        labels = np.empty(len(self.options), dtype=object)
+        labels[:] = [None if option is FREE_SLOT else option for option in self.options]
+        return labels
+
+    def to_pairs(self):
+        return [(option, weight) for option, weight in zip(self.options, self.slot_weights) if option is not FREE_SLOT]
+
+    def memory_usage(self):
+        text_bytes = sum(sys.getsizeof(option) for option in self.options)
+        return text_bytes + 3 * 8 * len(self.options) + (self._weights.nbytes if self._weights is not None else 0)
+
+    def draw_slot(self, rng=None):
+        if not self.positive:
+            raise ValueError("There are no options with weight to draw")
+        rng = rng or default_rng()
+        total = self.tree.total()
+        for _ in range(FENWICK_MAX_RETRIES):
+            if isinstance(total, int):
+                target = int(rng.integers(0, total))
+            else:
+                target = rng.random() * total
+            slot, _ = self.tree.find(target)
+            # Float round-off can leave crumbs on removed slots; draw again if we hit one
+            if slot < len(self.slot_weights) and self.slot_weights[slot] > 0:
+                return slot
+        # The crumbs are much of what is left of the total
+        return int(self.draw_exact(1, rng)[0])
+
+    def draw_exact(self, k, rng):
+        # Searches the slot weights rather than the tree: removed slots hold
+        # exactly 0 there, so no draw can land on them
+        return draw_cumulative_indices(np.cumsum(self.weights), k, rng)
+
+    def draw_indices(self, k, rng=None):
+        if not self.positive:
+            return np.empty(0, dtype=np.int64)
+        if k <= FENWICK_BATCH_THRESHOLD:
+            return np.array([self.draw_slot(rng) for _ in range(k)], dtype=np.int64)
+        # For big batches one O(n) cumulative sum beats k tree walks
+        return self.draw_exact(k, rng)
+
+    def draw(self, k=1, rng=None):
+        if not len(self):
+            return np.empty(0, dtype=object)
+        return self.labels()[self.draw_indices(k, rng)]
+
+    def draw_one(self, rng=None):
+        if not len(self):
+            return None
+        return self.options[self.draw_slot(rng)]
+
+
+class ExclusionSampler:
+    # Draws from fixed weights with some options taken out, e.g. ones already
+    # picked by other Multi-Roll rows. A single draw picks a point in the
+    # remaining mass and steps it over the removed options in order of
+    # position, then searches the full cumulative weights: O(removed + log n),
+    # never a redraw. Batches draw from a copy with the removed weights zeroed.
+    def __init__(self, weights):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.cumulative = np.cumsum(self.weights)
+        self.total = float(self.cumulative[-1]) if len(self.weights) else 0.0
+        self.positive = int(np.count_nonzero(self.weights > 0))
+        self.removed = []  # Sorted indices of removed options with weight
+        self.removed_mass = 0.0
+
+    def __len__(self):
+        # Options that can still be drawn
+        return self.positive - len(self.removed)
+
+    def remove(self, index):
+        weight = float(self.weights[index])
+        position = bisect_right(self.removed, index)
+        if weight <= 0 or (position and self.removed[position - 1] == index):
+            return False
+        self.removed.insert(position, index)
+        self.removed_mass += weight
+        return True
+
+    def restore(self, index):
+        position = bisect_right(self.removed, index) - 1
+        if position >= 0 and self.removed[position] == index:
+            del self.removed[position]
+            self.removed_mass -= float(self.weights[index])
+
+    def remaining_weights(self):
+        weights = self.weights.copy()
+        weights[self.removed] = 0.0
+        return weights
+
+    def draw_one(self, rng=None):
+        # An index, or None once every option with weight is removed
+        if not len(self):
+            return None
+        rng = rng or default_rng()
+        target = rng.random() * max(self.total - self.removed_mass, 0.0)
+        for index in self.removed:
+            if target < self.cumulative[index] - self.weights[index]:
+                break
+            target += self.weights[index]
+        index = min(int(np.searchsorted(self.cumulative, target, side='right')), len(self.weights) - 1)
+        if self.weights[index] <= 0 or self.is_removed(index):
+            # Round-off put the point on the edge of a removed or empty option
+            index = self.nearest_available(index)
+        return index
+
+    def is_removed(self, index):
+        position = bisect_right(self.removed, index) - 1
+        return position >= 0 and self.removed[position] == index
+
+    def nearest_available(self, index):
+        available = np.flatnonzero(self.remaining_weights() > 0)
+        return int(available[np.argmin(np.abs(available - index))])
+
+    def draw_indices(self, k, rng=None):
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        if not self.removed:
+            return draw_cumulative_indices(self.cumulative, k, rng)
+        return draw_cumulative_indices(np.cumsum(self.remaining_weights()), k, rng)
+
+    def draw_distinct_indices(self, k, rng=None):
+        return sample_without_replacement(self.remaining_weights() if self.removed else self.weights, k, rng)
@@ -0,0 +1,426 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, quote
+
+import decision_core
+from list_store import DEFAULT_STORAGE, DEFAULT_DATABASE, open_list_store
+from nested_lists import sampling_graphs
+from rng import RandomStreams, format_stream
+from instrumentation import metrics
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')  # Loaded on first use, see lazy_imports.py
+
+# Local HTTP service that rolls saved lists for other tools. Never imports Qt.
+#
+#   GET /lists                              {"lists": [...]}
+#   GET /roll?list=NAME                     one pick
+#   GET /roll_many?list=A&list=B&count=N    N picks from each list (distinct=1
+#                                           for different options); also as a
+#                                           POST with {"list": [...], "count": N}
+#   GET /metrics                            latency and throughput
+#
+# Lists come from the shared list cache and compiled-graph cache, which are
+# checked against the store on every batch, so edits made in the app are
+# picked up. Requests for the same list that arrive within a batch window are
+# answered from one vectorized draw on a worker thread. Every batch has its
+# own random stream ('serve', batch number); responses carry the seed, the
+# stream and where in the batch their picks start, so any roll can be replayed.
+#
+#   python main.py --serve [--port 8765]
+#   python server.py --load-test my_list --requests 20000 --concurrency 64
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# How long the first request for a list waits for others to share its draw
+DEFAULT_BATCH_WINDOW_MS = 1.0
+# Most picks a single request may ask for
+MAX_COUNT = 100_000
+MAX_BODY_BYTES = 1 << 20
+# Request latencies kept for the percentiles in /metrics
+LATENCY_SAMPLES = 10_000
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class ServerStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = {}  # path -> count
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # seconds
+        self.draws = 0
+        self.batches = 0
+        self.batched_requests = 0
+
+    def record(self, path, elapsed, failed):
+        self.requests[path] = self.requests.get(path, 0) + 1
+        self.latencies.append(elapsed)
+        if failed:
+            self.errors += 1
+
+    def snapshot(self):
+        uptime = time.perf_counter() - self.started
+        total = sum(self.requests.values())
+        latencies = np.asarray(self.latencies, dtype=np.float64) * 1000
+        percentiles = {}
+        if len(latencies):
+            for name, value in zip(('p50', 'p95', 'p99'), np.percentile(latencies, [50, 95, 99]).tolist()):
+                percentiles[name] = value
+            percentiles['max'] = float(latencies.max())
+        return {
+            'uptime_s': uptime,
+            'requests': dict(sorted(self.requests.items())),
+            'errors': self.errors,
+            'requests_per_s': total / uptime if uptime else 0.0,
+            'draws': self.draws,
+            'draws_per_s': self.draws / uptime if uptime else 0.0,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_requests / self.batches if self.batches else 0.0,
+            'latency_ms': percentiles,
+        }
+
+
+class RollBatcher:
+    # Coalesces the picks asked of a list within the batch window into one draw
+    def __init__(self, store, streams, executor, window):
+        self.store = store
+        self.streams = streams
+        self.executor = executor
+        self.window = window  # seconds
+        self.stats = None
+        self.pending = {}  # list name -> [(count, future), ...]
+        self.batch_number = 0
+        self.tasks = set()
+
+    def next_stream(self):
+        self.batch_number += 1
+        return ('serve', self.batch_number)
+
+    async def roll(self, list_name, count):
+        # (picks, stream, offset); picks is None if the list has nothing to roll
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.get(list_name)
+        if batch is None:
+            batch = self.pending[list_name] = []
+            loop.call_later(self.window, self.start_flush, list_name)
+        batch.append((count, future))
+        return await future
+
+    async def roll_distinct(self, list_name, count):
+        # Picks without replacement cannot share a draw with other requests
+        stream_id = self.next_stream()
+        loop = asyncio.get_running_loop()
+        picks = await loop.run_in_executor(self.executor, self.draw, list_name, count, stream_id, True)
+        self.count_batch(1, count)
+        return picks, format_stream(stream_id), 0
+
+    def start_flush(self, list_name):
+        task = asyncio.ensure_future(self.flush(list_name))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self, list_name):
+        batch = self.pending.pop(list_name)
+        total = sum(count for count, _ in batch)
+        stream_id = self.next_stream()
+        loop = asyncio.get_running_loop()
+        try:
+            picks = await loop.run_in_executor(self.executor, self.draw, list_name, total, stream_id, False)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.count_batch(len(batch), total)
+        stream = format_stream(stream_id)
+        offset = 0
+        for count, future in batch:
+            if not future.done():  # The client may have gone away meanwhile
+                future.set_result((None if picks is None else picks[offset:offset + count], stream, offset))
+            offset += count
+
+    def count_batch(self, requests, draws):
+        if self.stats is not None:
+            self.stats.batches += 1
+            self.stats.batched_requests += requests
+            self.stats.draws += draws
+
+    def draw(self, list_name, count, stream_id, distinct):
+        # Runs on a worker thread; NumPy releases the GIL for the draw itself
+        if not self.store.exists(list_name):
+            raise HttpError(404, f'No list named "{list_name}"')
+        with metrics.timer('serve.draw'):
+            decision_list = sampling_graphs.get(list_name, self.store)
+            if not decision_list:
+                return None
+            rng = self.streams.stream(*stream_id)
+            if distinct:
+                return decision_list.draw_distinct(count, rng)
+            return decision_list.draw(count, rng).tolist()
+
+
+class DecisionServer:
+    def __init__(self, store, streams=None, batch_window_ms=DEFAULT_BATCH_WINDOW_MS, max_workers=None):
+        self.store = store
+        self.streams = streams or RandomStreams()
+        # NumPy's lazy import is not thread-safe (see lazy_imports.py), and with
+        # a given seed nothing has loaded it yet: load it before the workers do
+        np.random
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='serve')
+        self.batcher = RollBatcher(store, self.streams, self.executor, batch_window_ms / 1000)
+        self.stats = self.batcher.stats = ServerStats()
+        self.routes = {
+            '/lists': self.handle_lists,
+            '/roll': self.handle_roll,
+            '/roll_many': self.handle_roll_many,
+            '/metrics': self.handle_metrics,
+        }
+        self.server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive, enough for local clients
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                length = headers.get('content-length', '0')
+                if len(parts) != 3 or not length.isdigit():
+                    await self.respond(writer, 400, {'error': 'Malformed request'}, keep_alive=False)
+                    break
+                if int(length) > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': 'Request body too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(int(length)) if int(length) else b''
+                method, target, version = parts
+                status, payload = await self.dispatch(method, target, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, body):
+        start = time.perf_counter()
+        url = urlsplit(target)
+        status = 200
+        try:
+            handler = self.routes.get(url.path)
+            if handler is None:
+                raise HttpError(404, f"Unknown path {url.path}")
+            if method not in ('GET', 'POST'):
+                raise HttpError(405, f"Method {method} not allowed")
+            payload = await handler(self.parameters(url.query, body))
+        except HttpError as error:
+            status, payload = error.status, {'error': str(error)}
+        except (OSError, ValueError) as error:
+            # e.g. an unreadable list, or lists that refer to each other in a cycle
+            status, payload = 500, {'error': str(error)}
+        except Exception as error:
+            # A bug rather than a bad list; the client still gets an answer
+            print(f"Error handling {method} {target}: {error!r}", file=sys.stderr)
+            status, payload = 500, {'error': f'Internal error: {error}'}
+        # Unknown paths are counted together, so stray requests cannot grow the stats
+        self.stats.record(url.path if url.path in self.routes else 'other', time.perf_counter() - start, status != 200)
+        return status, payload
+
+    @staticmethod
+    def parameters(query, body):
+        # {name: [value, ...]} from the query string and a JSON object body
+        params = parse_qs(query)
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise HttpError(400, 'The request body is not valid JSON')
+            if not isinstance(data, dict):
+                raise HttpError(400, 'The request body must be a JSON object')
+            for name, value in data.items():
+                params[name] = [str(item) for item in value] if isinstance(value, list) else [str(value)]
+        return params
+
+    @staticmethod
+    def list_names(params):
+        names = params.get('list')
+        if not names:
+            raise HttpError(400, 'Missing the "list" parameter')
+        return names
+
+    @staticmethod
+    def count(params):
+        try:
+            count = int(params.get('count', ['1'])[0])
+        except ValueError:
+            raise HttpError(400, '"count" must be a whole number')
+        if not 1 <= count <= MAX_COUNT:
+            raise HttpError(400, f'"count" must be between 1 and {MAX_COUNT}')
+        return count
+
+    async def handle_lists(self, params):
+        loop = asyncio.get_running_loop()
+        return {'lists': await loop.run_in_executor(self.executor, self.store.list_names)}
+
+    async def handle_roll(self, params):
+        list_name = self.list_names(params)[0]
+        picks, stream, offset = await self.batcher.roll(list_name, 1)
+        return {'list': list_name, 'result': picks[0] if picks else None,
+                'seed': self.streams.seed, 'stream': stream, 'offset': offset}
+
+    async def handle_roll_many(self, params):
+        names = self.list_names(params)
+        count = self.count(params)
+        distinct = params.get('distinct', ['0'])[0].lower() in ('1', 'true', 'yes')
+        roll = self.batcher.roll_distinct if distinct else self.batcher.roll
+        rolls = await asyncio.gather(*(roll(list_name, count) for list_name in names))
+        return {'seed': self.streams.seed, 'results': [
+            {'list': list_name, 'picks': picks or [], 'stream': stream, 'offset': offset}
+            for list_name, (picks, stream, offset) in zip(names, rolls)]}
+
+    async def handle_metrics(self, params):
+        snapshot = self.stats.snapshot()
+        if metrics.enabled:
+            snapshot.update(metrics.snapshot())
+        return snapshot
+
+
+async def serve(args):
+    store = open_list_store({'storage': args.storage, 'database': args.database}, args.lists_directory)
+    store.prepare()
+    server = DecisionServer(store, RandomStreams(args.seed), args.batch_window_ms, args.workers)
+    host, port = await server.start(args.host, args.port)
+    print(f"Serving {store} on http://{host}:{port} (seed {server.streams.seed})", file=sys.stderr)
+    async with server.server:
+        await server.server.serve_forever()
+
+
+async def fetch(reader, writer, target):
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def load_test(args):
+    # Starts a server on a free localhost port and rolls list_name from
+    # `concurrency` keep-alive connections until `requests` rolls are done
+    store = open_list_store({'storage': args.storage, 'database': args.database}, args.lists_directory)
+    server = DecisionServer(store, RandomStreams(args.seed), args.batch_window_ms, args.workers)
+    host, port = await server.start(DEFAULT_HOST, 0)
+    target = f"/roll?list={quote(args.load_test)}"
+    latencies = []
+    failures = 0
+    remaining = args.requests
+
+    async def client():
+        nonlocal remaining, failures
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                status, payload = await fetch(reader, writer, target)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    failures += 1
+                    if failures == 1:
+                        print(f"{status}: {payload.get('error')}", file=sys.stderr)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    report = server.stats.snapshot()
+    await server.close()
+    latencies = np.asarray(latencies) * 1000
+    report['client'] = {
+        'requests': len(latencies),
+        'failures': failures,
+        'concurrency': args.concurrency,
+        'requests_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_ms': dict(zip(('p50', 'p95', 'p99'), np.percentile(latencies, [50, 95, 99]).tolist())),
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='main.py --serve', description='Serve rolls of saved lists over local HTTP.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Address to listen on (default: %(default)s, this machine only)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--lists-directory', default=decision_core.DEFAULT_LISTS_DIRECTORY)
+    parser.add_argument('--storage', choices=('files', 'sqlite'), default=DEFAULT_STORAGE)
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite database, with --storage sqlite')
+    parser.add_argument('--seed', type=int, default=None, help='Session seed (default: a new one, printed on start)')
+    parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                        help='How long to gather requests for the same list into one draw (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='Threads that draw (default: one per CPU, up to 32)')
+    parser.add_argument('--timings', action='store_true', help='Also collect timings of list reads and draws for /metrics')
+    parser.add_argument('--load-test', metavar='LIST', help='Roll LIST through a temporary server and report, instead of serving')
+    parser.add_argument('--requests', type=int, default=10_000, help='Rolls for --load-test (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Connections for --load-test (default: %(default)s)')
+    args = parser.parse_args(argv)
+    metrics.enabled = args.timings
+    try:
+        if args.load_test:
+            return asyncio.run(load_test(args))
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
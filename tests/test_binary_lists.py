@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+import pytest
+
+import binary_lists
+from binary_lists import (HEADER, HEADER_SIZE, INT64_MAX, WEIGHTS_INT, WEIGHTS_FLOAT, WEIGHTS_MIXED,
+                          section_offsets, write_binary_list, open_binary_list, json_to_binary, binary_to_json)
+
+
+MIXED = [('a', 2 ** 60 + 1), ('b', 0.5), ('c', 3), ('é', 2 ** 53 + 1), ('zero', 0)]
+
+
+def round_trip(tmp_path, pairs):
+    path = str(tmp_path / 'test.dmb')
+    write_binary_list(path, pairs)
+    return open_binary_list(path)
+
+
+@pytest.mark.parametrize('pairs, weight_kind', [
+    ([('a', 1), ('b', 2 ** 62)], WEIGHTS_INT),
+    ([('a', 0.25), ('b', 1.5)], WEIGHTS_FLOAT),
+    (MIXED, WEIGHTS_MIXED),
+])
+def test_round_trip(tmp_path, pairs, weight_kind):
+    binary_list = round_trip(tmp_path, pairs)
+    assert binary_list.weight_kind == weight_kind
+    assert binary_list.to_pairs() == pairs
+    assert [binary_list.weight(i) for i in range(len(pairs))] == [weight for _, weight in pairs]
+    assert [type(binary_list.weight(i)) for i in range(len(pairs))] == [type(weight) for _, weight in pairs]
+    assert binary_list.pairs_range(1, 3) == pairs[1:3]
+
+
+def test_draws_skip_options_without_weight(tmp_path):
+    binary_list = round_trip(tmp_path, [('a', 0.5), ('zero', 0), ('b', 1)])
+    picks = set(binary_list.draw(1000, np.random.default_rng(1)).tolist())
+    assert picks == {'a', 'b'}
+
+
+def test_json_conversion_keeps_int_weights_exact(tmp_path):
+    json_path = str(tmp_path / 'test.json')
+    binary_path = str(tmp_path / 'test.dmb')
+    with open(json_path, 'w') as file:
+        json.dump(MIXED, file)
+    json_to_binary(json_path, binary_path)
+    binary_to_json(binary_path, json_path)
+    with open(json_path) as file:
+        assert [tuple(pair) for pair in json.load(file)] == MIXED
+
+
+@pytest.mark.parametrize('pairs', [
+    [('a', INT64_MAX + 1)],
+    [('a', 2 ** 62), ('b', 2 ** 62)],  # The total overflows
+    [('a', 2 ** 64), ('b', 0.5)],
+    [('a', -1)],
+    [('a', True)],
+    [(1, 1)],
+])
+def test_rejected_lists(tmp_path, pairs):
+    with pytest.raises(ValueError):
+        write_binary_list(str(tmp_path / 'test.dmb'), pairs)
+
+
+def write_version_1(path, pairs):
+    # Version 1 is version 2 without the int weights section of mixed lists
+    write_binary_list(path, pairs)
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, _, weight_kind, count, text_size = HEADER.unpack_from(data, 0)
+    _, _, _, _, ints_start, text_start = section_offsets(count, weight_kind)
+    header = HEADER.pack(magic, 1, weight_kind, count, text_size).ljust(HEADER_SIZE, b'\0')
+    with open(path, 'wb') as file:
+        file.write(header + data[HEADER_SIZE:ints_start] + data[text_start:])
+
+
+@pytest.mark.parametrize('pairs', [
+    [('a', 1), ('b', 2)],
+    [('a', 0.25), ('b', 1.5)],
+    [('a', 7), ('b', 0.5), ('c', 2 ** 40)],
+])
+def test_version_1_files(tmp_path, pairs):
+    path = str(tmp_path / 'test.dmb')
+    write_version_1(path, pairs)
+    binary_list = open_binary_list(path)
+    assert binary_list.to_pairs() == pairs
+    assert [binary_list.weight(i) for i in range(len(pairs))] == [weight for _, weight in pairs]
+
+
+def test_unknown_versions_are_rejected(tmp_path):
+    path = str(tmp_path / 'test.dmb')
+    write_binary_list(path, [('a', 1)])
+    with open(path, 'r+b') as file:
+        file.write(HEADER.pack(binary_lists.MAGIC, 99, WEIGHTS_INT, 1, 1))
+    with pytest.raises(ValueError):
+        open_binary_list(path)
@@ -0,0 +1,89 @@
+import os
+import json
+
+import pytest
+
+import decision_core
+from journal import journal_path, read_journal, append_changes, replay
+
+
+def add(*pairs):
+    return {'op': 'add', 'options': [list(pair) for pair in pairs]}
+
+
+def remove(*pairs):
+    return {'op': 'remove', 'options': [list(pair) for pair in pairs]}
+
+
+def weight(option, old, new):
+    return {'op': 'weight', 'option': option, 'old': old, 'new': new}
+
+
+def test_replay():
+    pairs = [('a', 1), ('b', 2), ('a', 1)]
+    changes = [add(('c', 3)), remove(('a', 1)), weight('b', 2, 5), weight('c', 3, 0.5)]
+    # Which of the two equal entries is removed does not matter
+    assert sorted(replay(pairs, changes)) == [('a', 1), ('b', 5), ('c', 0.5)]
+
+
+def test_replay_rejects_unknown_options_and_operations():
+    with pytest.raises(ValueError):
+        replay([('a', 1)], [remove(('a', 2))])
+    with pytest.raises(ValueError):
+        replay([('a', 1)], [weight('b', 1, 2)])
+    with pytest.raises(ValueError):
+        replay([('a', 1)], [{'op': 'rename'}])
+
+
+@pytest.fixture
+def lists_directory(tmp_path):
+    decision_core.write_list('test', [('a', 1), ('b', 2)], str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def saved_list(lists_directory):
+    return os.path.join(lists_directory, 'test.json')
+
+
+def test_read_journal(lists_directory, saved_list):
+    assert read_journal(saved_list) is None
+    append_changes(saved_list, [add(('c', 3))])
+    append_changes(saved_list, [weight('a', 1, 4)])
+    assert read_journal(saved_list) == [add(('c', 3)), weight('a', 1, 4)]
+    assert decision_core.read_list('test', lists_directory) == [('a', 4), ('b', 2), ('c', 3)]
+
+
+def test_cut_off_save_is_ignored(saved_list):
+    append_changes(saved_list, [add(('c', 3))])
+    line = json.dumps({'changes': [add(('d', 4))]}).encode('utf-8')
+    with open(journal_path(saved_list), 'ab') as file:
+        file.write(line[:len(line) // 2])
+    assert read_journal(saved_list) == [add(('c', 3))]
+
+    # The next save replaces the partial line
+    append_changes(saved_list, [add(('e', 5))])
+    assert read_journal(saved_list) == [add(('c', 3)), add(('e', 5))]
+
+
+def test_stale_journal_is_ignored(lists_directory, saved_list):
+    append_changes(saved_list, [add(('c', 3))])
+    # Replacing the snapshot behind the journal's back, as another program might
+    with open(saved_list, 'w') as file:
+        json.dump([['x', 1], ['y', 2]], file)
+    assert read_journal(saved_list) is None
+    assert decision_core.read_list('test', lists_directory) == [('x', 1), ('y', 2)]
+
+
+def test_full_save_supersedes_the_journal(lists_directory, saved_list):
+    append_changes(saved_list, [add(('c', 3))])
+    decision_core.write_list('test', [('z', 1)], lists_directory)
+    assert read_journal(saved_list) is None
+    assert decision_core.read_list('test', lists_directory) == [('z', 1)]
+
+
+def test_compaction(lists_directory, saved_list):
+    append_changes(saved_list, [add(('c', 3)), remove(('b', 2))])
+    assert decision_core.compact_list('test', lists_directory)
+    assert read_journal(saved_list) is None
+    assert decision_core.read_list('test', lists_directory) == [('a', 1), ('c', 3)]
@@ -0,0 +1,58 @@
+import pytest
+
+import option_index
+from option_store import OptionStore, build_index_from
+
+
+OPTIONS = ['Pizza', 'pasta', 'Sushi', 'Straße', 'STRASSE', 'pineapple pizza', 'Café', 'a', 'ab', '']
+QUERIES = ['p', 'pi', 'piz', 'PIZZA', 'izz', 'zza p', 'strasse', 'ß', 'café', 'fé', 'a', 'x', 'ssu']
+
+
+def matching(store, query):
+    # What the filter shows: the options matching query, by scanning
+    return sorted(store.entries[entry_id][0] for entry_id in store.search_entries(store.entries, query))
+
+
+def indexed(store, query):
+    return sorted(store.entries[entry_id][0] for entry_id in store.search(query))
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_index_finds_what_a_scan_finds(query):
+    store = OptionStore([(option, 1) for option in OPTIONS])
+    store.build_index()
+    assert indexed(store, query) == matching(store, query)
+
+
+def test_short_queries_match_the_start_only():
+    store = OptionStore([(option, 1) for option in OPTIONS])
+    store.build_index()
+    assert indexed(store, 'pi') == ['Pizza', 'pineapple pizza']
+    assert indexed(store, 'pa') == ['pasta']
+    assert indexed(store, 'zza') == ['Pizza', 'pineapple pizza']
+
+
+def test_edits_after_the_build(monkeypatch):
+    # Small segments and delta, so the build and the freeze of added options both split
+    monkeypatch.setattr(option_index, 'SEGMENT_SIZE', 3)
+    monkeypatch.setattr(option_index, 'DELTA_LIMIT', 4)
+    store = OptionStore([(option, 1) for option in OPTIONS])
+    generation, next_id, entries = store.index_snapshot()
+    index = build_index_from(entries)
+    # Added between the snapshot and the attach, then after it
+    store.add('pizza bianca', 1)
+    assert store.attach_index(index, generation, next_id)
+    for i in range(10):
+        store.add(f'pizza {i}', 1)
+    store.remove_rows([store.pairs().index(('Pizza', 1))])
+    for query in QUERIES + ['bianca', 'pizza 7']:
+        assert indexed(store, query) == matching(store, query)
+    assert 'Pizza' not in indexed(store, 'pizza')
+
+
+def test_index_of_replaced_entries_is_not_attached():
+    store = OptionStore([(option, 1) for option in OPTIONS])
+    generation, next_id, entries = store.index_snapshot()
+    store.reset([('other', 1)])
+    assert not store.attach_index(build_index_from(entries), generation, next_id)
+    assert indexed(store, 'pizza') == []
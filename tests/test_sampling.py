@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+import sampling
+from sampling import AliasSampler, FenwickSampler, FREE_SLOT, sample_without_replacement
+
+
+def weights_of(sampler):
+    return {option: weight for option, weight in sampler.to_pairs()}
+
+
+def test_insert_remove_update():
+    sampler = FenwickSampler([('a', 1), ('b', 2), ('c', 3)])
+    assert len(sampler) == 3
+    assert sampler.tree.total() == 6
+
+    sampler.remove(1)
+    assert sampler.option(1) is FREE_SLOT
+    assert weights_of(sampler) == {'a': 1, 'c': 3}
+    assert sampler.tree.total() == 4
+
+    # Removed slots are reused
+    assert sampler.insert('d', 5) == 1
+    assert sampler.insert('e', 1) == 3
+    sampler.update(0, 4)
+    assert weights_of(sampler) == {'a': 4, 'd': 5, 'c': 3, 'e': 1}
+    assert sampler.tree.total() == 13
+    assert list(sampler.weights) == [4, 5, 3, 1]
+
+
+def test_negative_weights_are_rejected():
+    with pytest.raises(ValueError):
+        FenwickSampler([('a', -1)])
+    sampler = FenwickSampler([('a', 1)])
+    with pytest.raises(ValueError):
+        sampler.insert('b', -1)
+    with pytest.raises(ValueError):
+        sampler.update(0, -1)
+
+
+def test_draws_follow_edits():
+    sampler = FenwickSampler([('a', 1), ('b', 1), ('c', 1)])
+    sampler.remove(0)
+    sampler.update(1, 3)
+    rng = np.random.default_rng(1)
+    # Batches above FENWICK_BATCH_THRESHOLD search the weights rather than the tree
+    for k in (50, 20_000):
+        picks = sampler.draw(k, rng).tolist()
+        assert 'a' not in picks
+        assert picks.count('b') / k == pytest.approx(0.75, abs=0.1)
+
+
+def test_len_counts_only_options_with_weight():
+    sampler = FenwickSampler([('a', 1), ('z', 0)])
+    assert len(sampler) == 2
+    sampler.update(0, 0)
+    assert len(sampler) == 0
+    sampler.update(0, 2)
+    assert len(sampler) == 2
+    sampler.remove(0)
+    assert len(sampler) == 0
+
+
+def test_float_round_off_after_removals():
+    # Removing the float weights leaves about 2.8e-17 in the tree
+    sampler = FenwickSampler([('a', 0.1), ('b', 0.1), ('c', 0.1), ('z', 0)])
+    for slot in range(3):
+        sampler.remove(slot)
+    assert sampler.tree.total() != 0
+    assert len(sampler) == 0
+    assert sampler.draw_one() is None
+    assert len(sampler.draw(100)) == 0
+    assert len(sampler.draw_indices(100)) == 0
+    with pytest.raises(ValueError):
+        sampler.draw_slot()
+
+
+def test_round_off_crumbs_are_never_drawn():
+    # The crumbs left by the removals outweigh the only option left
+    sampler = FenwickSampler([('a', 0.1), ('b', 0.1), ('c', 0.1)])
+    sampler.insert('tiny', 1e-300)
+    for slot in range(3):
+        sampler.remove(slot)
+    rng = np.random.default_rng(2)
+    assert sampler.draw_one(rng) == 'tiny'
+    for k in (10, 1000):
+        assert set(sampler.draw(k, rng).tolist()) == {'tiny'}
+
+
+def test_batches_skip_removed_slots():
+    sampler = FenwickSampler([(str(i), 0.1) for i in range(1000)])
+    for slot in range(0, 1000, 2):
+        sampler.remove(slot)
+    picks = sampler.draw_indices(100_000, np.random.default_rng(3))
+    assert (picks % 2 == 1).all()
+
+
+def test_alias_sampler_follows_the_weights():
+    sampler = AliasSampler([('a', 1), ('b', 0), ('c', 3), ('d', 0.5), ('e', 5.5)])
+    indices = sampler.draw_indices(200_000, np.random.default_rng(4))
+    shares = np.bincount(indices, minlength=5) / len(indices)
+    assert shares == pytest.approx([0.1, 0, 0.3, 0.05, 0.55], abs=0.01)
+    assert shares[1] == 0
+
+
+def test_alias_sampler_without_weight():
+    for pairs in ([], [('a', 0), ('b', 0)]):
+        sampler = AliasSampler(pairs)
+        assert len(sampler) == 0
+        assert sampler.draw_one() is None
+        assert len(sampler.draw(5)) == 0
+    with pytest.raises(ValueError):
+        AliasSampler([('a', 1), ('b', -1)])
+
+
+def test_distinct_picks():
+    weights = np.array([1, 0, 2, 0.5, 0, 3])
+    rng = np.random.default_rng(5)
+    for k in range(1, 7):
+        picks = sample_without_replacement(weights, k, rng)
+        assert len(picks) == min(k, 4)
+        assert len(set(picks.tolist())) == len(picks)
+        assert not set(picks.tolist()) & {1, 4}
+    assert len(sample_without_replacement(weights, 0, rng)) == 0
+
+
+def test_first_distinct_pick_follows_the_weights():
+    weights = np.array([1.0, 2.0, 7.0])
+    rng = np.random.default_rng(6)
+    firsts = [sample_without_replacement(weights, 2, rng)[0] for _ in range(20_000)]
+    assert np.bincount(firsts, minlength=3) / len(firsts) == pytest.approx([0.1, 0.2, 0.7], abs=0.015)
+
+
+def test_distinct_picks_do_not_depend_on_the_chunk_size(monkeypatch):
+    weights = np.random.default_rng(7).random(1000)
+    weights[::7] = 0
+    whole = sample_without_replacement(weights, 50, np.random.default_rng(8))
+    monkeypatch.setattr(sampling, 'DISTINCT_CHUNK_SIZE', 64)
+    chunked = sample_without_replacement(weights, 50, np.random.default_rng(8))
+    assert whole.tolist() == chunked.tolist()
+
+
+def test_distinct_draws_of_an_edited_sampler():
+    sampler = FenwickSampler([(str(i), 1) for i in range(10)])
+    for slot in range(0, 10, 2):
+        sampler.remove(slot)
+    picks = sample_without_replacement(sampler.weights, 10, np.random.default_rng(9))
+    assert sorted(picks.tolist()) == [1, 3, 5, 7, 9]
@@ -0,0 +1,116 @@
+import os
+import re
+import sys
+import json
+import asyncio
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import decision_core
+from list_store import FileListStore
+from rng import RandomStreams
+from server import DecisionServer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LISTS = 8
+OPTIONS = [[f'option {i}', i + 1] for i in range(50)]
+
+
+@pytest.fixture
+def lists_directory(tmp_path):
+    for i in range(LISTS):
+        decision_core.write_list(f'list{i}', OPTIONS, str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def seeded_server(lists_directory):
+    # A process of its own: NumPy must not be loaded yet when the first requests come in
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py'), '--serve', '--seed', '7',
+                                '--port', '0', '--lists-directory', lists_directory],
+                               stderr=subprocess.PIPE, text=True)
+    try:
+        match = re.search(r'(http://\S+) \(seed 7\)', process.stderr.readline())
+        assert match, 'The server did not start'
+        yield match.group(1)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_concurrent_first_requests_to_a_seeded_server(seeded_server):
+    urls = [f'{seeded_server}/roll?list=list{i}' for i in range(LISTS)]
+    with ThreadPoolExecutor(max_workers=LISTS) as executor:
+        responses = list(executor.map(get, urls))
+    options = {option for option, _ in OPTIONS}
+    for status, payload in responses:
+        assert status == 200, payload
+        assert payload['seed'] == 7
+        assert payload['result'] in options
+
+    status, payload = get(f'{seeded_server}/roll?list=missing')
+    assert status == 404
+    status, payload = get(f'{seeded_server}/metrics')
+    assert payload['requests']['/roll'] == LISTS + 1
+    assert payload['errors'] == 1
+
+
+def dispatch(server, target, method='GET', body=b''):
+    async def run():
+        try:
+            return await server.dispatch(method, target, body)
+        finally:
+            server.executor.shutdown(wait=True)
+    return asyncio.run(run())
+
+
+def test_distinct_picks(lists_directory):
+    server = DecisionServer(FileListStore(lists_directory), RandomStreams(7))
+    status, payload = dispatch(server, '/roll_many?list=list0&list=list1&count=50&distinct=1')
+    assert status == 200
+    for result in payload['results']:
+        assert sorted(result['picks']) == sorted(option for option, _ in OPTIONS)
+
+
+def test_post_body(lists_directory):
+    server = DecisionServer(FileListStore(lists_directory), RandomStreams(7))
+    body = json.dumps({'list': ['list0', 'list1'], 'count': 3}).encode('utf-8')
+    status, payload = dispatch(server, '/roll_many', 'POST', body)
+    assert status == 200
+    assert [len(result['picks']) for result in payload['results']] == [3, 3]
+
+
+@pytest.mark.parametrize('target, status', [
+    ('/nowhere', 404),
+    ('/roll', 400),
+    ('/roll_many?list=list0&count=0', 400),
+    ('/roll_many?list=list0&count=x', 400),
+])
+def test_bad_requests(lists_directory, target, status):
+    server = DecisionServer(FileListStore(lists_directory))
+    assert dispatch(server, target)[0] == status
+
+
+def test_unexpected_errors_are_answered(lists_directory):
+    server = DecisionServer(FileListStore(lists_directory))
+
+    async def broken(params):
+        raise KeyError('broken')
+    server.routes['/roll'] = broken
+    status, payload = dispatch(server, '/roll?list=list0')
+    assert status == 500
+    assert 'broken' in payload['error']
+    assert server.stats.snapshot()['errors'] == 1